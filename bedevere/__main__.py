@@ -1,19 +1,44 @@
+import argparse
 import asyncio
 import importlib
 import os
 import sys
+import time
 import traceback
 
 import aiohttp
-import cachetools
 import sentry_sdk
 from aiohttp import web
-from gidgethub import aiohttp as gh_aiohttp
-from gidgethub import apps, routing, sansio
+from gidgethub import routing, sansio
 
-from . import backport, close_pr, filepaths, gh_issue, news, stage
+from . import (  # isort: skip
+    backport,
+    caches,
+    catchup,
+    client,
+    close_pr,
+    deliveries,
+    filepaths,
+    gh_issue,
+    journal,
+    metrics,
+    mutations,
+    news,
+    ordering,
+    prstate,
+    ratelimit,
+    reconcile,
+    retry,
+    snapshot,
+    stage,
+    tokens,
+    tracing,
+    util,
+    warmstart,
+    workers,
+)
 
-router = routing.Router(
+router = metrics.Router(
     backport.router,
     gh_issue.router,
     close_pr.router,
@@ -21,9 +46,197 @@ router = routing.Router(
     news.router,
     stage.router,
 )
-cache = cachetools.LRUCache(maxsize=500)
+# Seconds an ETag is kept for; a stale one only costs a full request.
+ETAG_TTL = 24 * 60 * 60
+cache = caches.Cache("github_etags", maxsize=500, ttl=ETAG_TTL, warm_start=True)
+# Seconds to wait before handling an event.
+CONSISTENCY_DELAY = 1
+# Seconds to wait before each attempt at handling a failed delivery again.
+RETRY_DELAYS = (10, 60, 300)
+
+RETRIED = metrics.Counter(
+    "bedevere_retried_deliveries_total",
+    "Failed deliveries to be handled again.",
+)
+
+sentry_sdk.init(os.environ.get("SENTRY_DSN"), traces_sample_rate=tracing.sample_rate())
+
+
+async def handle(event, gh, session):
+    """Dispatch the event to the handlers, then make the writes they planned."""
+    # Give GitHub some time to reach internal consistency.
+    await asyncio.sleep(CONSISTENCY_DELAY)
+    plan = mutations.Plan()
+    await router.dispatch(
+        event, gh, session=session, snapshots=snapshot.Loader(gh), plan=plan
+    )
+    await plan.apply(gh)
+
+
+def _accept(event):
+    """Take a delivery other than a ping on.
+
+    Return the response for GitHub if the delivery isn't to be handled.
+    """
+    metrics.observe_delivery(event)
+    if not deliveries.SEEN.add(event.delivery_id):
+        deliveries.DUPLICATES.inc()
+        print("Already handled", event.delivery_id, file=sys.stderr)
+        return web.Response(status=200)
+    if not event.data.get("installation"):
+        deliveries.SEEN.discard(event.delivery_id)
+        return web.Response(text="Must be installed as an App.", status=400)
+    journal.JOURNAL.append(event)
+    prstate.MIRROR.update(event)
+    return None
+
+
+async def _handle(event, attempt=0):
+    """Handle an accepted delivery in its turn.
+
+    A label change superseded by a later one is finished along with it, so a
+    restart during the debounce doesn't lose it. A delivery which
+    fails is left unfinished in the journal and handled again later (see
+    RETRY_DELAYS).
+    """
+    key = ordering.key(event)
+    head_sha = ordering.head_sha(event)
+    if head_sha is not None:
+        ordering.HEADS.pushed(key, head_sha)
+    burst = None
+    if key is not None:
+        if ordering.is_label_change(event):
+            burst = ordering.LABEL_BURSTS.arrived(key, event)
+            arrived_at = time.monotonic()
+        else:
+            ordering.LABEL_BURSTS.close(key)
+    # Deliveries for the same pull request are handled in arrival order.
+    async with ordering.EXECUTOR.turn(key):
+        finished = [event]
+        if burst is not None:
+            if not await ordering.LABEL_BURSTS.settle(key, burst, event, arrived_at):
+                # Superseded by a later label change.
+                return
+            finished = burst
+        try:
+            await _handle_delivery(event, key, head_sha)
+        except Exception:
+            for each in finished:
+                _retry(each, attempt)
+            raise
+        for each in finished:
+            journal.JOURNAL.done(each.delivery_id)
+
+
+def _retry(event, attempt):
+    """Handle a failed delivery again later, unless it's failed too often."""
+    if attempt >= len(RETRY_DELAYS):
+        print(
+            f"Giving up on {event.delivery_id} until the next restart",
+            file=sys.stderr,
+        )
+        # Let it be redelivered by hand meanwhile.
+        deliveries.SEEN.discard(event.delivery_id)
+        return
+    RETRIED.inc()
+    task = asyncio.create_task(_handle_later(event, attempt + 1))
+    _retrying.add(task)
+    task.add_done_callback(_retrying.discard)
+
+
+async def _handle_later(event, attempt):
+    await asyncio.sleep(RETRY_DELAYS[attempt - 1])
+    try:
+        await _handle(event, attempt)
+    except Exception:
+        print(f"Handling {event.delivery_id} again failed", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
 
-sentry_sdk.init(os.environ.get("SENTRY_DSN"))
+
+async def process(event):
+    """Handle a delivery other than a ping, returning the response for GitHub."""
+    response = _accept(event)
+    if response is None:
+        await _handle(event)
+        response = web.Response(status=200)
+    return response
+
+
+# The tasks waiting to handle failed deliveries again.
+_retrying: set[asyncio.Task] = set()
+
+# Delivery ID -> the task handling it, for deliveries acknowledged already.
+_handling: dict[str, asyncio.Task] = {}
+
+
+async def _handle_in_background(event):
+    try:
+        await _handle(event)
+    except Exception:
+        print("Handling", event.delivery_id, "failed", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+    finally:
+        del _handling[event.delivery_id]
+
+
+def acknowledge(event):
+    """Take a delivery on, handling it in the background.
+
+    Return the response for GitHub, which doesn't wait for the delivery to be
+    handled: GitHub gives up after 10 seconds, while a delivery may wait its
+    turn and for the labels to settle (see bedevere.ordering). Once journaled,
+    a delivery cut short is handled again on startup (see bedevere.journal).
+    """
+    response = _accept(event)
+    if response is None:
+        # The task gets a copy of the request's scope, for the delivery's
+        # transaction to carry on its trace (see bedevere.tracing).
+        with sentry_sdk.isolation_scope():
+            task = asyncio.create_task(_handle_in_background(event))
+        _handling[event.delivery_id] = task
+        response = web.Response(status=200)
+    return response
+
+
+async def handled(delivery_id=None):
+    """Wait for the delivery, or every delivery, being handled in the background."""
+    if delivery_id is None:
+        tasks = list(_handling.values())
+    else:
+        tasks = [_handling[delivery_id]] if delivery_id in _handling else []
+    await asyncio.gather(*tasks)
+
+
+async def _handle_delivery(event, key, head_sha):
+    if ordering.HEADS.superseded(key, head_sha):
+        ordering.SKIPPED.inc()
+        print(f"Skipping delivery for {head_sha}: superseded", file=sys.stderr)
+        return
+    with tracing.delivery(event):
+        async with aiohttp.ClientSession() as session:
+            gh = client.from_environ(
+                session,
+                cache=cache,
+                scheduler=ratelimit.SCHEDULER,
+                write_limiters=retry.WRITE_LIMITERS,
+            )
+            gh.observers.append(metrics.observe_request)
+            installation_id = event.data["installation"]["id"]
+            gh.oauth_token = await tokens.installation_token(gh, installation_id)
+            gh.installation_id = installation_id
+
+            metrics.DELIVERIES_IN_PROGRESS.inc()
+            try:
+                await ordering.HEADS.run(key, head_sha, handle(event, gh, session))
+            finally:
+                metrics.DELIVERIES_IN_PROGRESS.dec()
+    try:
+        print("GH requests remaining:", gh.rate_limit.remaining)
+        metrics.RATE_LIMIT_REMAINING.labels(installation_id).set(
+            gh.rate_limit.remaining
+        )
+    except AttributeError:
+        pass
 
 
 async def main(request):
@@ -34,33 +247,85 @@ async def main(request):
         print("GH delivery ID", event.delivery_id, file=sys.stderr)
         if event.event == "ping":
             return web.Response(status=200)
-
-        async with aiohttp.ClientSession() as session:
-            gh = gh_aiohttp.GitHubAPI(session, "python/bedevere", cache=cache)
-            if not event.data.get("installation"):
-                return web.Response(text="Must be installed as an App.", status=400)
-            installation_id = event.data["installation"]["id"]
-            installation_access_token = await apps.get_installation_access_token(
-                gh,
-                installation_id=installation_id,
-                app_id=os.environ.get("GH_APP_ID"),
-                private_key=os.environ.get("GH_PRIVATE_KEY"),
-            )
-            gh.oauth_token = installation_access_token["token"]
-
-            # Give GitHub some time to reach internal consistency.
-            await asyncio.sleep(1)
-            await router.dispatch(event, gh, session=session)
-        try:
-            print("GH requests remaining:", gh.rate_limit.remaining)
-        except AttributeError:
-            pass
-        return web.Response(status=200)
+        return acknowledge(event)
     except Exception as exc:
         traceback.print_exc(file=sys.stderr)
         return web.Response(status=500)
 
 
+async def _replay(event):
+    # Journaled already, and perhaps remembered as seen before the restart.
+    deliveries.SEEN.add(event.delivery_id)
+    prstate.MIRROR.update(event)
+    await _handle(event)
+
+
+async def replay():
+    """Handle the deliveries a restart cut short."""
+    events = journal.JOURNAL.claim()
+    if events:
+        print(f"Replaying {len(events)} deliveries", file=sys.stderr)
+    journal.REPLAYED.inc(len(events))
+    results = await asyncio.gather(
+        *(_replay(event) for event in events), return_exceptions=True
+    )
+    for event, result in zip(events, results):
+        if isinstance(result, Exception):
+            print(f"Replaying {event.delivery_id} failed: {result!r}", file=sys.stderr)
+
+
+async def catch_up(window, concurrency=catchup.CONCURRENCY):
+    """Handle the deliveries which failed in the last window seconds."""
+    since = time.time() - window
+    try:
+        await catchup.catch_up(process, since=since, concurrency=concurrency)
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+
+
+async def warm_up():
+    """Get what the first deliveries will need before they arrive."""
+    try:
+        await warmstart.warm_up()
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+
+
+async def _background(app):
+    # With several workers, only the first one replays, catches up, warms up
+    # and saves the caches, so none of it happens more than once.
+    primary = app[PRIMARY]
+    warm_start_path = warmstart.path()
+    if warm_start_path:
+        warmstart.load(warm_start_path)
+    tasks = []
+    if primary:
+        tasks.append(asyncio.create_task(replay()))
+        tasks.append(asyncio.create_task(journal.compact_periodically(journal.JOURNAL)))
+        if warm_start_path:
+            tasks.append(asyncio.create_task(warm_up()))
+        if window := catchup.startup_window():
+            tasks.append(asyncio.create_task(catch_up(window)))
+    workers_metrics = app.get(metrics.WORKERS)
+    if workers_metrics is not None:
+        tasks.append(asyncio.create_task(workers_metrics.publish_periodically()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Finish the deliveries acknowledged already. Those waiting to be handled
+    # again are left unfinished in the journal, to be replayed.
+    await handled()
+    await util.issue_links_written()
+    for task in _retrying:
+        task.cancel()
+    await asyncio.gather(*_retrying, return_exceptions=True)
+    if workers_metrics is not None:
+        workers_metrics.publish()
+    if warm_start_path and primary:
+        warmstart.save(warm_start_path)
+
+
 @router.register("installation", action="created")
 async def repo_installation_added(event, gh, *args, **kwargs):
     print(
@@ -68,10 +333,85 @@ async def repo_installation_added(event, gh, *args, **kwargs):
     )
 
 
-if __name__ == "__main__":  # pragma: no cover
+PRIMARY = web.AppKey("primary", bool)
+
+
+def create_app(*, primary=True, workers_metrics=None):
+    """Create the aiohttp application serving the webhook endpoint.
+
+    Only the primary worker runs the background tasks. Workers publish their
+    metrics with workers_metrics, if given.
+    """
     app = web.Application()
+    app[PRIMARY] = primary
+    if workers_metrics is not None:
+        app[metrics.WORKERS] = workers_metrics
     app.router.add_post("/", main)
+    app.router.add_get("/metrics", metrics.handler)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bedevere")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes serving webhooks (default: %(default)s)",
+    )
+    commands = parser.add_subparsers(dest="command")
+    catch_up_parser = commands.add_parser(
+        "catch-up", help="handle the deliveries GitHub failed to make"
+    )
+    catch_up_parser.add_argument(
+        "--minutes",
+        type=float,
+        default=catchup.SINCE / 60,
+        help="how far back to look (default: %(default)s)",
+    )
+    catch_up_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=catchup.CONCURRENCY,
+        help="deliveries to handle at once (default: %(default)s)",
+    )
+    reconcile_parser = commands.add_parser(
+        "reconcile",
+        help="bring the labels and statuses of open pull requests up to date",
+    )
+    reconcile_parser.add_argument(
+        "--dry-run", action="store_true", help="report the changes without making them"
+    )
+    reconcile_parser.add_argument(
+        "--checkpoint", metavar="FILE", help="save progress to, and resume from, FILE"
+    )
+    reconcile_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=reconcile.CONCURRENCY,
+        help="pull requests to check at once (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    args = parse_args()
+    if args.command == "catch-up":
+        asyncio.run(catch_up(args.minutes * 60, args.concurrency))
+        sys.exit()
+    if args.command == "reconcile":
+        progress = asyncio.run(
+            reconcile.reconcile(
+                dry_run=args.dry_run,
+                concurrency=args.concurrency,
+                checkpoint=args.checkpoint,
+            )
+        )
+        sys.exit(1 if progress.failed else 0)
     port = os.environ.get("PORT")
     if port is not None:
         port = int(port)
-    web.run_app(app, port=port)
+    if args.workers > 1:
+        sys.exit(workers.serve(create_app, port=port, workers=args.workers))
+    web.run_app(create_app(), port=port)
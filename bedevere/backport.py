@@ -5,7 +5,7 @@ import re
 
 import gidgethub.routing
 
-from . import util
+from . import mutations, util
 
 create_status = functools.partial(util.create_status, "bedevere/maintenance-branch-pr")
 
@@ -30,27 +30,30 @@ BACKPORT_TITLE_DEVGUIDE_URL = (
 )
 
 
-async def _copy_over_labels(gh, original_issue, backport_issue):
+async def _copy_over_labels(gh, original_issue, backport_issue, plan=None):
     """Copy over relevant labels from the original PR to the backport PR."""
     label_prefixes = "skip", "type", "sprint", "topic"
     labels = list(
         filter(lambda x: x.startswith(label_prefixes), util.labels(original_issue))
     )
     if labels:
-        await gh.post(backport_issue["labels_url"], data=labels)
+        await mutations.writer(gh, plan).add_labels(backport_issue, labels)
 
 
-async def _remove_backport_label(gh, original_issue, branch, backport_pr_number):
+async def _remove_backport_label(
+    gh, original_issue, branch, backport_pr_number, plan=None
+):
     """Remove the appropriate "backport to" label on the original PR.
 
     Also leave a comment on the original PR referencing the backport PR.
     """
     backport_label = BACKPORT_LABEL.format(branch=branch)
     message = MESSAGE_TEMPLATE.format(branch=branch, pr=backport_pr_number)
-    await gh.post(original_issue["comments_url"], data={"body": message})
+    writes = mutations.writer(gh, plan)
+    await writes.add_comment(original_issue["comments_url"], message)
     if backport_label not in util.labels(original_issue):
         return
-    await gh.delete(original_issue["labels_url"], {"name": backport_label})
+    await writes.remove_label(original_issue, backport_label)
 
 
 @router.register("pull_request", action="opened")
@@ -69,10 +72,11 @@ async def manage_labels(event, gh, *args, **kwargs):
     original_issue = await gh.getitem(
         event.data["repository"]["issues_url"], {"number": original_pr_number}
     )
-    await _remove_backport_label(gh, original_issue, branch, event.data["number"])
+    plan = kwargs.get("plan")
+    await _remove_backport_label(gh, original_issue, branch, event.data["number"], plan)
 
-    backport_issue = await util.issue_for_PR(gh, pull_request)
-    await _copy_over_labels(gh, original_issue, backport_issue)
+    backport_issue = await util.issue_for_PR(gh, pull_request, kwargs.get("snapshots"))
+    await _copy_over_labels(gh, original_issue, backport_issue, plan)
 
 
 def is_maintenance_branch(ref):
@@ -123,7 +127,7 @@ async def validate_maintenance_branch_pr(event, gh, *args, **kwargs):
         status = create_status(
             util.StatusState.SUCCESS, description="Valid maintenance branch PR title."
         )
-    await util.post_status(gh, event, status)
+    await util.post_status(gh, event, status, kwargs.get("plan"))
 
 
 @router.register("create", ref_type="branch")
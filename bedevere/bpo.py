@@ -0,0 +1,160 @@
+"""Offline index of the issue numbers that exist on bugs.python.org.
+
+bugs.python.org is a frozen, read-only archive, so the set of valid issue
+numbers never changes. It is generated at build time (bin/post_compile, which
+Heroku runs after installing the dependencies) with::
+
+    python -m bedevere.bpo [SOURCE [OUTPUT]]
+
+where SOURCE is a path or URL to a list of issue numbers, by default the CSV
+export of the archive's ``id`` column at EXPORT_URL. The index is stored as a
+sorted array of inclusive ``(start, end)`` ranges, which keeps the archive's
+~50,000 mostly contiguous issue numbers down to a few kilobytes.
+
+An export with fewer than BPO_INDEX_MINIMUM issue numbers (MINIMUM_ISSUES by
+default) is taken to be truncated: no index is written for it and the command
+fails, rather than leave every bpo- title without an issue.
+"""
+
+import array
+import bisect
+import os
+import pathlib
+import re
+import struct
+import sys
+import urllib.request
+from collections.abc import Iterable, Iterator
+
+DEFAULT_INDEX_PATH = pathlib.Path(__file__).with_name("bpo-issues.idx")
+# Roundup's CSV export of every issue's number.
+EXPORT_URL = "https://bugs.python.org/issue?@action=export_csv&@columns=id&@sort=id"
+MAGIC = b"BPOIDX1\0"
+# Magic bytes followed by the number of ranges, then the range starts and the
+# range ends as little-endian unsigned 32-bit integers.
+HEADER = struct.Struct("<8sI")
+NUMBER_RE = re.compile(rb"^\s*\"?(\d+)\"?\s*(?:,|$)")
+# The archive holds about 50,000 issues.
+MINIMUM_ISSUES = 40_000
+
+
+def ranges_from_numbers(numbers: Iterable[int]) -> list[tuple[int, int]]:
+    """Collapse issue numbers into sorted, inclusive (start, end) ranges."""
+    ranges: list[tuple[int, int]] = []
+    for number in sorted(set(numbers)):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1] = ranges[-1][0], number
+        else:
+            ranges.append((number, number))
+    return ranges
+
+
+def write_index(
+    numbers: Iterable[int], path: os.PathLike | str, *, minimum: int = 1
+) -> int:
+    """Write the index for the issue numbers, returning the number of ranges.
+
+    Raise ValueError without writing anything if there are fewer than minimum
+    issue numbers.
+    """
+    numbers = set(numbers)
+    if len(numbers) < minimum:
+        raise ValueError(
+            f"Refusing to write an index of {len(numbers)} issue numbers;"
+            f" expected at least {minimum}"
+        )
+    ranges = ranges_from_numbers(numbers)
+    starts = array.array("I", (start for start, _ in ranges))
+    ends = array.array("I", (end for _, end in ranges))
+    if sys.byteorder != "little":  # pragma: no cover
+        starts.byteswap()
+        ends.byteswap()
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(ranges)))
+        file.write(starts.tobytes())
+        file.write(ends.tobytes())
+    return len(ranges)
+
+
+def read_numbers(source: str) -> Iterator[int]:
+    """Read issue numbers from a path or URL, one per line.
+
+    Only the first column is considered, so CSV exports work as-is, and lines
+    which don't start with a number (like headers) are skipped.
+    """
+    if "://" in source:
+        file = urllib.request.urlopen(source)
+    else:
+        file = open(source, "rb")
+    with file:
+        for line in file:
+            if match := NUMBER_RE.match(line):
+                yield int(match.group(1))
+
+
+class BPOIndex:
+    """Lazily loaded set of valid bugs.python.org issue numbers."""
+
+    def __init__(self, path: os.PathLike | str) -> None:
+        self.path = path
+        self._starts: array.array | None = None
+        self._ends: array.array | None = None
+        self._loaded = False
+
+    def _load(self) -> None:
+        self._loaded = True
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        magic, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a bpo issue index")
+        offset = HEADER.size
+        size = count * 4
+        starts = array.array("I", data[offset : offset + size])
+        ends = array.array("I", data[offset + size : offset + 2 * size])
+        if sys.byteorder != "little":  # pragma: no cover
+            starts.byteswap()
+            ends.byteswap()
+        self._starts, self._ends = starts, ends
+
+    @property
+    def available(self) -> bool:
+        """Whether the index file could be loaded."""
+        if not self._loaded:
+            self._load()
+        return self._starts is not None
+
+    def lookup(self, issue_number: int) -> bool | None:
+        """Return whether the issue exists, or None if the index is unavailable."""
+        if not self.available:
+            return None
+        assert self._starts is not None and self._ends is not None
+        position = bisect.bisect_right(self._starts, issue_number) - 1
+        return position >= 0 and issue_number <= self._ends[position]
+
+
+INDEX = BPOIndex(os.environ.get("BPO_INDEX_PATH", DEFAULT_INDEX_PATH))
+# Only ask bugs.python.org itself about numbers missing from the index when
+# explicitly requested.
+HEAD_FALLBACK = bool(os.environ.get("BPO_HEAD_FALLBACK"))
+
+
+def main(argv: list[str]) -> None:  # pragma: no cover
+    if len(argv) > 2:
+        sys.exit("usage: python -m bedevere.bpo [SOURCE [OUTPUT]]")
+    source = argv[0] if argv else EXPORT_URL
+    output = argv[1] if len(argv) == 2 else DEFAULT_INDEX_PATH
+    minimum = int(os.environ.get("BPO_INDEX_MINIMUM", MINIMUM_ISSUES))
+    try:
+        count = write_index(read_numbers(source), output, minimum=minimum)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(os.EX_DATAERR)
+    print(f"Wrote {count} ranges to {output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,466 @@
+"""Caches which outlive the process, or are shared with other processes.
+
+cachetools caches time their entries with time.monotonic(), which means
+nothing to another process. A Cache remembers when each entry was stored by
+the wall clock instead, and keeps its entries in a backend:
+
+* Memory, the default, keeps them in an LRU cache in the process. Caches
+  created with ``warm_start=True`` are saved when bedevere stops and loaded
+  when it starts again (see bedevere.warmstart), each entry dropped if it's
+  older than the cache's TTL by then.
+* Redis keeps them in a server speaking the Redis protocol, shared by every
+  process pointed at it, so several workers (or dynos) share their hits
+  instead of each warming its own caches. Set CACHE_URL to
+  ``redis://[:password@]host[:port][/db]`` to use it. Entries expire with the
+  cache's TTL; how many are kept is up to the server's ``maxmemory`` policy.
+  Entries used in the last LOCAL_TTL seconds are kept in the process too, so
+  only lookups which miss there go to the server.
+
+Redis is spoken over a blocking socket, on a thread of each cache's own, so
+the event loop doesn't wait for the server. Code which can await looks entries
+up with Cache.fetch(), which goes to the server if the entry isn't kept in the
+process; lookups which can't await (gidgethub looks ETags up synchronously)
+only see the entries kept in the process. Stores and deletions are made in the
+process straight away and on the server in the background. When the server
+can't be reached, lookups miss and stores are dropped rather than failing the
+delivery, and it's left be for REDIS_RETRY_AFTER seconds rather than trying it
+for every lookup meanwhile.
+
+Keys and values must survive a round trip through JSON, except that tuple keys
+are turned back into tuples.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+from collections.abc import Callable, Hashable, Iterator, MutableMapping
+from typing import Any, Protocol
+
+import cachetools
+
+from . import metrics
+
+# Seconds to wait for the Redis server, which should be close by.
+REDIS_TIMEOUT = 0.05
+# Seconds to leave the Redis server be after failing to reach it.
+REDIS_RETRY_AFTER = 30.0
+# Seconds entries from a shared backend are kept in the process too.
+LOCAL_TTL = 5.0
+
+BACKEND_ERRORS = metrics.Counter(
+    "bedevere_cache_backend_errors_total",
+    "Cache operations which failed because the backend couldn't be reached.",
+    ("cache",),
+)
+
+# Name -> the caches saved and loaded by bedevere.warmstart.
+WARM_START: dict[str, "Cache"] = {}
+
+
+def _key(key: Any) -> Hashable:
+    # JSON has no tuples, so tuple keys come back as lists.
+    return tuple(_key(part) for part in key) if isinstance(key, list) else key
+
+
+def _failed(name: str, exc: Exception) -> None:
+    BACKEND_ERRORS.labels(name).inc()
+    if not isinstance(exc, RedisUnavailable):
+        # Reported when the server is tried, not for each skipped lookup.
+        print(f"Cache {name!r} unavailable: {exc!r}", file=sys.stderr)
+
+
+class Backend(Protocol):
+    """Where a Cache keeps its entries, as (time.time() when stored, value)."""
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None: ...
+
+    async def fetch(self, key: Hashable) -> tuple[float, Any] | None: ...
+
+    def set(self, key: Hashable, entry: tuple[float, Any], ttl: float) -> None: ...
+
+    def delete(self, key: Hashable) -> bool: ...
+
+    def keys(self) -> list[Hashable]: ...
+
+
+class Memory:
+    """Entries in an LRU cache in the process."""
+
+    def __init__(self, maxsize: int) -> None:
+        self._entries: cachetools.LRUCache = cachetools.LRUCache(maxsize)
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None:
+        return self._entries.get(key)
+
+    async def fetch(self, key: Hashable) -> tuple[float, Any] | None:
+        return self.get(key)
+
+    def set(self, key: Hashable, entry: tuple[float, Any], ttl: float) -> None:
+        self._entries[key] = entry
+
+    def delete(self, key: Hashable) -> bool:
+        return self._entries.pop(key, None) is not None
+
+    def keys(self) -> list[Hashable]:
+        return list(self._entries)
+
+
+class RedisError(Exception):
+    """The Redis server replied with an error."""
+
+
+class RedisUnavailable(ConnectionError):
+    """The Redis server couldn't be reached lately, so it wasn't tried."""
+
+
+class RedisConnection:
+    """A blocking connection to a server speaking the Redis protocol (RESP2).
+
+    Commands may be sent from several threads, one at a time.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        *,
+        db: int = 0,
+        password: str | None = None,
+        timeout: float = REDIS_TIMEOUT,
+        retry_after: float = REDIS_RETRY_AFTER,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._socket: socket.socket | None = None
+        self._reader: Any = None
+        # time.monotonic() until which the server is left be.
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisConnection":
+        parts = urllib.parse.urlsplit(url)
+        db = parts.path.strip("/")
+        return cls(
+            parts.hostname or "localhost",
+            parts.port or 6379,
+            db=int(db) if db else 0,
+            password=parts.password,
+        )
+
+    def _connect(self) -> None:
+        self._socket = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self._reader = self._socket.makefile("rb")
+        if self.password is not None:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = self._reader = None
+
+    def _read(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by the Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._reader.read(length + 2)[:-2]
+        if kind == b"*":
+            return [self._read() for _ in range(int(rest))]
+        raise ConnectionError(f"unexpected reply from the Redis server: {line!r}")
+
+    def _send(self, *args: Any) -> Any:
+        encoded = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+        request = [b"*%d\r\n" % len(encoded)]
+        for arg in encoded:
+            request.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._socket.sendall(b"".join(request))
+        return self._read()
+
+    def command(self, *args: Any) -> Any:
+        """Send a command and return the reply, reconnecting once if needed.
+
+        If the server can't be reached, commands raise RedisUnavailable
+        without trying it for the next retry_after seconds.
+        """
+        with self._lock:
+            return self._command(*args)
+
+    def _command(self, *args: Any) -> Any:
+        if time.monotonic() < self._down_until:
+            raise RedisUnavailable(f"{self.host}:{self.port} was unreachable")
+        if self._socket is not None:
+            try:
+                return self._send(*args)
+            except OSError:
+                # The server may have closed an idle connection.
+                self.close()
+        try:
+            self._connect()
+            return self._send(*args)
+        except OSError:
+            self.close()
+            self._down_until = time.monotonic() + self.retry_after
+            raise
+
+
+class Redis:
+    """Entries in a Redis server, under keys starting with the prefix."""
+
+    # Keys asked for at a time when listing them.
+    SCAN_COUNT = 1_000
+
+    def __init__(self, connection: RedisConnection, prefix: str) -> None:
+        self.connection = connection
+        self.prefix = prefix
+
+    def _name(self, key: Hashable) -> str:
+        return self.prefix + json.dumps(key)
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None:
+        data = self.connection.command("GET", self._name(key))
+        if data is None:
+            return None
+        stored_at, value = json.loads(data)
+        return stored_at, value
+
+    async def fetch(self, key: Hashable) -> tuple[float, Any] | None:
+        return self.get(key)
+
+    def set(self, key: Hashable, entry: tuple[float, Any], ttl: float) -> None:
+        # Expire the entry with the cache's TTL, counted from when it was stored.
+        milliseconds = int((entry[0] + ttl - time.time()) * 1000)
+        if milliseconds > 0:
+            data = json.dumps(entry, separators=(",", ":"))
+            self.connection.command("SET", self._name(key), data, "PX", milliseconds)
+
+    def delete(self, key: Hashable) -> bool:
+        return bool(self.connection.command("DEL", self._name(key)))
+
+    def keys(self) -> list[Hashable]:
+        keys = []
+        cursor = b"0"
+        while True:
+            cursor, names = self.connection.command(
+                "SCAN", cursor, "MATCH", f"{self.prefix}*", "COUNT", self.SCAN_COUNT
+            )
+            for name in names:
+                keys.append(_key(json.loads(name[len(self.prefix) :])))
+            if cursor == b"0":
+                return keys
+
+
+class Tiered:
+    """Entries in a shared backend, with those used lately kept in the process.
+
+    Only fetch() looks entries up in the shared backend; get() only sees the
+    ones kept in the process, which are still served while the shared backend
+    can't be reached. The shared backend is used from a thread of the tier's
+    own, and stores and deletions don't wait for it. Another process's changes
+    to an entry can take up to ttl seconds to show.
+    """
+
+    def __init__(
+        self, shared: Backend, maxsize: int, ttl: float = LOCAL_TTL, *, name: str
+    ) -> None:
+        self.shared = shared
+        self.name = name
+        self._local: cachetools.TTLCache = cachetools.TTLCache(maxsize, ttl)
+        self._thread: concurrent.futures.ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+
+    @property
+    def _executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        # Started on first use in each process, as a forked child has none of
+        # its parent's threads (see bedevere.workers).
+        if self._pid != os.getpid():
+            self._thread = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"cache-{self.name}"
+            )
+            self._pid = os.getpid()
+        assert self._thread is not None
+        return self._thread
+
+    def _in_background(self, operation: Callable[..., Any], *args: Any) -> None:
+        def run() -> None:
+            try:
+                operation(*args)
+            except (OSError, RedisError) as exc:
+                _failed(self.name, exc)
+
+        self._executor.submit(run)
+
+    def flush(self) -> None:
+        """Wait for the stores and deletions made so far to reach the shared backend."""
+        self._executor.submit(lambda: None).result()
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None:
+        return self._local.get(key)
+
+    async def fetch(self, key: Hashable) -> tuple[float, Any] | None:
+        entry = self._local.get(key)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(self._executor, self.shared.get, key)
+            if entry is not None:
+                self._local[key] = entry
+        return entry
+
+    def set(self, key: Hashable, entry: tuple[float, Any], ttl: float) -> None:
+        self._local[key] = entry
+        self._in_background(self.shared.set, key, entry, ttl)
+
+    def delete(self, key: Hashable) -> bool:
+        self._in_background(self.shared.delete, key)
+        return self._local.pop(key, None) is not None
+
+    def keys(self) -> list[Hashable]:
+        self.flush()
+        return self.shared.keys()
+
+
+# CACHE_URL -> the connection shared by the caches using it.
+_connections: dict[str, RedisConnection] = {}
+# A forked child mustn't talk over its parent's connections.
+os.register_at_fork(after_in_child=_connections.clear)
+
+
+def from_environ(name: str, maxsize: int) -> Backend:
+    """Return a backend for the named cache, as configured by CACHE_URL."""
+    url = os.environ.get("CACHE_URL")
+    if not url:
+        return Memory(maxsize)
+    if url not in _connections:
+        _connections[url] = RedisConnection.from_url(url)
+    return Tiered(Redis(_connections[url], f"bedevere:{name}:"), maxsize, name=name)
+
+
+class Cache(MutableMapping):
+    """A cache whose entries expire ttl seconds after they're stored."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        maxsize: int,
+        ttl: float,
+        warm_start: bool = False,
+        backend: Backend | None = None,
+    ) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.backend = backend if backend is not None else from_environ(name, maxsize)
+        if warm_start:
+            WARM_START[name] = self
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.time() - stored_at > self.ttl
+
+    def _failed(self, exc: Exception) -> None:
+        _failed(self.name, exc)
+
+    def _get(self, key: Hashable) -> tuple[float, Any] | None:
+        try:
+            return self.backend.get(key)
+        except (OSError, RedisError) as exc:
+            self._failed(exc)
+            return None
+
+    def _set(self, key: Hashable, entry: tuple[float, Any]) -> None:
+        try:
+            self.backend.set(key, entry, self.ttl)
+        except (OSError, RedisError) as exc:
+            self._failed(exc)
+
+    def _keys(self) -> list[Hashable]:
+        try:
+            return self.backend.keys()
+        except (OSError, RedisError) as exc:
+            self._failed(exc)
+            return []
+
+    async def fetch(self, key: Hashable, default: Any = None) -> Any:
+        """Return the key's value, or default, without blocking the event loop.
+
+        Unlike cache[key], this looks in a shared backend for entries which
+        aren't kept in the process.
+        """
+        try:
+            entry = await self.backend.fetch(key)
+        except (OSError, RedisError) as exc:
+            self._failed(exc)
+            return default
+        if entry is None or self._expired(entry[0]):
+            return default
+        return entry[1]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        entry = self._get(key)
+        if entry is None:
+            raise KeyError(key)
+        stored_at, value = entry
+        if self._expired(stored_at):
+            del self[key]
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._set(key, (time.time(), value))
+
+    def __delitem__(self, key: Hashable) -> None:
+        try:
+            deleted = self.backend.delete(key)
+        except (OSError, RedisError) as exc:
+            self._failed(exc)
+            deleted = False
+        if not deleted:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def dump(self) -> list[list[Any]]:
+        """Return the entries which haven't expired."""
+        entries = []
+        for key in self._keys():
+            entry = self._get(key)
+            if entry is not None and not self._expired(entry[0]):
+                entries.append([key, *entry])
+        return entries
+
+    def load(self, entries: list[list[Any]]) -> int:
+        """Add dumped entries which haven't expired since, returning how many."""
+        loaded = 0
+        for key, stored_at, value in entries:
+            if not self._expired(stored_at):
+                self._set(_key(key), (stored_at, value))
+                loaded += 1
+        return loaded
@@ -0,0 +1,146 @@
+"""Catch up on the deliveries GitHub failed to make, e.g. during an outage.
+
+GitHub keeps a log of the app's webhook deliveries for three days, failed
+attempts included. Catching up lists the deliveries made since a given time,
+picks those for which no attempt succeeded, fetches their payloads and handles
+them as if they had just arrived. Deliveries which got through after all are
+skipped: those in the journal (see bedevere.journal), which are handled or
+replayed, and those remembered as seen (see bedevere.deliveries). Only the
+journal and a DELIVERIES_DB survive a restart, so set either of them when
+catching up from a new process.
+
+The payloads are fetched rather than redelivered so the pace is ours: a
+bounded number of deliveries is handled at a time, oldest first, and before
+each batch catching up waits for an installation's rate limit to reset if
+less than RESERVE of it is left, keeping that for new deliveries.
+
+Run ``python -m bedevere catch-up`` after an outage, or set CATCH_UP_MINUTES
+to catch up on that many minutes of deliveries on startup.
+"""
+
+import asyncio
+import datetime
+import os
+import sys
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import aiohttp
+from gidgethub import sansio
+
+from . import client, deliveries, journal, metrics, ratelimit, tokens
+
+# Seconds of deliveries to catch up on by default.
+SINCE = 60 * 60
+# Deliveries handled at once.
+CONCURRENCY = 8
+# Fraction of an installation's rate limit left for new deliveries.
+RESERVE = 0.25
+
+CAUGHT_UP = metrics.Counter(
+    "bedevere_caught_up_deliveries_total",
+    "Failed deliveries handled while catching up.",
+)
+
+
+def startup_window() -> float:
+    """Seconds of deliveries to catch up on at startup, if any."""
+    return float(os.environ.get("CATCH_UP_MINUTES", 0)) * 60
+
+
+def _delivered_at(delivery: dict[str, Any]) -> float:
+    return datetime.datetime.strptime(
+        delivery["delivered_at"], "%Y-%m-%dT%H:%M:%S%z"
+    ).timestamp()
+
+
+def _got_through(delivery_id: str) -> bool:
+    return delivery_id in journal.JOURNAL or delivery_id in deliveries.SEEN
+
+
+async def failed_deliveries(gh, since: float) -> list[dict[str, Any]]:
+    """Return the deliveries since the epoch time which never got through.
+
+    Each delivery is represented by its latest attempt, oldest delivery first.
+    """
+    # Delivery GUID -> attempts, newest first.
+    attempts: dict[str, list[dict[str, Any]]] = {}
+    async for attempt in gh.getiter(
+        "/app/hook/deliveries?per_page=100", jwt=tokens.app_jwt()
+    ):
+        # Listed newest first.
+        if _delivered_at(attempt) < since:
+            break
+        attempts.setdefault(attempt["guid"], []).append(attempt)
+    failed = [
+        tries[0]
+        for tries in attempts.values()
+        if not any(200 <= attempt["status_code"] < 300 for attempt in tries)
+    ]
+    failed.reverse()
+    return failed
+
+
+async def fetch(gh, attempt: dict[str, Any]) -> sansio.Event:
+    """Fetch the payload of a delivery attempt."""
+    delivery = await gh.getitem(
+        "/app/hook/deliveries/{delivery_id}",
+        {"delivery_id": attempt["id"]},
+        jwt=tokens.app_jwt(),
+    )
+    return sansio.Event(
+        delivery["request"]["payload"],
+        event=delivery["event"],
+        delivery_id=delivery["guid"],
+    )
+
+
+async def catch_up(
+    process: Callable[[sansio.Event], Awaitable[Any]],
+    *,
+    since: float,
+    concurrency: int = CONCURRENCY,
+    reserve: float = RESERVE,
+) -> int:
+    """Handle the deliveries which failed since the epoch time with process().
+
+    Return how many deliveries were handled.
+    """
+    if isinstance(journal.JOURNAL, journal.NullJournal) and isinstance(
+        deliveries.SEEN, deliveries.SeenDeliveries
+    ):
+        print(
+            "Warning: set JOURNAL_DB or DELIVERIES_DB, or deliveries handled"
+            " before a restart may be handled again",
+            file=sys.stderr,
+        )
+    handled = 0
+    async with aiohttp.ClientSession() as session:
+        gh = client.from_environ(session)
+        failed = await failed_deliveries(gh, since)
+        missed = [attempt for attempt in failed if not _got_through(attempt["guid"])]
+        print(
+            f"Catching up on {len(missed)} of {len(failed)} failed deliveries",
+            file=sys.stderr,
+        )
+        for start in range(0, len(missed), concurrency):
+            batch = missed[start : start + concurrency]
+            installations = {attempt["installation_id"] for attempt in batch}
+            for installation_id in installations - {None}:
+                await ratelimit.SCHEDULER.wait(installation_id, reserve)
+            events = await asyncio.gather(*(fetch(gh, attempt) for attempt in batch))
+            # Handling starts in order, so deliveries for the same pull request
+            # are still handled in the order they were made.
+            results = await asyncio.gather(
+                *(process(event) for event in events), return_exceptions=True
+            )
+            for event, result in zip(events, results):
+                if isinstance(result, Exception):
+                    print(
+                        f"Catching up on {event.delivery_id} failed: {result!r}",
+                        file=sys.stderr,
+                    )
+                else:
+                    handled += 1
+    CAUGHT_UP.inc(handled)
+    return handled
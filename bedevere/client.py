@@ -0,0 +1,213 @@
+"""GitHub API client which reports every request it makes."""
+
+import os
+import re
+import sys
+import urllib.parse
+from collections.abc import Callable, Mapping
+from typing import Literal, NamedTuple
+
+import aiohttp
+from gidgethub import aiohttp as gh_aiohttp
+from gidgethub import sansio
+
+from . import retry, tracing
+
+# "uncached": there was no cached copy of the resource.
+# "cached": a cached copy was revalidated, but had changed.
+# "304": a cached copy was revalidated and was still current, which doesn't
+#        count against the rate limit.
+CacheState = Literal["uncached", "cached", "304"]
+
+_TEMPLATE_SEGMENTS = (
+    (re.compile(r"^[0-9a-f]{40}$"), "{sha}"),
+    (re.compile(r"^\d+$"), "{number}"),
+)
+
+
+class RequestRecord(NamedTuple):
+    method: str
+    url: str
+    cache: CacheState
+    status: int
+    # 0 for the first attempt at a request, 1 for its first retry and so on.
+    attempt: int = 0
+
+    @property
+    def is_write(self) -> bool:
+        return not is_read(self.method, self.url)
+
+    @property
+    def costs_quota(self) -> bool:
+        """Whether the request counts against the rate limit."""
+        return self.cache != "304"
+
+
+def is_read(method: str, url_template: str) -> bool:
+    """Whether the request only reads; GraphQL queries are POSTed."""
+    return method == "GET" or url_template == "/graphql"
+
+
+def url_template(url: str, base_url: str = "") -> str:
+    """Turn a URL into a template shared by the requests for similar resources.
+
+    >>> url_template("https://api.github.com/repos/python/cpython/issues/42",
+    ...              "https://api.github.com")
+    '/repos/python/cpython/issues/{number}'
+    """
+    if base_url and url.startswith(base_url):
+        url = url[len(base_url) :]
+    parts = urllib.parse.urlsplit(url)
+    segments = []
+    for segment in parts.path.split("/"):
+        for pattern, replacement in _TEMPLATE_SEGMENTS:
+            if pattern.match(segment):
+                segment = replacement
+                break
+        segments.append(segment)
+    # Only requests to other hosts (e.g. bugs.python.org) keep their host.
+    host = f"{parts.scheme}://{parts.netloc}" if parts.netloc else ""
+    return host + "/".join(segments)
+
+
+class RequestDropped(Exception):
+    """The request was not made, to save the rate limit for more important work."""
+
+
+class RequestDeferred(RequestDropped):
+    """The request was queued, to be made once the rate limit resets."""
+
+
+class Request(NamedTuple):
+    """A request to the GitHub API, to be made later."""
+
+    method: str
+    url: str
+    headers: Mapping[str, str]
+    body: bytes
+
+    async def send(self, gh: "GitHubAPI") -> tuple[int, Mapping[str, str], bytes]:
+        """Make the request with the client's installation token."""
+        headers = {**self.headers, "authorization": f"token {gh.oauth_token}"}
+        return await gh._request(self.method, self.url, headers, self.body)
+
+
+class GitHubAPI(gh_aiohttp.GitHubAPI):
+    """aiohttp-based client which passes a RequestRecord to its observers.
+
+    Requests GitHub turns away for being too many or too fast, or fails with a
+    server error, are retried (see bedevere.retry). Once installation_id is
+    set, requests go through the scheduler (see bedevere.ratelimit) and writes
+    through the installation's write limiter, if given.
+    """
+
+    def __init__(self, *args, scheduler=None, write_limiters=None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.observers: list[Callable[[RequestRecord], None]] = []
+        self.scheduler = scheduler
+        self.write_limiters = write_limiters
+        self.installation_id: int | str | None = None
+
+    def with_session(self, session: aiohttp.ClientSession) -> "GitHubAPI":
+        """Return a client like this one which makes its requests with session.
+
+        For work which outlives the session this client was made with.
+        """
+        gh = GitHubAPI(
+            session,
+            self.requester,
+            oauth_token=self.oauth_token,
+            cache=self._cache,
+            base_url=self.base_url,
+            scheduler=self.scheduler,
+            write_limiters=self.write_limiters,
+        )
+        gh.observers = list(self.observers)
+        gh.installation_id = self.installation_id
+        return gh
+
+    async def _request(
+        self, method: str, url: str, headers: Mapping[str, str], body: bytes = b""
+    ) -> tuple[int, Mapping[str, str], bytes]:
+        template = url_template(url, self.base_url)
+        limiter = None
+        if (
+            not is_read(method, template)
+            and self.write_limiters is not None
+            and self.installation_id is not None
+        ):
+            limiter = self.write_limiters[self.installation_id]
+        attempt = 0
+        while True:
+            if limiter is None:
+                response = await self._attempt(
+                    method, url, template, headers, body, attempt
+                )
+            else:
+                async with limiter.slot():
+                    response = await self._attempt(
+                        method, url, template, headers, body, attempt
+                    )
+            status, response_headers, response_body = response
+            if limiter is not None:
+                if retry.is_throttled(status, response_headers, response_body):
+                    limiter.throttled()
+                elif status < 400:
+                    limiter.succeeded()
+            delay = retry.retry_delay(
+                method, template, attempt, status, response_headers, response_body
+            )
+            if delay is None:
+                return response
+            if delay > retry.MAX_INLINE_DELAY:
+                if limiter is not None and self.scheduler is not None:
+                    request = Request(method, url, headers, body)
+                    self.scheduler.defer(self.installation_id, template, request, delay)
+                return response
+            print(
+                f"Retrying {method} {template} (HTTP {status}) in {delay:.1f}s",
+                file=sys.stderr,
+            )
+            await self.sleep(delay)
+            attempt += 1
+
+    async def _attempt(
+        self,
+        method: str,
+        url: str,
+        template: str,
+        headers: Mapping[str, str],
+        body: bytes,
+        attempt: int,
+    ) -> tuple[int, Mapping[str, str], bytes]:
+        scheduled = self.scheduler is not None and self.installation_id is not None
+        if scheduled:
+            request = Request(method, url, headers, body)
+            self.scheduler.acquire(self.installation_id, template, request)
+        with tracing.span("http.client", f"{method} {template}") as span:
+            status, response_headers, response_body = await super()._request(
+                method, url, headers, body
+            )
+            if status == 304:
+                cache: CacheState = "304"
+            elif "if-none-match" in headers or "if-modified-since" in headers:
+                cache = "cached"
+            else:
+                cache = "uncached"
+            span.set_tag("cache", cache)
+            span.set_data("url.template", template)
+            span.set_data("http.response.status_code", status)
+            if attempt:
+                span.set_data("retry.attempt", attempt)
+        if scheduled:
+            self.scheduler.update(self.installation_id, response_headers)
+        record = RequestRecord(method, template, cache, status, attempt)
+        for observer in self.observers:
+            observer(record)
+        return status, response_headers, response_body
+
+
+def from_environ(session: aiohttp.ClientSession, **kwargs) -> GitHubAPI:
+    """Return bedevere's client, for the API at GH_BASE_URL if it's set."""
+    base_url = os.environ.get("GH_BASE_URL", sansio.DOMAIN)
+    return GitHubAPI(session, "python/bedevere", base_url=base_url, **kwargs)
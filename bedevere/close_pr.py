@@ -4,6 +4,8 @@ import re
 
 import gidgethub.routing
 
+from . import mutations
+
 PYTHON_MAINT_BRANCH_RE = re.compile(r"^\w+:\d+\.\d+$")
 
 INVALID_PR_COMMENT = """\
@@ -32,13 +34,14 @@ async def close_invalid_pr(event, gh, *args, **kwargs):
     if PYTHON_MAINT_BRANCH_RE.match(head_label) and base_label == "python:main":
         data = {"state": "closed"}
         await gh.patch(event.data["pull_request"]["url"], data=data)
-        await gh.post(
-            f'{event.data["pull_request"]["issue_url"]}/labels', data=["invalid"]
-        )
-        await gh.post(
-            f'{event.data["pull_request"]["issue_url"]}/comments',
-            data={"body": INVALID_PR_COMMENT},
-        )
+        issue_url = event.data["pull_request"]["issue_url"]
+        issue = {
+            "labels_url": f"{issue_url}/labels",
+            "labels": event.data["pull_request"].get("labels", []),
+        }
+        writes = mutations.writer(gh, kwargs.get("plan"))
+        await writes.add_labels(issue, ["invalid"])
+        await writes.add_comment(f"{issue_url}/comments", INVALID_PR_COMMENT)
 
 
 @router.register("pull_request", action="review_requested")
@@ -0,0 +1,129 @@
+"""Recognize webhook deliveries which have already been handled.
+
+GitHub redelivers a webhook when it times out waiting for a response, and
+people redeliver them by hand. Handling a delivery again would repeat its
+comments, so the IDs of deliveries seen in the last DEDUP_TTL seconds are
+remembered and repeats are acknowledged without doing anything.
+
+IDs are remembered in memory by default. Set DELIVERIES_DB to the path of a
+SQLite database to share them between processes instead.
+"""
+
+import os
+import sqlite3
+import time
+
+import cachetools
+
+from . import metrics
+
+# GitHub only offers to redeliver deliveries from the past three days.
+DEDUP_TTL = 3 * 24 * 60 * 60
+MAX_REMEMBERED = 50_000
+
+DUPLICATES = metrics.Counter(
+    "bedevere_duplicate_deliveries_total",
+    "Deliveries ignored because they were already handled.",
+)
+
+
+# Connections opened before a fork. The child keeps them open, as closing one
+# there could checkpoint the parent's WAL.
+_inherited: list[sqlite3.Connection] = []
+
+
+class SeenDeliveries:
+    """Delivery IDs seen recently, in memory."""
+
+    def __init__(self, *, maxsize: int = MAX_REMEMBERED, ttl: float = DEDUP_TTL):
+        self._seen: cachetools.TTLCache = cachetools.TTLCache(maxsize, ttl)
+
+    def __contains__(self, delivery_id: str) -> bool:
+        return delivery_id in self._seen
+
+    def add(self, delivery_id: str) -> bool:
+        """Remember the delivery, returning False if it was already seen."""
+        if delivery_id in self._seen:
+            return False
+        self._seen[delivery_id] = None
+        return True
+
+    def discard(self, delivery_id: str) -> None:
+        """Forget the delivery, e.g. so it can be redelivered after failing."""
+        self._seen.pop(delivery_id, None)
+
+    def clear(self) -> None:
+        self._seen.clear()
+
+
+class SQLiteSeenDeliveries:
+    """Delivery IDs seen recently, in a SQLite database shared by processes."""
+
+    # Expired IDs are purged every this many additions.
+    PURGE_EVERY = 1_000
+
+    def __init__(self, path: str, *, ttl: float = DEDUP_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._added = 0
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Each worker process opens its own connection, on first use, rather
+        # than one opened at import before the workers were forked.
+        if self._pid != os.getpid():
+            if self._connection is not None:
+                _inherited.append(self._connection)
+            self._connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            self._pid = os.getpid()
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen_deliveries"
+                " (delivery_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+        return self._connection
+
+    def __contains__(self, delivery_id: str) -> bool:
+        row = self._db.execute(
+            "SELECT 1 FROM seen_deliveries WHERE delivery_id = ? AND seen_at >= ?",
+            (delivery_id, time.time() - self.ttl),
+        ).fetchone()
+        return row is not None
+
+    def add(self, delivery_id: str) -> bool:
+        now = time.time()
+        self._added += 1
+        if self._added % self.PURGE_EVERY == 0:
+            self._db.execute(
+                "DELETE FROM seen_deliveries WHERE seen_at < ?", (now - self.ttl,)
+            )
+        # Replace the row only if it has expired.
+        cursor = self._db.execute(
+            "INSERT INTO seen_deliveries VALUES (?, ?) ON CONFLICT (delivery_id)"
+            " DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at < ?",
+            (delivery_id, now, now - self.ttl),
+        )
+        return cursor.rowcount == 1
+
+    def discard(self, delivery_id: str) -> None:
+        self._db.execute(
+            "DELETE FROM seen_deliveries WHERE delivery_id = ?", (delivery_id,)
+        )
+
+    def clear(self) -> None:
+        self._db.execute("DELETE FROM seen_deliveries")
+
+
+def from_environ() -> SeenDeliveries | SQLiteSeenDeliveries:
+    """Return the shared store if DELIVERIES_DB is set, else an in-memory one."""
+    path = os.environ.get("DELIVERIES_DB")
+    if path:
+        return SQLiteSeenDeliveries(path)
+    return SeenDeliveries()
+
+
+SEEN = from_environ()
@@ -12,11 +12,17 @@ router = gidgethub.routing.Router()
 @router.register("pull_request", action="reopened")
 async def check_file_paths(event, gh, *args, **kwargs):
     pull_request = event.data["pull_request"]
-    files = await util.files_for_PR(gh, pull_request)
+    snapshots = kwargs.get("snapshots")
+    plan = kwargs.get("plan")
+    files = await util.files_for_PR(gh, pull_request, snapshots)
     filenames = [file["file_name"] for file in files]
     if event.data["action"] == "opened":
-        labels = await prtype.classify_by_filepaths(gh, pull_request, filenames)
+        labels = await prtype.classify_by_filepaths(
+            gh, pull_request, filenames, snapshots=snapshots, plan=plan
+        )
         if prtype.Labels.skip_news not in labels:
-            await news.check_news(gh, pull_request, files)
+            await news.check_news(
+                gh, pull_request, files, snapshots=snapshots, plan=plan
+            )
     else:
-        await news.check_news(gh, pull_request, files)
+        await news.check_news(gh, pull_request, files, snapshots=snapshots, plan=plan)
@@ -1,14 +1,15 @@
 """Check if a GitHub issue number is specified in the pull request's title."""
 
 import re
-from typing import Literal
+from typing import Any, Literal
 
+import cachetools
 import gidgethub
 from aiohttp import ClientSession
 from gidgethub import routing
 from gidgethub.abc import GitHubAPI
 
-from . import util
+from . import bpo, caches, metrics, tracing, util
 
 router = routing.Router()
 
@@ -26,10 +27,25 @@ ISSUE_URL: dict[IssueKind, str] = {
     "bpo": "https://bugs.python.org/issue?@action=redirect&bpo={issue_number}",
 }
 ISSUE_CHECK_URL: dict[IssueKind, str] = {
-    "gh": "https://api.github.com/repos/python/cpython/issues/{issue_number}",
+    "gh": "/repos/python/cpython/issues/{issue_number}",
     "bpo": "https://bugs.python.org/issue{issue_number}",
 }
 
+# An issue never stops being an issue, so positive lookups are kept for a long
+# time. Misses are only kept briefly in case the issue gets created shortly
+# after the pull request referencing it.
+FOUND_ISSUE_TTL = 7 * 24 * 60 * 60
+MISSING_ISSUE_TTL = 5 * 60
+_found_issues = caches.Cache(
+    "found_issues", maxsize=10_000, ttl=FOUND_ISSUE_TTL, warm_start=True
+)
+_missing_issues: cachetools.TTLCache = cachetools.TTLCache(
+    maxsize=1_000, ttl=MISSING_ISSUE_TTL
+)
+# Issue payloads fetched while validating, handed over to set_status() so the
+# issue doesn't have to be fetched again to update its body.
+_fetched_issues: cachetools.TTLCache = cachetools.TTLCache(maxsize=100, ttl=60)
+
 
 @router.register("pull_request", action="opened")
 @router.register("pull_request", action="synchronize")
@@ -37,40 +53,51 @@ ISSUE_CHECK_URL: dict[IssueKind, str] = {
 async def set_status(event, gh: GitHubAPI, *args, session: ClientSession, **kwargs):
     """Set the issue number status on the pull request."""
     pull_request = event.data["pull_request"]
-    issue = await util.issue_for_PR(gh, pull_request)
-
+    issue = await util.issue_for_PR(gh, pull_request, kwargs.get("snapshots"))
+    status, issue_number = await issue_status(gh, pull_request, issue, session=session)
+    # Reviewers and merge gates wait on the status, so post it straight away
+    # rather than after linking the pull request and the issue to each other
+    # and the other handlers' work.
+    await util.post_status(gh, event, status, kwargs.get("plan"), now=True)
+    if issue_number is not None:
+        _link_pr_to_issue(gh, issue_number, pull_request["number"])
+        # Add the issue number to the pull request's body
+        await util.patch_body(gh, util.PR, pull_request, issue_number)
+
+
+async def issue_status(gh: GitHubAPI, pull_request, issue, *, session: ClientSession):
+    """Return the issue number status for a pull request.
+
+    Also return the number of the GitHub issue the pull request should be
+    linked to, if any.
+    """
     if util.skip("issue", issue):
-        await util.post_status(gh, event, SKIP_ISSUE_STATUS)
-        return
+        return SKIP_ISSUE_STATUS, None
 
     issue_number_found = ISSUE_RE.search(pull_request["title"])
 
     if not issue_number_found:
-        status = create_failure_status_no_issue()
-    else:
-        issue_number = int(issue_number_found.group("issue"))
-        issue_kind = issue_number_found.group("kind").lower()
-        issue_found = await _validate_issue_number(
-            gh, issue_number, session=session, kind=issue_kind
-        )
-        if issue_found:
-            status = create_success_status(issue_number, kind=issue_kind)
-            if issue_kind == "gh":
-                # Add the issue number to the pull request's body
-                await util.patch_body(gh, util.PR, pull_request, issue_number)
-                # Get GitHub Issue data
-                issue_data = await gh.getitem(
-                    ISSUE_CHECK_URL[issue_kind].format(issue_number=issue_number)
-                )
-                # Add the pull request number to the issue's body
-                await util.patch_body(
-                    gh, util.ISSUE, issue_data, pull_request["number"]
-                )
-        else:
-            status = create_failure_status_issue_not_present(
-                issue_number, kind=issue_kind
-            )
-    await util.post_status(gh, event, status)
+        return create_failure_status_no_issue(), None
+
+    issue_number = int(issue_number_found.group("issue"))
+    issue_kind = issue_number_found.group("kind").lower()
+    issue_found = await _validate_issue_number(
+        gh, issue_number, session=session, kind=issue_kind
+    )
+    if not issue_found:
+        status = create_failure_status_issue_not_present(issue_number, kind=issue_kind)
+        return status, None
+
+    status = create_success_status(issue_number, kind=issue_kind)
+    return status, (issue_number if issue_kind == "gh" else None)
+
+
+def _link_pr_to_issue(gh: GitHubAPI, issue_number: int, pr_number: int):
+    """Add the pull request number to the issue's body, in the background."""
+    issue_url = ISSUE_CHECK_URL["gh"].format(issue_number=issue_number)
+    # Reuse the GitHub Issue data if validation just fetched it.
+    issue_data = _fetched_issues.pop(("gh", issue_number), None)
+    util.link_pr_to_issue(gh, issue_url, pr_number, issue=issue_data)
 
 
 @router.register("pull_request", action="edited")
@@ -78,7 +105,7 @@ async def title_edited(event, gh, *args, session, **kwargs):
     """Set the status on a pull request that has changed its title."""
     if "title" not in event.data["changes"]:
         return
-    await set_status(event, gh, session=session)
+    await set_status(event, gh, session=session, **kwargs)
 
 
 @router.register("pull_request", action="labeled")
@@ -90,7 +117,7 @@ async def new_label(event, gh, *args, **kwargs):
             status = create_success_status(issue_number_found.group("issue"))
         else:
             status = SKIP_ISSUE_STATUS
-        await util.post_status(gh, event, status)
+        await util.post_status(gh, event, status, kwargs.get("plan"))
 
 
 @router.register("pull_request", action="unlabeled")
@@ -99,7 +126,7 @@ async def removed_label(event, gh, *args, session, **kwargs):
     if util.no_labels(event.data):
         return
     elif util.label_name(event.data) == SKIP_ISSUE_LABEL:
-        await set_status(event, gh, session=session)
+        await set_status(event, gh, session=session, **kwargs)
 
 
 def create_success_status(issue_number: int, *, kind: IssueKind = "gh"):
@@ -143,18 +170,47 @@ async def _validate_issue_number(
     gh: GitHubAPI, issue_number: int, *, session: ClientSession, kind: IssueKind = "gh"
 ) -> bool:
     """Ensure the GitHub Issue number is valid."""
-    if kind == "bpo":
-        url = ISSUE_CHECK_URL[kind].format(issue_number=issue_number)
-        async with session.head(url) as res:
-            return res.status != 404
-
-    if kind != "gh":
+    if kind not in ISSUE_CHECK_URL:
         raise ValueError(f"Unknown issue kind {kind}")
 
+    key = (kind, issue_number)
+    if await _found_issues.fetch(key):
+        metrics.ISSUE_CACHE_HIT.inc()
+        return True
+    if key in _missing_issues:
+        metrics.ISSUE_CACHE_HIT.inc()
+        return False
+    metrics.ISSUE_CACHE_MISS.inc()
+    found = await _check_issue_number(gh, issue_number, session=session, kind=kind)
+    if found:
+        _found_issues[key] = True
+    else:
+        _missing_issues[key] = True
+    return found
+
+
+async def _check_issue_number(
+    gh: GitHubAPI, issue_number: int, *, session: ClientSession, kind: IssueKind
+) -> bool:
+    """Ask the issue tracker whether the issue number is valid."""
     url = ISSUE_CHECK_URL[kind].format(issue_number=issue_number)
+    if kind == "bpo":
+        found = bpo.INDEX.lookup(issue_number)
+        if found or (found is False and not bpo.HEAD_FALLBACK):
+            return found
+        name = f"HEAD {ISSUE_CHECK_URL[kind]}"
+        with tracing.span("http.client", name) as span:
+            async with session.head(url) as res:
+                span.set_tag("cache", "uncached")
+                span.set_data("http.response.status_code", res.status)
+                return res.status != 404
+
     try:
-        response = await gh.getitem(url)
+        response: dict[str, Any] = await gh.getitem(url)
     except gidgethub.BadRequest:
         return False
     # It is an issue if the response does not have the `pull_request` key.
-    return "pull_request" not in response
+    if "pull_request" in response:
+        return False
+    _fetched_issues[(kind, issue_number)] = response
+    return True
@@ -0,0 +1,181 @@
+"""A journal of deliveries, so those cut short by a restart are handled later.
+
+Every accepted delivery is appended to a SQLite journal before it's handled
+and marked as done afterwards. On startup the deliveries an earlier run never
+marked as done are handled again. Set JOURNAL_DB to the path of the journal
+to enable it; it must be on storage which survives restarts.
+
+Deliveries are journaled under the run's BOOT ID, which every worker shares.
+Replaying only takes deliveries journaled under another, so it leaves those
+the other workers are handling as it starts be. They're claimed in one
+statement, so each is replayed once.
+
+The journal is in WAL mode with synchronous=NORMAL, so appending doesn't wait
+for an fsync: the WAL is synced in batches, when SQLite checkpoints it. A
+crashed process loses nothing; losing power can lose the last few entries,
+which GitHub's own redelivery covers.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+
+from gidgethub import sansio
+
+from . import metrics
+
+# Seconds between compactions of the journal.
+COMPACT_INTERVAL = 10 * 60
+# Seconds finished deliveries are kept for, e.g. to look into an incident.
+RETENTION = 60 * 60
+# This run of bedevere. Set on import, before any workers are forked.
+BOOT = uuid.uuid4().hex
+
+# Connections opened before a fork, kept from being closed in the child: closing
+# one could checkpoint the WAL out from under the parent.
+_inherited: list[sqlite3.Connection] = []
+
+REPLAYED = metrics.Counter(
+    "bedevere_replayed_deliveries_total",
+    "Deliveries handled again after a restart cut them short.",
+)
+
+
+class Journal:
+    """The deliveries being handled, and those handled recently."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened on first use in each process, as SQLite connections mustn't
+        # be used across a fork (see bedevere.workers).
+        if self._pid != os.getpid():
+            if self._connection is not None:
+                _inherited.append(self._connection)
+            self._connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            self._pid = os.getpid()
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " delivery_id TEXT PRIMARY KEY,"
+                " event TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " received_at REAL NOT NULL,"
+                " done_at REAL,"
+                " boot TEXT)"
+            )
+            columns = self._connection.execute("PRAGMA table_info(deliveries)")
+            if "boot" not in {column[1] for column in columns}:
+                # Journaled before there were boot IDs.
+                self._connection.execute("ALTER TABLE deliveries ADD COLUMN boot TEXT")
+        return self._connection
+
+    def __contains__(self, delivery_id: str) -> bool:
+        """Whether the delivery was journaled, and not compacted away since."""
+        row = self._db.execute(
+            "SELECT 1 FROM deliveries WHERE delivery_id = ?", (delivery_id,)
+        ).fetchone()
+        return row is not None
+
+    def append(self, event: sansio.Event) -> None:
+        self._db.execute(
+            "INSERT INTO deliveries"
+            " (delivery_id, event, data, received_at, boot) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (delivery_id) DO NOTHING",
+            (
+                event.delivery_id,
+                event.event,
+                json.dumps(event.data),
+                time.time(),
+                BOOT,
+            ),
+        )
+
+    def done(self, delivery_id: str) -> None:
+        self._db.execute(
+            "UPDATE deliveries SET done_at = ? WHERE delivery_id = ?",
+            (time.time(), delivery_id),
+        )
+
+    def unfinished(self) -> list[sansio.Event]:
+        """Return the deliveries not marked as done, oldest first."""
+        rows = self._db.execute(
+            "SELECT delivery_id, event, data FROM deliveries"
+            " WHERE done_at IS NULL ORDER BY received_at"
+        )
+        return [
+            sansio.Event(json.loads(data), event=event, delivery_id=delivery_id)
+            for delivery_id, event, data in rows
+        ]
+
+    def claim(self) -> list[sansio.Event]:
+        """Take over the deliveries earlier runs left unfinished, oldest first."""
+        rows = self._db.execute(
+            "UPDATE deliveries SET boot = ? WHERE done_at IS NULL AND boot IS NOT ?"
+            " RETURNING received_at, delivery_id, event, data",
+            (BOOT, BOOT),
+        ).fetchall()
+        rows.sort()
+        return [
+            sansio.Event(json.loads(data), event=event, delivery_id=delivery_id)
+            for _, delivery_id, event, data in rows
+        ]
+
+    def compact(self, retention: float = RETENTION) -> int:
+        """Drop deliveries finished before the retention period, returning how many."""
+        cursor = self._db.execute(
+            "DELETE FROM deliveries WHERE done_at < ?", (time.time() - retention,)
+        )
+        # Shrink the WAL back down too.
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return cursor.rowcount
+
+
+class NullJournal:
+    """The journal when JOURNAL_DB isn't set: remembers nothing."""
+
+    def __contains__(self, delivery_id: str) -> bool:
+        return False
+
+    def append(self, event: sansio.Event) -> None:
+        pass
+
+    def done(self, delivery_id: str) -> None:
+        pass
+
+    def unfinished(self) -> list[sansio.Event]:
+        return []
+
+    def claim(self) -> list[sansio.Event]:
+        return []
+
+    def compact(self, retention: float = RETENTION) -> int:
+        return 0
+
+
+async def compact_periodically(
+    journal: Journal | NullJournal, interval: float = COMPACT_INTERVAL
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        dropped = journal.compact()
+        print(f"Compacted the journal, dropping {dropped} deliveries", file=sys.stderr)
+
+
+def from_environ() -> Journal | NullJournal:
+    path = os.environ.get("JOURNAL_DB")
+    return Journal(path) if path else NullJournal()
+
+
+JOURNAL = from_environ()
@@ -0,0 +1,437 @@
+"""Metrics in the Prometheus text exposition format, served at /metrics.
+
+Metrics with labels hand out a child per set of label values. Code on the hot
+path binds the children it needs once, at import time, or on first use when
+the label values aren't known up front, so updating a metric is a plain
+attribute update.
+
+When bedevere runs several worker processes (see bedevere.workers), each one
+publishes a snapshot of its metrics to a shared directory every
+PUBLISH_INTERVAL seconds, and the worker serving /metrics adds the other
+workers' snapshots to its own: counters and histograms are summed, gauges are
+combined as each one's ``aggregate`` says.
+"""
+
+import asyncio
+import bisect
+import functools
+import json
+import os
+import sys
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from typing import Any
+
+from aiohttp import web
+from gidgethub import routing, sansio
+
+from . import client, tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# In seconds, spanning a label update up to a handler crawling through pages of
+# reviews.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds between the snapshots each worker publishes.
+PUBLISH_INTERVAL = 1.0
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value)
+        value = value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        registry: "Registry | None" = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, Any] = {}
+        if not self.labelnames:
+            self._children[()] = self._child()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values: Any) -> Any:
+        """Return the child for the label values, creating it if needed."""
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} has labels {self.labelnames}, got {values}"
+                ) from None
+            child = self._children[values] = self._child()
+            return child
+
+    def _value(self, child: Any) -> Any:
+        return child.get()
+
+    def _merge(self, value: Any, other: Any) -> Any:
+        return value + other
+
+    def snapshot(self) -> list[list[Any]]:
+        """Return the children's values as JSON-serializable [label values, value]."""
+        return [
+            [list(values), self._value(child)]
+            for values, child in self._children.items()
+        ]
+
+    def _samples(self, values: dict[tuple, Any]) -> Iterator[str]:
+        for label_values, value in values.items():
+            labels = _format_labels(self.labelnames, label_values)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+    def render(self, others: Sequence[list[list[Any]]] = ()) -> str:
+        """Render the metric, combined with snapshots of it from other workers."""
+        values = {
+            label_values: self._value(child)
+            for label_values, child in self._children.items()
+        }
+        for snapshot in others:
+            for label_values, value in snapshot:
+                key = tuple(label_values)
+                values[key] = (
+                    self._merge(values[key], value) if key in values else value
+                )
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self._samples(values))
+        return "\n".join(lines) + "\n"
+
+
+def _sum(value: float, other: float) -> float:
+    return value + other
+
+
+class _Value:
+    __slots__ = ("value", "function")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from the function whenever the metrics are scraped."""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Counter(_Metric):
+    """A value which only goes up."""
+
+    type = "counter"
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    """A value which goes up and down.
+
+    The values of several workers are combined with ``aggregate``: "sum",
+    "min" or "max".
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        aggregate: str = "sum",
+        registry: "Registry | None" = None,
+    ) -> None:
+        self._merge = {"sum": _sum, "min": min, "max": max}[aggregate]
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._children[()].dec(amount)
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._children[()].set_function(function)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # The last count is for the implicit +Inf bucket.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Counts of observations (like durations) in configurable buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: "Registry | None" = None,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def _value(self, child: _Buckets) -> list[Any]:
+        return [list(child.counts), child.sum]
+
+    def _merge(self, value: list[Any], other: list[Any]) -> list[Any]:
+        counts = [count + more for count, more in zip(value[0], other[0])]
+        return [counts, value[1] + other[1]]
+
+    def _samples(self, values: dict[tuple, Any]) -> Iterator[str]:
+        names = (*self.labelnames, "le")
+        for label_values, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(names, (*label_values, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """The metrics to expose."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name!r} is already registered")
+        self._metrics[metric.name] = metric
+
+    def snapshot(self) -> dict[str, list[list[Any]]]:
+        """Return the values of every metric, for another worker to render."""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, others: Sequence[Mapping[str, list[list[Any]]]] = ()) -> str:
+        """Render every metric, combined with other workers' snapshots."""
+        return "".join(
+            metric.render([other[name] for other in others if name in other])
+            for name, metric in self._metrics.items()
+        )
+
+
+REGISTRY = Registry()
+
+DELIVERIES = Counter(
+    "bedevere_deliveries_total", "Webhook deliveries received.", ("event", "action")
+)
+DELIVERIES_IN_PROGRESS = Gauge(
+    "bedevere_deliveries_in_progress", "Webhook deliveries being handled."
+)
+HANDLER_SECONDS = Histogram(
+    "bedevere_handler_seconds", "Time spent in each webhook handler.", ("handler",)
+)
+GITHUB_REQUESTS = Counter(
+    "bedevere_github_requests_total",
+    "Requests made to the GitHub API.",
+    ("method", "endpoint", "status"),
+)
+GITHUB_RETRIES = Counter(
+    "bedevere_github_retries_total", "Requests to the GitHub API made again."
+)
+CACHE_LOOKUPS = Counter(
+    "bedevere_cache_lookups_total", "Cache lookups by outcome.", ("cache", "result")
+)
+RATE_LIMIT_REMAINING = Gauge(
+    "bedevere_rate_limit_remaining",
+    "GitHub API requests left in the rate limit, per installation.",
+    ("installation",),
+    # The lowest is the latest, until the rate limit resets.
+    aggregate="min",
+)
+ISSUE_LINK_BATCHES = Gauge(
+    "bedevere_issue_link_batches",
+    "Issues waiting for linked pull requests to be added to their body.",
+)
+
+ISSUE_CACHE_HIT = CACHE_LOOKUPS.labels("issue_numbers", "hit")
+ISSUE_CACHE_MISS = CACHE_LOOKUPS.labels("issue_numbers", "miss")
+GITHUB_CACHE_HIT = CACHE_LOOKUPS.labels("github_etags", "hit")
+GITHUB_CACHE_MISS = CACHE_LOOKUPS.labels("github_etags", "miss")
+
+
+# The label values of deliveries and requests aren't known up front, so their
+# children are bound the first time each combination is seen and kept here.
+
+
+@functools.cache
+def _delivery_counter(event: str, action: str) -> _Value:
+    return DELIVERIES.labels(event, action)
+
+
+@functools.cache
+def _request_counter(method: str, endpoint: str, status: int) -> _Value:
+    return GITHUB_REQUESTS.labels(method, endpoint, status)
+
+
+def observe_delivery(event: sansio.Event) -> None:
+    """Count a webhook delivery."""
+    _delivery_counter(event.event, event.data.get("action", "")).inc()
+
+
+def observe_request(record: client.RequestRecord) -> None:
+    """Count a request made to the GitHub API; a client.GitHubAPI observer."""
+    _request_counter(record.method, record.url, record.status).inc()
+    if record.attempt:
+        GITHUB_RETRIES.inc()
+    if record.cache == "304":
+        GITHUB_CACHE_HIT.inc()
+    elif not record.is_write:
+        GITHUB_CACHE_MISS.inc()
+
+
+def handler_name(callback: Callable) -> str:
+    """Name a handler after its module within bedevere, e.g. "stage.new_review"."""
+    module = callback.__module__.rpartition(".")[2]
+    return f"{module}.{callback.__qualname__}"
+
+
+class Router(routing.Router):
+    """Router which times, and traces, every handler."""
+
+    def __init__(self, *other_routers: routing.Router) -> None:
+        self._timers: dict[routing.AsyncCallback, tuple[str, _Buckets]] = {}
+        super().__init__(*other_routers)
+
+    def add(
+        self, func: routing.AsyncCallback, event_type: str, **data_detail: Any
+    ) -> None:
+        super().add(func, event_type, **data_detail)
+        if func not in self._timers:
+            name = handler_name(func)
+            self._timers[func] = name, HANDLER_SECONDS.labels(name)
+
+    async def dispatch(self, event, *args: Any, **kwargs: Any) -> None:
+        for callback in self.fetch(event):
+            name, timer = self._timers[callback]
+            start = time.perf_counter()
+            try:
+                with tracing.span("handler", name):
+                    await callback(event, *args, **kwargs)
+            except client.RequestDropped as exc:
+                # Let the other handlers do their (more important) work.
+                print(f"{name}: {exc}", file=sys.stderr)
+            finally:
+                timer.observe(time.perf_counter() - start)
+
+
+class Workers:
+    """The snapshots of the worker processes, shared through a directory."""
+
+    def __init__(self, directory: str, worker: int) -> None:
+        self.directory = directory
+        self.worker = worker
+
+    def _path(self, worker: int | str) -> str:
+        return os.path.join(self.directory, f"{worker}.json")
+
+    def publish(self, registry: Registry | None = None) -> None:
+        """Publish a snapshot of this worker's metrics, replacing the last one."""
+        snapshot = (REGISTRY if registry is None else registry).snapshot()
+        with open(f"{self._path(self.worker)}.tmp", "w") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+        os.replace(f"{self._path(self.worker)}.tmp", self._path(self.worker))
+
+    def others(self) -> list[dict[str, list[list[Any]]]]:
+        """Return the latest snapshots of the other workers."""
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            worker, _, extension = name.partition(".")
+            if extension != "json" or worker == str(self.worker):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # Being replaced, or gone with the directory.
+                continue
+        return snapshots
+
+    async def publish_periodically(self, interval: float = PUBLISH_INTERVAL) -> None:
+        while True:
+            self.publish()
+            await asyncio.sleep(interval)
+
+
+WORKERS = web.AppKey("workers", Workers)
+
+
+async def handler(request: web.Request) -> web.Response:
+    """Serve the metrics to Prometheus, of every worker if there are several."""
+    workers = request.app.get(WORKERS)
+    others = workers.others() if workers is not None else []
+    return web.Response(
+        body=REGISTRY.render(others).encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
@@ -0,0 +1,187 @@
+"""Plan the writes of all handlers for a delivery, and make them together.
+
+Several handlers react to the same delivery, and each used to add and remove
+labels, set statuses and leave comments on its own. Handlers now ask a writer
+for the changes they want. A Plan, created for each delivery and passed to the
+handlers as the ``plan`` keyword argument, collects them so that:
+
+* the labels to add to an issue are added with one request;
+* adding and then removing a label (or the other way around) cancels out;
+* adding a label the issue has, or removing one it doesn't, is dropped;
+* only the last status set for each context is posted;
+* the same comment isn't left twice.
+
+Handlers called without a plan make each write straight away.
+"""
+
+import asyncio
+import sys
+from typing import Any
+
+from . import client, prstate
+
+
+def _label_names(issue: dict[str, Any]) -> list[str]:
+    return prstate.MIRROR.labels(issue)
+
+
+def _forget(labels_url: str) -> None:
+    # The mirrored labels are out of date until the next delivery.
+    prstate.MIRROR.forget(labels_url.partition("{")[0].removesuffix("/labels"))
+
+
+class Immediate:
+    """Make each write as soon as it's asked for."""
+
+    def __init__(self, gh) -> None:
+        self.gh = gh
+
+    def labels(self, issue: dict[str, Any]) -> list[str]:
+        """Return the names of the issue's labels."""
+        return _label_names(issue)
+
+    async def add_labels(self, issue: dict[str, Any], names: list[str]) -> None:
+        _forget(issue["labels_url"])
+        await self.gh.post(issue["labels_url"], data=list(names))
+
+    async def remove_label(self, issue: dict[str, Any], name: str) -> None:
+        _forget(issue["labels_url"])
+        await self.gh.delete(issue["labels_url"], {"name": name})
+
+    async def set_status(self, statuses_url: str, status: dict[str, Any]) -> None:
+        await self.gh.post(statuses_url, data=status)
+
+    async def add_comment(self, comments_url: str, body: str) -> None:
+        await self.gh.post(comments_url, data={"body": body})
+
+
+class _Labels:
+    """The planned label changes of an issue."""
+
+    def __init__(self, labels_url: str, current: list[str]) -> None:
+        # Without the "{/name}" URI template of issues from the REST API.
+        self.labels_url = labels_url
+        self.current = current
+        # Dicts rather than sets to keep the order the labels were asked for.
+        self.add: dict[str, None] = {}
+        self.remove: dict[str, None] = {}
+
+    def names(self) -> list[str]:
+        kept = [name for name in self.current if name not in self.remove]
+        return kept + list(self.add)
+
+
+class Plan:
+    """Collect the writes of every handler for a delivery, to apply at the end.
+
+    Labels are tracked per issue, starting from the labels of the issue data
+    the first handler to change them passed in.
+    """
+
+    def __init__(self) -> None:
+        self._labels: dict[str, _Labels] = {}
+        # (statuses URL, context) -> status
+        self._statuses: dict[tuple[str, str], dict[str, Any]] = {}
+        # Comments URL -> bodies
+        self._comments: dict[str, dict[str, None]] = {}
+
+    def _issue_labels(self, issue: dict[str, Any]) -> _Labels:
+        labels_url = issue["labels_url"].partition("{")[0]
+        try:
+            return self._labels[labels_url]
+        except KeyError:
+            labels = _Labels(labels_url, _label_names(issue))
+            self._labels[labels_url] = labels
+            return labels
+
+    def labels(self, issue: dict[str, Any]) -> list[str]:
+        """Return the names of the issue's labels once the plan is applied."""
+        return self._issue_labels(issue).names()
+
+    async def add_labels(self, issue: dict[str, Any], names: list[str]) -> None:
+        labels = self._issue_labels(issue)
+        for name in names:
+            if name in labels.remove:
+                del labels.remove[name]
+            elif name not in labels.current:
+                labels.add[name] = None
+
+    async def remove_label(self, issue: dict[str, Any], name: str) -> None:
+        labels = self._issue_labels(issue)
+        if name in labels.add:
+            del labels.add[name]
+        elif name in labels.current:
+            labels.remove[name] = None
+
+    async def set_status(self, statuses_url: str, status: dict[str, Any]) -> None:
+        key = statuses_url, status["context"]
+        # Move the status to the end, as the latest one set.
+        self._statuses.pop(key, None)
+        self._statuses[key] = status
+
+    def discard_status(self, statuses_url: str, context: str) -> None:
+        """Forget the status planned for the context, if any."""
+        self._statuses.pop((statuses_url, context), None)
+
+    async def add_comment(self, comments_url: str, body: str) -> None:
+        self._comments.setdefault(comments_url, {})[body] = None
+
+    def describe(self) -> list[str]:
+        """Describe the planned writes, e.g. for a dry run."""
+        lines = []
+        for labels in self._labels.values():
+            if labels.add:
+                lines.append(f"add labels {', '.join(map(repr, labels.add))}")
+            lines.extend(f"remove label {name!r}" for name in labels.remove)
+        for status in self._statuses.values():
+            line = f"set {status['context']} to {status['state']}"
+            if "description" in status:
+                line += f" ({status['description']})"
+            lines.append(line)
+        for bodies in self._comments.values():
+            for body in bodies:
+                first_line = body.partition("\n")[0]
+                lines.append(f"comment {first_line!r}")
+        return lines
+
+    async def _post_comments(self, gh, comments_url: str, bodies: list[str]) -> None:
+        # In order, so the conversation reads the way the handlers meant it.
+        for body in bodies:
+            await gh.post(comments_url, data={"body": body})
+
+    async def apply(self, gh) -> None:
+        """Make the planned writes, concurrently.
+
+        Every write is attempted. Writes dropped because the rate limit is low
+        are reported; any other failure is raised once the rest are done.
+        """
+        writes = [
+            gh.post(statuses_url, data=status)
+            for (statuses_url, _), status in self._statuses.items()
+        ]
+        for labels in self._labels.values():
+            if labels.add or labels.remove:
+                _forget(labels.labels_url)
+            if labels.add:
+                writes.append(gh.post(labels.labels_url, data=list(labels.add)))
+            writes.extend(
+                gh.delete(f"{labels.labels_url}{{/name}}", {"name": name})
+                for name in labels.remove
+            )
+        writes.extend(
+            self._post_comments(gh, comments_url, list(bodies))
+            for comments_url, bodies in self._comments.items()
+        )
+        errors = []
+        for result in await asyncio.gather(*writes, return_exceptions=True):
+            if isinstance(result, client.RequestDropped):
+                print(result, file=sys.stderr)
+            elif isinstance(result, BaseException):
+                errors.append(result)
+        if errors:
+            raise errors[0]
+
+
+def writer(gh, plan: Plan | None = None) -> Plan | Immediate:
+    """Return the plan to add writes to, or an Immediate writer without one."""
+    return plan if plan is not None else Immediate(gh)
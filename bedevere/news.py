@@ -6,7 +6,7 @@ import re
 
 import gidgethub.routing
 
-from . import util
+from . import mutations, util
 
 router = gidgethub.routing.Router()
 
@@ -41,13 +41,21 @@ apply the `skip news` label instead.
 """
 
 
-async def check_news(gh, pull_request, files=None):
+def _has_changes(file):
+    """Check if a file returned by util.files_for_PR() isn't empty."""
+    if "changes" in file:
+        return file["changes"] >= 1
+    return len(file["patch"]) >= 1
+
+
+async def check_news(gh, pull_request, files=None, *, snapshots=None, plan=None):
     """Check for a news entry.
 
     The routing is handled through the filepaths module.
     """
+    writes = mutations.writer(gh, plan)
     if not files:
-        files = await util.files_for_PR(gh, pull_request)
+        files = await util.files_for_PR(gh, pull_request, snapshots)
     in_next_dir = file_found = False
     for file in files:
         if not util.is_news_dir(file["file_name"]):
@@ -57,20 +65,18 @@ async def check_news(gh, pull_request, files=None):
         if len(file_path.parts) != 5:  # Misc, NEWS.d, next, <subsection>, <entry>
             continue
         file_found = True
-        if FILENAME_RE.match(file_path.name) and len(file["patch"]) >= 1:
+        if FILENAME_RE.match(file_path.name) and _has_changes(file):
             status = create_status(
                 util.StatusState.SUCCESS, description="News entry found in Misc/NEWS.d"
             )
             break
     else:
-        issue = await util.issue_for_PR(gh, pull_request)
+        issue = await util.issue_for_PR(gh, pull_request, snapshots)
         if util.skip("news", issue):
             status = SKIP_LABEL_STATUS
         else:
             if pull_request["author_association"] == "NONE":
-                await gh.post(
-                    f"{pull_request['issue_url']}/comments", data={"body": HELP}
-                )
+                await writes.add_comment(f"{pull_request['issue_url']}/comments", HELP)
             if not in_next_dir:
                 description = (
                     f'No news entry in {util.NEWS_NEXT_DIR} or "skip news" label found'
@@ -85,13 +91,13 @@ async def check_news(gh, pull_request, files=None):
                 target_url=BLURB_IT_URL,
             )
 
-    await gh.post(pull_request["statuses_url"], data=status)
+    await writes.set_status(pull_request["statuses_url"], status)
 
 
 @router.register("pull_request", action="labeled")
 async def label_added(event, gh, *args, **kwargs):
     if util.label_name(event.data) == SKIP_NEWS_LABEL:
-        await util.post_status(gh, event, SKIP_LABEL_STATUS)
+        await util.post_status(gh, event, SKIP_LABEL_STATUS, kwargs.get("plan"))
 
 
 @router.register("pull_request", action="unlabeled")
@@ -100,4 +106,9 @@ async def label_removed(event, gh, *args, **kwargs):
         return
     elif util.label_name(event.data) == SKIP_NEWS_LABEL:
         pull_request = event.data["pull_request"]
-        await check_news(gh, pull_request)
+        await check_news(
+            gh,
+            pull_request,
+            snapshots=kwargs.get("snapshots"),
+            plan=kwargs.get("plan"),
+        )
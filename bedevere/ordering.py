@@ -0,0 +1,250 @@
+"""Handle the deliveries for each pull request one at a time, in arrival order.
+
+GitHub sends several deliveries at once for a single action (e.g. pushing
+sends ``synchronize`` and possibly ``labeled``), and handling them
+concurrently races, e.g. two handlers each removing the stage label the other
+just added. Deliveries are keyed by the pull request (or issue) they're about;
+those with the same key wait for the ones which arrived before them, while
+deliveries for different pull requests are handled concurrently.
+
+Pushing to a pull request again makes the work for its previous head commit
+pointless, so a ``synchronize`` delivery for a commit which has since been
+superseded is skipped if it's still waiting, or cancelled if it's running.
+
+Triagers tend to add and remove several labels in a row. Label changes to a
+pull request are held for LABEL_DEBOUNCE_SECONDS (2 by default) and, if more
+arrive meanwhile, only the last one is handled once the labels settle, as its
+payload carries the pull request's final labels. They're held in their turn,
+so other deliveries for the pull request still wait for them.
+"""
+
+import asyncio
+import contextlib
+import os
+import sys
+import time
+from collections.abc import AsyncIterator, Coroutine, Hashable
+from typing import Any
+
+import cachetools
+from gidgethub import sansio
+
+from . import metrics
+
+QUEUE_SECONDS = metrics.Histogram(
+    "bedevere_delivery_queue_seconds",
+    "Time deliveries waited for earlier ones for the same pull request.",
+)
+BACKLOG = metrics.Gauge(
+    "bedevere_delivery_backlog",
+    "Deliveries waiting for earlier ones for the same pull request.",
+)
+KEY_BACKLOG = metrics.Histogram(
+    "bedevere_delivery_key_backlog",
+    "Deliveries for the same pull request ahead of each delivery on arrival.",
+    buckets=(0, 1, 2, 4, 8, 16),
+)
+SUPERSEDED = metrics.Counter(
+    "bedevere_superseded_deliveries_total",
+    "Synchronize deliveries for a head commit which was pushed over.",
+    ("outcome",),
+)
+SKIPPED = SUPERSEDED.labels("skipped")
+CANCELLED = SUPERSEDED.labels("cancelled")
+COALESCED = metrics.Counter(
+    "bedevere_coalesced_label_deliveries_total",
+    "Label change deliveries superseded by a later one.",
+)
+
+LABEL_ACTIONS = frozenset({"labeled", "unlabeled"})
+
+
+def key(event: sansio.Event) -> tuple[str, int] | None:
+    """Return the (repository, number) the event is about, if any."""
+    data = event.data
+    item = data.get("pull_request") or data.get("issue")
+    repository = data.get("repository")
+    if item is None or repository is None:
+        # E.g. a push, which may be for any number of pull requests.
+        return None
+    return repository["full_name"], item["number"]
+
+
+def head_sha(event: sansio.Event) -> str | None:
+    """Return the head commit pushed to a pull request by a synchronize event."""
+    if event.event == "pull_request" and event.data.get("action") == "synchronize":
+        return event.data["pull_request"]["head"]["sha"]
+    return None
+
+
+def is_label_change(event: sansio.Event) -> bool:
+    return event.event == "pull_request" and event.data.get("action") in LABEL_ACTIONS
+
+
+def label_debounce() -> float:
+    """Seconds to wait for more label changes before handling them."""
+    return float(os.environ.get("LABEL_DEBOUNCE_SECONDS", 2))
+
+
+class _Queue:
+    __slots__ = ("lock", "size")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # Deliveries holding or waiting for the lock.
+        self.size = 0
+
+
+class KeyedExecutor:
+    """Run work with the same key in arrival order, and other work concurrently."""
+
+    def __init__(self) -> None:
+        self._queues: dict[Hashable, _Queue] = {}
+
+    def backlog(self, key: Hashable) -> int:
+        """Return how much work with the key is running or waiting."""
+        queue = self._queues.get(key)
+        return queue.size if queue is not None else 0
+
+    @contextlib.asynccontextmanager
+    async def turn(self, key: Hashable | None) -> AsyncIterator[None]:
+        """Wait for the work with the same key which arrived earlier to finish.
+
+        Work without a key doesn't wait.
+        """
+        if key is None:
+            yield
+            return
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _Queue()
+        KEY_BACKLOG.observe(queue.size)
+        queue.size += 1
+        start = time.perf_counter()
+        BACKLOG.inc()
+        try:
+            # Waiters on an asyncio.Lock acquire it in the order they waited.
+            await queue.lock.acquire()
+        except BaseException:
+            self._leave(key, queue)
+            raise
+        finally:
+            BACKLOG.dec()
+        QUEUE_SECONDS.observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            queue.lock.release()
+            self._leave(key, queue)
+
+    def _leave(self, key: Hashable, queue: _Queue) -> None:
+        queue.size -= 1
+        if not queue.size:
+            del self._queues[key]
+
+
+class Heads:
+    """Track the latest head commit of each pull request."""
+
+    def __init__(self, *, maxsize: int = 10_000, ttl: float = 60 * 60) -> None:
+        self._latest: cachetools.TTLCache = cachetools.TTLCache(maxsize, ttl)
+        # Key -> (head SHA, task) of the synchronize delivery being handled.
+        self._running: dict[Hashable, tuple[str, asyncio.Task]] = {}
+
+    def pushed(self, key: Hashable, sha: str) -> None:
+        """Record a new head commit, cancelling the work for the previous one."""
+        self._latest[key] = sha
+        running = self._running.get(key)
+        if running is not None and running[0] != sha:
+            running[1].cancel()
+
+    def superseded(self, key: Hashable, sha: str | None) -> bool:
+        """Whether a newer head commit has been pushed since."""
+        if sha is None:
+            return False
+        return self._latest.get(key, sha) != sha
+
+    async def run(
+        self, key: Hashable, sha: str | None, work: Coroutine[Any, Any, None]
+    ) -> bool:
+        """Run the work for a head commit, unless a newer one is pushed meanwhile.
+
+        Work without a head commit is simply awaited. Return False if the work
+        was skipped or cancelled.
+        """
+        if sha is None:
+            await work
+            return True
+        if self.superseded(key, sha):
+            # Pushed over while getting ready, e.g. fetching a token.
+            work.close()
+            SKIPPED.inc()
+            return False
+        task = asyncio.ensure_future(work)
+        self._running[key] = sha, task
+        try:
+            # Unlike awaiting the task, waiting for it keeps a cancellation of
+            # our own apart from the one from pushed().
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            del self._running[key]
+        if task.cancelled():
+            CANCELLED.inc()
+            print(f"Cancelled work for {sha} of {key}: superseded", file=sys.stderr)
+            return False
+        task.result()
+        return True
+
+    def clear(self) -> None:
+        self._latest.clear()
+
+
+class Bursts:
+    """Collect bursts of label changes to each pull request."""
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._bursts: dict[Hashable, list[sansio.Event]] = {}
+
+    def arrived(self, key: Hashable, event: sansio.Event) -> list[sansio.Event]:
+        """Add a label change to the pull request's burst, and return the burst."""
+        burst = self._bursts.setdefault(key, [])
+        burst.append(event)
+        return burst
+
+    def close(self, key: Hashable) -> None:
+        """End the pull request's burst, as another kind of delivery arrived.
+
+        Label changes arriving later start a new burst, so none of them are
+        handled before the delivery, nor the earlier ones after it.
+        """
+        self._bursts.pop(key, None)
+
+    async def settle(
+        self,
+        key: Hashable,
+        burst: list[sansio.Event],
+        event: sansio.Event,
+        arrived_at: float,
+    ) -> bool:
+        """Wait for the labels to settle, and return whether to handle the event.
+
+        Wait until the window has passed since the delivery arrived (at
+        time.monotonic()), so each change restarts the wait. Only the last
+        change of the burst is handled; the others are counted as coalesced.
+        """
+        await asyncio.sleep(arrived_at + self.window - time.monotonic())
+        if burst[-1] is not event:
+            COALESCED.inc()
+            return False
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        return True
+
+
+EXECUTOR = KeyedExecutor()
+HEADS = Heads()
+LABEL_BURSTS = Bursts(label_debounce())
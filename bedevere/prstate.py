@@ -0,0 +1,168 @@
+"""Mirror the state of open pull requests from the deliveries about them.
+
+Every ``pull_request`` and ``pull_request_review`` delivery carries the pull
+request's labels, draft flag, head commit, author association and requested
+reviewers, yet handlers used to fetch the pull request's issue again to read
+its labels. The mirror remembers what the latest delivery about each open pull
+request said, and util.issue_for_PR() and the label checks of util.labels()
+and stage.stage() consult it before going to the API.
+
+A delivery older than what the mirror already has (by ``updated_at``) doesn't
+overwrite it. State not refreshed by a delivery within MAX_AGE seconds is
+treated as stale and fetched again, as is the state of pull requests whose
+labels bedevere itself has just changed.
+"""
+
+import time
+from typing import Any, NamedTuple
+
+import cachetools
+from gidgethub import sansio
+
+from . import metrics
+
+# Seconds the state of a pull request is used for without a new delivery.
+MAX_AGE = 5 * 60
+MAX_PULL_REQUESTS = 5_000
+
+HIT = metrics.CACHE_LOOKUPS.labels("pull_requests", "hit")
+MISS = metrics.CACHE_LOOKUPS.labels("pull_requests", "miss")
+STALE = metrics.CACHE_LOOKUPS.labels("pull_requests", "stale")
+MIRRORED = metrics.Gauge(
+    "bedevere_pull_requests_mirrored", "Open pull requests whose state is mirrored."
+)
+
+
+class State(NamedTuple):
+    """What the latest delivery said about an open pull request."""
+
+    # The REST API URL of the pull request's issue.
+    issue_url: str
+    # The REST API URL of the pull request.
+    url: str
+    author: str
+    author_association: str
+    draft: bool
+    head_sha: str
+    labels: tuple[str, ...]
+    requested_reviewers: tuple[str, ...]
+    updated_at: str
+    # time.monotonic() when the delivery was received.
+    seen_at: float
+
+    def issue(self) -> dict[str, Any]:
+        """Return the parts of the pull request's issue bedevere uses."""
+        return {
+            "url": self.issue_url,
+            "number": int(self.issue_url.rpartition("/")[2]),
+            "user": {"login": self.author},
+            "labels": [{"name": name} for name in self.labels],
+            "labels_url": f"{self.issue_url}/labels{{/name}}",
+            "comments_url": f"{self.issue_url}/comments",
+            "updated_at": self.updated_at,
+            "pull_request": {"url": self.url},
+        }
+
+
+def _issue_url(item: dict[str, Any]) -> str | None:
+    # Pull requests link to their issue; issues (and search results) are it.
+    return item.get("issue_url") or item.get("url")
+
+
+class Mirror:
+    """The state of recently updated open pull requests, by issue URL."""
+
+    def __init__(
+        self, *, maxsize: int = MAX_PULL_REQUESTS, max_age: float = MAX_AGE
+    ) -> None:
+        self.max_age = max_age
+        self._states: cachetools.LRUCache = cachetools.LRUCache(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def update(self, event: sansio.Event) -> None:
+        """Record the state of the pull request the delivery is about, if any."""
+        pull_request = event.data.get("pull_request") or {}
+        issue = event.data.get("issue") or {}
+        # Without "updated_at" a delivery can't be ordered against others.
+        if "issue_url" in pull_request and "updated_at" in pull_request:
+            self._update_pull_request(pull_request)
+        elif "pull_request" in issue and "updated_at" in issue:
+            self._update_labels(issue)
+
+    def _update_pull_request(self, pull_request: dict[str, Any]) -> None:
+        issue_url = pull_request["issue_url"]
+        if pull_request["state"] != "open":
+            self._states.pop(issue_url, None)
+            return
+        current = self._states.get(issue_url)
+        if current is not None and current.updated_at > pull_request["updated_at"]:
+            # An older delivery, which arrived late.
+            return
+        self._states[issue_url] = State(
+            issue_url=issue_url,
+            url=pull_request["url"],
+            author=pull_request["user"]["login"],
+            author_association=pull_request["author_association"],
+            draft=pull_request.get("draft", False),
+            head_sha=pull_request["head"]["sha"],
+            labels=tuple(label["name"] for label in pull_request["labels"]),
+            requested_reviewers=tuple(
+                user["login"] for user in pull_request.get("requested_reviewers", [])
+            ),
+            updated_at=pull_request["updated_at"],
+            seen_at=time.monotonic(),
+        )
+
+    def _update_labels(self, issue: dict[str, Any]) -> None:
+        # Issue deliveries (e.g. comments) only carry the labels.
+        current = self._states.get(issue["url"])
+        if current is None or current.updated_at > issue["updated_at"]:
+            return
+        if issue["state"] != "open":
+            del self._states[issue["url"]]
+            return
+        self._states[issue["url"]] = current._replace(
+            labels=tuple(label["name"] for label in issue["labels"]),
+            updated_at=issue["updated_at"],
+            seen_at=time.monotonic(),
+        )
+
+    def get(self, item: dict[str, Any]) -> State | None:
+        """Return the state of a pull request (or its issue), unless it's stale."""
+        issue_url = _issue_url(item)
+        state = self._states.get(issue_url) if issue_url else None
+        if state is None:
+            MISS.inc()
+            return None
+        if time.monotonic() - state.seen_at > self.max_age:
+            STALE.inc()
+            return None
+        HIT.inc()
+        return state
+
+    def labels(self, item: dict[str, Any]) -> list[str]:
+        """Return the labels of a pull request or issue, as of the latest news.
+
+        The item's own labels are used unless the mirror has newer ones, so
+        e.g. a stale search result doesn't undo a label change.
+        """
+        names = [label["name"] for label in item["labels"]]
+        if "updated_at" not in item:
+            return names
+        state = self._states.get(_issue_url(item))
+        if state is None or state.updated_at <= item["updated_at"]:
+            return names
+        return list(state.labels)
+
+    def forget(self, issue_url: str) -> None:
+        """Forget a pull request whose labels bedevere changed."""
+        self._states.pop(issue_url, None)
+
+    def clear(self) -> None:
+        self._states.clear()
+
+
+MIRROR = Mirror()
+MIRRORED.set_function(lambda: len(MIRROR))
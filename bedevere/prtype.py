@@ -3,7 +3,7 @@
 import enum
 import pathlib
 
-from . import util
+from . import mutations, util
 
 TYPE_LABEL_PREFIX = "type"
 
@@ -21,15 +21,18 @@ class Labels(enum.Enum):
     skip_news = "skip news"
 
 
-async def add_labels(gh, issue, labels):
+async def add_labels(gh, issue, labels, plan=None):
     """Add the specified labels to the PR."""
-    current_labels = util.labels(issue)
+    writes = mutations.writer(gh, plan)
+    current_labels = writes.labels(issue)
     label_names = [c.value for c in labels if c.value not in current_labels]
     if label_names:
-        await gh.post(issue["labels_url"], data=label_names)
+        await writes.add_labels(issue, label_names)
 
 
-async def classify_by_filepaths(gh, pull_request, filenames):
+async def classify_by_filepaths(
+    gh, pull_request, filenames, *, snapshots=None, plan=None
+):
     """Categorize the pull request based on the files it has modified.
 
     If any paths are found which do not fall within a specific classification,
@@ -38,7 +41,7 @@ async def classify_by_filepaths(gh, pull_request, filenames):
     The routing is handled by the filepaths module.
     """
     pr_labels = []
-    issue = await util.issue_for_PR(gh, pull_request)
+    issue = await util.issue_for_PR(gh, pull_request, snapshots)
     news = docs = tests = False
     for filename in filenames:
         if util.is_news_dir(filename):
@@ -57,5 +60,5 @@ async def classify_by_filepaths(gh, pull_request, filenames):
             pr_labels = [Labels.docs]
         else:
             pr_labels = [Labels.docs, Labels.skip_news]
-    await add_labels(gh, issue, pr_labels)
+    await add_labels(gh, issue, pr_labels, plan)
     return pr_labels
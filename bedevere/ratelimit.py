@@ -0,0 +1,237 @@
+"""Spend what is left of each installation's rate limit on the work that matters.
+
+Every write to GitHub is classified by what it does. Statuses, which merges
+wait on, only wait once the quota is gone entirely. Reads, which are needed to
+decide what to do, are never held back: once the quota is gone they're
+dropped, as nothing would be waiting for their response by the time it resets.
+As an installation's remaining quota
+falls below the reserve kept back for more important work, less important
+writes are queued and made once the rate limit resets, or are dropped if the
+reset is too far away or too much work is already queued. Queued writes don't
+hold up the delivery which asked for them; they're kept in memory, so a
+restart loses them.
+"""
+
+import asyncio
+import enum
+import json
+import re
+import sys
+import time
+
+import aiohttp
+from gidgethub import sansio
+
+from . import client, metrics, retry, tokens
+
+
+@enum.unique
+class Priority(enum.IntEnum):
+    READ = 0
+    STATUS = 1
+    LABEL = 2
+    BODY = 3
+    COMMENT = 4
+
+
+# Fraction of the rate limit kept back for more important work.
+RESERVES = {
+    Priority.READ: 0.0,
+    Priority.STATUS: 0.0,
+    Priority.LABEL: 0.02,
+    Priority.BODY: 0.05,
+    Priority.COMMENT: 0.1,
+}
+# Work is dropped rather than held for longer than this many seconds.
+MAX_DEFER = 15 * 60
+# How many requests may be queued at once, across installations.
+MAX_DEFERRED = 100
+
+_BODY_RE = re.compile(r"/(issues|pulls)/\{number\}$")
+
+DEFERRED = metrics.Counter(
+    "bedevere_deferred_requests_total",
+    "Requests queued until the rate limit reset.",
+    ("priority",),
+)
+DROPPED = metrics.Counter(
+    "bedevere_dropped_requests_total",
+    "Requests dropped because the rate limit was too low.",
+    ("priority",),
+)
+_DEFERRED = {priority: DEFERRED.labels(priority.name.lower()) for priority in Priority}
+_DROPPED = {priority: DROPPED.labels(priority.name.lower()) for priority in Priority}
+
+
+def _only_edits_body(body: bytes) -> bool:
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.keys() == {"body"}
+
+
+def classify(method: str, url_template: str, body: bytes = b"") -> Priority:
+    """Classify a request to the GitHub API by what it does."""
+    if client.is_read(method, url_template):
+        return Priority.READ
+    if "/statuses/" in url_template:
+        return Priority.STATUS
+    if url_template.endswith("/comments"):
+        return Priority.COMMENT
+    # Not e.g. closing a pull request, which is the same endpoint.
+    if method == "PATCH" and _BODY_RE.search(url_template) and _only_edits_body(body):
+        return Priority.BODY
+    # Labels, review requests, and anything else that moves a PR along.
+    return Priority.LABEL
+
+
+class Scheduler:
+    """Track each installation's rate limit and hold back low-priority work."""
+
+    def __init__(
+        self,
+        *,
+        reserves: dict[Priority, float] = RESERVES,
+        max_defer: float = MAX_DEFER,
+        max_deferred: int = MAX_DEFERRED,
+    ) -> None:
+        self.reserves = reserves
+        self.max_defer = max_defer
+        self.max_deferred = max_deferred
+        self.deferred = 0
+        # Installation ID -> (limit, remaining, reset epoch)
+        self._quotas: dict[int | str, tuple[int, int, float]] = {}
+        # Installation ID -> the requests queued until its rate limit resets.
+        self._queues: dict[int | str, list[client.Request]] = {}
+        self._flushes: dict[int | str, asyncio.Task] = {}
+
+    def update(self, installation_id: int | str, headers) -> None:
+        """Record the rate limit reported in a response's headers."""
+        if headers.get("x-ratelimit-resource", "core") != "core":
+            # E.g. GraphQL queries have their own, points-based, rate limit.
+            return
+        rate_limit = sansio.RateLimit.from_http(headers)
+        if rate_limit is not None:
+            reset = rate_limit.reset_datetime.timestamp()
+            self._quotas[installation_id] = (
+                rate_limit.limit,
+                rate_limit.remaining,
+                reset,
+            )
+
+    def _allowed(self, installation_id: int | str, reserve: float) -> float:
+        """Return 0 if more than the reserve is left, else how long until the reset."""
+        try:
+            limit, remaining, reset = self._quotas[installation_id]
+        except KeyError:
+            return 0
+        wait = reset - time.time()
+        if wait <= 0 or remaining > limit * reserve:
+            return 0
+        return wait
+
+    def acquire(
+        self, installation_id: int | str, url_template: str, request: client.Request
+    ) -> None:
+        """Return if the request may be made now.
+
+        Otherwise queue it until the rate limit resets and raise
+        client.RequestDeferred, or raise client.RequestDropped.
+        """
+        priority = classify(request.method, url_template, request.body)
+        wait = self._allowed(installation_id, self.reserves[priority])
+        if wait:
+            self.defer(installation_id, url_template, request, wait)
+
+    def defer(
+        self,
+        installation_id: int | str,
+        url_template: str,
+        request: client.Request,
+        wait: float,
+    ) -> None:
+        """Queue the request to be made in wait seconds, and raise RequestDeferred.
+
+        Raise client.RequestDropped instead for reads, if that's too long, or
+        if too much is queued already. Requests queued for an installation are
+        made together, when the first of them is due.
+        """
+        priority = classify(request.method, url_template, request.body)
+        name = priority.name.lower()
+        if (
+            priority is Priority.READ
+            or wait > self.max_defer
+            or self.deferred >= self.max_deferred
+        ):
+            _DROPPED[priority].inc()
+            raise client.RequestDropped(
+                f"{name} request for installation {installation_id} dropped as"
+                " the rate limit is too low"
+            )
+        _DEFERRED[priority].inc()
+        self._queues.setdefault(installation_id, []).append(request)
+        self.deferred += 1
+        if installation_id not in self._flushes:
+            self._flushes[installation_id] = asyncio.create_task(
+                self._flush(installation_id, wait)
+            )
+        raise client.RequestDeferred(
+            f"{name} request for installation {installation_id} deferred for"
+            f" {wait:.0f}s until the rate limit resets"
+        )
+
+    async def _flush(self, installation_id: int | str, wait: float) -> None:
+        await asyncio.sleep(wait)
+        # The rate limit has been reset.
+        self._quotas.pop(installation_id, None)
+        del self._flushes[installation_id]
+        queue = self._queues.pop(installation_id)
+        self.deferred -= len(queue)
+        print(
+            f"Making {len(queue)} deferred requests for installation"
+            f" {installation_id}",
+            file=sys.stderr,
+        )
+        async with aiohttp.ClientSession() as session:
+            gh = client.from_environ(
+                session, scheduler=self, write_limiters=retry.WRITE_LIMITERS
+            )
+            gh.observers.append(metrics.observe_request)
+            try:
+                gh.oauth_token = await tokens.installation_token(gh, installation_id)
+            except Exception as exc:
+                print(f"Dropping deferred requests: {exc!r}", file=sys.stderr)
+                return
+            gh.installation_id = installation_id
+            # In the order they were asked for.
+            for request in queue:
+                failed = f"Deferred {request.method} {request.url} failed"
+                try:
+                    status, _, _ = await request.send(gh)
+                except client.RequestDropped as exc:
+                    print(exc, file=sys.stderr)
+                except Exception as exc:
+                    print(f"{failed}: {exc!r}", file=sys.stderr)
+                else:
+                    if status >= 400:
+                        print(f"{failed}: HTTP {status}", file=sys.stderr)
+
+    async def wait(self, installation_id: int | str, reserve: float) -> None:
+        """Wait until more than the reserve fraction of the rate limit is left.
+
+        For work which can wait, e.g. catching up on missed deliveries.
+        """
+        wait = self._allowed(installation_id, reserve)
+        if not wait:
+            return
+        print(
+            f"Waiting {wait:.0f}s for the rate limit of installation"
+            f" {installation_id} to reset",
+            file=sys.stderr,
+        )
+        await asyncio.sleep(wait)
+        self._quotas.pop(installation_id, None)
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,346 @@
+"""Bring the labels and statuses of every open pull request up to date.
+
+Bedevere only updates a pull request when a delivery about it arrives, so
+deliveries lost in an incident, or a change to the checks themselves, leave
+pull requests in the wrong stage or with stale statuses. Reconciling walks
+every open pull request, a page at a time with the OpenPullRequests GraphQL
+query, and works out what the stage label and the news, issue number and
+maintenance branch statuses should be with the same functions the webhook
+handlers use. Only the labels and statuses which differ are written; comments
+the checks would leave are not.
+
+The query returns what the checks need (labels, reviews, files and the
+statuses of the head commit), so most pull requests cost no REST requests
+beyond the writes which fix them; core developers are looked up once for the
+whole run. Like catching up (see bedevere.catchup), reconciling waits for the
+rate limit to reset when less than RESERVE of it is left.
+
+Run ``python -m bedevere reconcile --dry-run`` to see the changes without
+making them. With ``--checkpoint FILE``, the cursor of the next page is saved
+after each page and an interrupted run resumes from it.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Any
+
+import aiohttp
+from gidgethub import sansio
+
+from . import (  # isort: skip
+    backport,
+    client,
+    gh_issue,
+    mutations,
+    news,
+    ratelimit,
+    retry,
+    snapshot,
+    stage,
+    tokens,
+    util,
+)
+
+QUERY = """\
+query OpenPullRequests($owner: String!, $name: String!, $cursor: String) {
+  rateLimit { limit remaining resetAt }
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: OPEN, first: 50, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        title
+        body
+        author { login }
+        authorAssociation
+        baseRefName
+        isDraft
+        headRefOid
+        labels(first: 100) { nodes { name } }
+        latestOpinionatedReviews(first: 100) { nodes { author { login } state } }
+        files(first: 100) {
+          nodes { path additions deletions }
+          pageInfo { hasNextPage }
+        }
+        commits(last: 1) {
+          nodes {
+            commit {
+              status { contexts { context state description targetUrl } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Pull requests checked at once.
+CONCURRENCY = 8
+# Fraction of the rate limits left for new deliveries.
+RESERVE = 0.25
+
+
+def _same(current: dict[str, Any] | None, status: dict[str, Any]) -> bool:
+    if current is None:
+        return False
+    same_state = current["state"].lower() == status["state"]
+    return same_state and current["description"] == status.get("description")
+
+
+class Diff(mutations.Plan):
+    """The writes which bring a pull request in line with the checks.
+
+    Statuses the head commit already has are left out, and so are comments:
+    reconciling corrects labels and statuses without repeating what was said.
+    """
+
+    def __init__(self, statuses: dict[str, dict[str, Any]]) -> None:
+        super().__init__()
+        # Context -> the head commit's status, as returned by QUERY.
+        self.statuses = statuses
+
+    async def set_status(self, statuses_url: str, status: dict[str, Any]) -> None:
+        if not _same(self.statuses.get(status["context"]), status):
+            await super().set_status(statuses_url, status)
+
+    async def add_comment(self, comments_url: str, body: str) -> None:
+        pass
+
+
+class Progress:
+    """How far reconciling has got."""
+
+    def __init__(
+        self,
+        cursor: str | None = None,
+        checked: int = 0,
+        changed: int = 0,
+        failed: int = 0,
+    ) -> None:
+        # The cursor of the next page of pull requests.
+        self.cursor = cursor
+        self.checked = checked
+        self.changed = changed
+        self.failed = failed
+
+    @classmethod
+    def load(cls, path: str | None) -> "Progress":
+        """Resume from the checkpoint, if there is one."""
+        if path is None or not os.path.exists(path):
+            return cls()
+        with open(path) as file:
+            return cls(**json.load(file))
+
+    def save(self, path: str) -> None:
+        # Replace the checkpoint atomically, so it survives being interrupted.
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(vars(self), file)
+        os.replace(f"{path}.tmp", path)
+
+
+def pull_request(base_url: str, repo: str, node: dict[str, Any]) -> dict[str, Any]:
+    """Turn a pull request returned by QUERY into its REST API representation.
+
+    Only the parts the checks use are filled in.
+    """
+    repo_url = f"{base_url}/repos/{repo}"
+    issue_url = f"{repo_url}/issues/{node['number']}"
+    return {
+        "number": node["number"],
+        "url": f"{repo_url}/pulls/{node['number']}",
+        "issue_url": issue_url,
+        "comments_url": f"{issue_url}/comments",
+        "statuses_url": f"{repo_url}/statuses/{node['headRefOid']}",
+        "title": node["title"],
+        "body": node["body"],
+        "state": "open",
+        "draft": node["isDraft"],
+        "user": {"login": (node["author"] or {}).get("login", "ghost")},
+        "author_association": node["authorAssociation"],
+        "labels": node["labels"]["nodes"],
+        "base": {"ref": node["baseRefName"]},
+        "head": {"sha": node["headRefOid"]},
+    }
+
+
+def _statuses(node: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    commits = node["commits"]["nodes"]
+    status = commits[0]["commit"]["status"] if commits else None
+    if status is None:
+        return {}
+    return {context["context"]: context for context in status["contexts"]}
+
+
+async def _issue_status(gh, pull_request, issue, diff, *, session):
+    match = gh_issue.ISSUE_RE.search(pull_request["title"])
+    if match is not None and not util.skip("issue", issue):
+        found = gh_issue.create_success_status(
+            int(match.group("issue")), kind=match.group("kind").lower()
+        )
+        # An issue never stops being an issue, so don't look it up again.
+        if _same(diff.statuses.get(gh_issue.STATUS_CONTEXT), found):
+            return found
+    status, _ = await gh_issue.issue_status(gh, pull_request, issue, session=session)
+    return status
+
+
+async def check(gh, pull_request, snapshots, diff, *, core_devs, session) -> None:
+    """Plan the changes to a pull request its snapshot calls for."""
+    pr_snapshot = await snapshots.load(pull_request["url"])
+    issue = pr_snapshot.issue()
+    if pr_snapshot.draft:
+        await stage._remove_stage_labels(gh, issue, diff)
+    else:
+        blockers = stage.expected_blockers(
+            pr_snapshot.author, pr_snapshot.reviews, core_devs
+        )
+        labels = diff.labels(issue)
+        if not any(blocker.value in labels for blocker in blockers):
+            await stage.stage(gh, issue, blockers[0], diff)
+    await news.check_news(gh, pull_request, snapshots=snapshots, plan=diff)
+    status = await _issue_status(gh, pull_request, issue, diff, session=session)
+    await diff.set_status(pull_request["statuses_url"], status)
+    event = sansio.Event(
+        {"action": "synchronize", "pull_request": pull_request},
+        event="pull_request",
+        delivery_id=f"reconcile-{pull_request['number']}",
+    )
+    await backport.validate_maintenance_branch_pr(event, gh, plan=diff)
+
+
+async def _wait_for_graphql(rate_limit: dict[str, Any], reserve: float) -> None:
+    if rate_limit["remaining"] > rate_limit["limit"] * reserve:
+        return
+    reset = datetime.datetime.strptime(
+        rate_limit["resetAt"], "%Y-%m-%dT%H:%M:%S%z"
+    ).timestamp()
+    wait = max(reset - time.time(), 0)
+    print(f"Waiting {wait:.0f}s for the GraphQL rate limit to reset", file=sys.stderr)
+    await asyncio.sleep(wait)
+
+
+class _Installation:
+    """Keep the client authenticated as the app's installation on the repo."""
+
+    def __init__(self, gh: client.GitHubAPI, repo: str) -> None:
+        self.gh = gh
+        self.repo = repo
+
+    async def renew(self) -> None:
+        """Get a new token if the current one is about to expire."""
+        if self.gh.installation_id is None:
+            installation = await self.gh.getitem(
+                f"/repos/{self.repo}/installation", jwt=tokens.app_jwt()
+            )
+            self.gh.installation_id = installation["id"]
+        self.gh.oauth_token = await tokens.installation_token(
+            self.gh, self.gh.installation_id
+        )
+
+
+async def reconcile(
+    *,
+    repo: str = "python/cpython",
+    dry_run: bool = False,
+    concurrency: int = CONCURRENCY,
+    checkpoint: str | None = None,
+    reserve: float = RESERVE,
+) -> Progress:
+    """Reconcile every open pull request of the repository.
+
+    The changes are printed, and only made if it isn't a dry run. Dry runs
+    don't save checkpoints.
+    """
+    owner, name = repo.split("/")
+    progress = Progress.load(checkpoint)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        gh = client.from_environ(
+            session,
+            scheduler=ratelimit.SCHEDULER,
+            write_limiters=retry.WRITE_LIMITERS,
+        )
+        installation = _Installation(gh, repo)
+        await installation.renew()
+        core_devs = await util.core_devs(gh)
+        snapshots = snapshot.Loader(gh)
+
+        async def plan(pull_request, statuses):
+            diff = Diff(statuses)
+            async with semaphore:
+                await check(
+                    gh,
+                    pull_request,
+                    snapshots,
+                    diff,
+                    core_devs=core_devs,
+                    session=session,
+                )
+            return diff
+
+        async def apply(diff):
+            async with semaphore:
+                await diff.apply(gh)
+
+        while True:
+            await installation.renew()
+            await ratelimit.SCHEDULER.wait(gh.installation_id, reserve)
+            data = await gh.graphql(
+                QUERY,
+                endpoint=f"{gh.base_url}/graphql",
+                owner=owner,
+                name=name,
+                cursor=progress.cursor,
+            )
+            page = data["repository"]["pullRequests"]
+            pull_requests = [pull_request(gh.base_url, repo, n) for n in page["nodes"]]
+            # Add every snapshot before checking: applying label changes
+            # (below) makes the loader forget them.
+            for pr, node in zip(pull_requests, page["nodes"]):
+                snapshot_data = {"repository": {"pullRequest": node}}
+                snapshots.add(snapshot.parse(pr["url"], snapshot_data))
+            diffs = await asyncio.gather(
+                *(
+                    plan(pr, _statuses(node))
+                    for pr, node in zip(pull_requests, page["nodes"])
+                ),
+                return_exceptions=True,
+            )
+            changed = {}
+            for pr, diff in zip(pull_requests, diffs):
+                if isinstance(diff, Exception):
+                    progress.failed += 1
+                    print(f"#{pr['number']}: check failed: {diff!r}", file=sys.stderr)
+                elif changes := diff.describe():
+                    changed[pr["number"]] = diff
+                    print(f"#{pr['number']}: {'; '.join(changes)}")
+            progress.checked += len(pull_requests)
+            progress.changed += len(changed)
+            if not dry_run:
+                results = await asyncio.gather(
+                    *(apply(diff) for diff in changed.values()), return_exceptions=True
+                )
+                for number, result in zip(changed, results):
+                    if isinstance(result, Exception):
+                        progress.failed += 1
+                        print(f"#{number}: changes failed: {result!r}", file=sys.stderr)
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            progress.cursor = page["pageInfo"]["endCursor"]
+            if checkpoint is not None and not dry_run:
+                progress.save(checkpoint)
+            await _wait_for_graphql(data["rateLimit"], reserve)
+    if checkpoint is not None and not dry_run and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    verb = "need changing" if dry_run else "changed"
+    print(
+        f"Checked {progress.checked} pull requests: {progress.changed} {verb},"
+        f" {progress.failed} failed",
+        file=sys.stderr,
+    )
+    return progress
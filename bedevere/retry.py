@@ -0,0 +1,130 @@
+"""Retrying requests GitHub turned away, and pacing writes so it doesn't.
+
+GitHub answers bursts of content-creating requests with a "secondary rate
+limit" 403 (or 429) and a Retry-After header, and occasionally fails with a
+502 or similar. Such requests are retried after the Retry-After delay or a
+jittered exponential backoff. Only short delays are waited out while handling
+a delivery, which GitHub gives up on after 10 seconds; writes which have to
+wait longer are queued by the scheduler (see bedevere.ratelimit), and reads
+give up.
+
+Writes for each installation are also limited in how many may be in flight
+at once. The limit grows by one for every limit's worth of successful writes
+and halves whenever GitHub pushes back (additive increase, multiplicative
+decrease).
+"""
+
+import asyncio
+import contextlib
+import random
+from collections.abc import AsyncIterator, Mapping
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# Give up instead of waiting longer than this many seconds for a retry.
+MAX_RETRY_AFTER = 120.0
+# Retries which would keep the delivery waiting longer than this many seconds
+# are left to the scheduler.
+MAX_INLINE_DELAY = 5.0
+SERVER_ERRORS = frozenset({500, 502, 503, 504})
+
+INITIAL_WRITE_CONCURRENCY = 4
+MAX_WRITE_CONCURRENCY = 16
+
+
+def is_throttled(status: int, headers: Mapping[str, str], body: bytes) -> bool:
+    """Whether the response is GitHub asking to slow down."""
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    if "retry-after" in headers:
+        return True
+    return b"secondary rate limit" in body.lower()
+
+
+def backoff(attempt: int) -> float:
+    """Return a random delay of up to BACKOFF_BASE * 2 ** attempt seconds."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def retry_delay(
+    method: str,
+    url_template: str,
+    attempt: int,
+    status: int,
+    headers: Mapping[str, str],
+    body: bytes,
+) -> float | None:
+    """Return how long to wait before retrying the request, or None to not retry."""
+    if attempt + 1 >= MAX_ATTEMPTS:
+        return None
+    if is_throttled(status, headers, body):
+        try:
+            delay = float(headers["retry-after"])
+        except (KeyError, ValueError):
+            # GitHub asks to wait at least a minute if it doesn't say.
+            delay = 60.0
+        # Spread out the retries of everything throttled at the same time.
+        delay += backoff(0)
+        return delay if delay <= MAX_RETRY_AFTER else None
+    if status in SERVER_ERRORS:
+        # Creating a comment may have worked despite the error, and a
+        # duplicate comment is worse than a missing one.
+        if method == "POST" and url_template.endswith("/comments"):
+            return None
+        return backoff(attempt)
+    return None
+
+
+class WriteLimiter:
+    """Limit the number of writes in flight, adapting to GitHub's pushback."""
+
+    def __init__(
+        self,
+        initial: int = INITIAL_WRITE_CONCURRENCY,
+        maximum: int = MAX_WRITE_CONCURRENCY,
+    ) -> None:
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def succeeded(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def throttled(self) -> None:
+        self.limit = max(1.0, self.limit / 2)
+
+
+class WriteLimiters:
+    """The write limiter of each installation."""
+
+    def __init__(self) -> None:
+        self._limiters: dict[int | str, WriteLimiter] = {}
+
+    def __getitem__(self, installation_id: int | str) -> WriteLimiter:
+        try:
+            return self._limiters[installation_id]
+        except KeyError:
+            limiter = self._limiters[installation_id] = WriteLimiter()
+            return limiter
+
+    def clear(self) -> None:
+        self._limiters.clear()
+
+
+WRITE_LIMITERS = WriteLimiters()
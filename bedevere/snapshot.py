@@ -0,0 +1,144 @@
+"""Load what handlers need to know about a pull request in one GraphQL query.
+
+Deciding a stage label or classifying a pull request needs its labels, its
+reviews and its files, which is several REST requests plus pagination. A
+Loader is created for each delivery and passed to the handlers as the
+``snapshots`` keyword argument; handlers called without one (or for which the
+query fails) fall back to the REST API.
+"""
+
+import re
+import sys
+from typing import Any, NamedTuple
+
+import gidgethub
+
+from . import client
+
+QUERY = """\
+query PullRequestSnapshot($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      author { login }
+      isDraft
+      headRefOid
+      labels(first: 100) { nodes { name } }
+      latestOpinionatedReviews(first: 100) { nodes { author { login } state } }
+      files(first: 100) {
+        nodes { path additions deletions }
+        pageInfo { hasNextPage }
+      }
+    }
+  }
+}
+"""
+
+PULL_REQUEST_URL_RE = re.compile(
+    r"/repos/(?P<owner>[^/]+)/(?P<name>[^/]+)/pulls/(?P<number>\d+)$"
+)
+
+
+class Snapshot(NamedTuple):
+    """The state of a pull request."""
+
+    # The pull request's REST API URL.
+    url: str
+    author: str
+    draft: bool
+    head_sha: str
+    labels: tuple[str, ...]
+    # (login, state) of the latest approval or change request of each reviewer.
+    reviews: tuple[tuple[str, str], ...]
+    # In the shape returned by util.files_for_PR(), or None if the pull
+    # request has too many files for a single query.
+    files: list[dict[str, Any]] | None
+
+    def issue(self) -> dict[str, Any]:
+        """Return the parts of the pull request's issue bedevere uses."""
+        issue_url = self.url.replace("/pulls/", "/issues/")
+        return {
+            "url": issue_url,
+            "number": int(self.url.rpartition("/")[2]),
+            "user": {"login": self.author},
+            "labels": [{"name": name} for name in self.labels],
+            "labels_url": f"{issue_url}/labels{{/name}}",
+            "comments_url": f"{issue_url}/comments",
+            "pull_request": {"url": self.url},
+        }
+
+
+def parse(url: str, data: dict[str, Any]) -> Snapshot:
+    """Turn the data returned for QUERY into a Snapshot."""
+    pull_request = data["repository"]["pullRequest"]
+    files = pull_request["files"]
+    return Snapshot(
+        url=url,
+        author=(pull_request["author"] or {}).get("login", "ghost"),
+        draft=pull_request["isDraft"],
+        head_sha=pull_request["headRefOid"],
+        labels=tuple(label["name"] for label in pull_request["labels"]["nodes"]),
+        reviews=tuple(
+            ((review["author"] or {}).get("login", "ghost"), review["state"].lower())
+            for review in pull_request["latestOpinionatedReviews"]["nodes"]
+        ),
+        files=(
+            None
+            if files["pageInfo"]["hasNextPage"]
+            else [
+                {
+                    "file_name": file["path"],
+                    "changes": file["additions"] + file["deletions"],
+                }
+                for file in files["nodes"]
+            ]
+        ),
+    )
+
+
+class Loader:
+    """Load and remember snapshots for the duration of a delivery.
+
+    Snapshots are forgotten whenever a handler changes the labels of an issue
+    or pull request, so later handlers don't act on stale labels. Nothing else
+    in a snapshot is changed by bedevere (bodies and titles aren't loaded).
+    """
+
+    _LABELS_RE = re.compile(r"/issues/\{number\}/labels\b")
+
+    def __init__(self, gh: client.GitHubAPI) -> None:
+        self.gh = gh
+        self._snapshots: dict[str, Snapshot | None] = {}
+        gh.observers.append(self._observe)
+
+    def _observe(self, record: client.RequestRecord) -> None:
+        if record.is_write and self._LABELS_RE.search(record.url):
+            self._snapshots.clear()
+
+    def add(self, snapshot: Snapshot) -> None:
+        """Remember a snapshot loaded some other way, e.g. in bulk."""
+        self._snapshots[snapshot.url] = snapshot
+
+    async def load(self, pull_request_url: str) -> Snapshot | None:
+        """Return the snapshot of the pull request, or None if it can't be loaded."""
+        try:
+            return self._snapshots[pull_request_url]
+        except KeyError:
+            pass
+        snapshot = None
+        if match := PULL_REQUEST_URL_RE.search(pull_request_url):
+            try:
+                data = await self.gh.graphql(
+                    QUERY,
+                    endpoint=f"{self.gh.base_url}/graphql",
+                    owner=match.group("owner"),
+                    name=match.group("name"),
+                    number=int(match.group("number")),
+                )
+            except gidgethub.GitHubException as exc:
+                print(
+                    f"Snapshot of {pull_request_url} failed: {exc!r}", file=sys.stderr
+                )
+            else:
+                snapshot = parse(pull_request_url, data)
+        self._snapshots[pull_request_url] = snapshot
+        return snapshot
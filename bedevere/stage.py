@@ -12,7 +12,7 @@ import random
 
 import gidgethub.routing
 
-from . import util
+from . import mutations, util
 
 router = gidgethub.routing.Router()
 
@@ -79,34 +79,64 @@ class Blocker(enum.Enum):
     merge = f"{LABEL_PREFIX} merge"
 
 
-async def _remove_stage_labels(gh, issue):
+def expected_blockers(author, reviews, core_devs):
+    """Return what may be blocking a pull request, judging by its reviews.
+
+    The reviews are the (reviewer, state) of each reviewer's latest review.
+    The likeliest blocker comes first; which of the others it is depends on
+    the pull request's history, e.g. whether the author has asked for another
+    review after making the requested changes.
+    """
+    # Ignoring "comment" reviews.
+    reviews = {
+        (reviewer, state)
+        for reviewer, state in reviews
+        if state in {"approved", "changes_requested"}
+    }
+    core_states = {state for reviewer, state in reviews if reviewer in core_devs}
+    blockers = []
+    if "changes_requested" in core_states:
+        blockers += [Blocker.changes, Blocker.change_review]
+    if "approved" in core_states:
+        # A commit pushed after the approval asks for another core review.
+        blockers += [Blocker.merge, Blocker.core_review]
+    if not blockers:
+        if reviews or author in core_devs:
+            blockers.append(Blocker.core_review)
+        else:
+            blockers.append(Blocker.review)
+    return blockers
+
+
+async def _remove_stage_labels(gh, issue, plan=None):
     """Remove all "awaiting" labels."""
+    writes = mutations.writer(gh, plan)
     # There's no reason to expect there to be multiple "awaiting" labels on a
     # single pull request, but just in case there are we might as well clean
     # up the situation when we come across it.
-    for label in issue["labels"]:
-        stale_name = label["name"]
+    for stale_name in writes.labels(issue):
         if stale_name.startswith(LABEL_PREFIX + " "):
-            await gh.delete(issue["labels_url"], {"name": stale_name})
+            await writes.remove_label(issue, stale_name)
 
 
-async def stage(gh, issue, blocked_on):
+async def stage(gh, issue, blocked_on, plan=None):
     """Remove any "awaiting" labels and apply the specified one."""
+    writes = mutations.writer(gh, plan)
     label_name = blocked_on.value
-    if any(label_name == label["name"] for label in issue["labels"]):
+    if label_name in writes.labels(issue):
         return
-    await _remove_stage_labels(gh, issue)
-    await gh.post(issue["labels_url"], data=[label_name])
+    await _remove_stage_labels(gh, issue, plan)
+    await writes.add_labels(issue, [label_name])
 
 
-async def stage_for_review(gh, pull_request):
+async def stage_for_review(gh, pull_request, snapshots=None, plan=None):
     """Apply "awaiting review" label."""
-    issue = await util.issue_for_PR(gh, pull_request)
+    issue = await util.issue_for_PR(gh, pull_request, snapshots)
     username = util.user_login(pull_request)
     if await util.is_core_dev(gh, username):
-        await stage(gh, issue, Blocker.core_review)
+        await stage(gh, issue, Blocker.core_review, plan)
     else:
-        await stage(gh, issue, Blocker.review)
+        await stage(gh, issue, Blocker.review, plan)
 
 
 @router.register("pull_request", action="opened")
@@ -120,20 +150,24 @@ async def opened_pr(event, gh, *arg, **kwargs):
     pull_request = event.data["pull_request"]
     if pull_request.get("draft"):
         return
-    await stage_for_review(gh, pull_request)
+    await stage_for_review(
+        gh, pull_request, kwargs.get("snapshots"), kwargs.get("plan")
+    )
 
 
 @router.register("pull_request", action="converted_to_draft")
 async def pr_converted_to_draft(event, gh, *arg, **kwargs):
     pull_request = event.data["pull_request"]
-    issue = await util.issue_for_PR(gh, pull_request)
-    await _remove_stage_labels(gh, issue)
+    issue = await util.issue_for_PR(gh, pull_request, kwargs.get("snapshots"))
+    await _remove_stage_labels(gh, issue, kwargs.get("plan"))
 
 
 @router.register("pull_request", action="ready_for_review")
 async def draft_pr_published(event, gh, *arg, **kwargs):
     pull_request = event.data["pull_request"]
-    await stage_for_review(gh, pull_request)
+    await stage_for_review(
+        gh, pull_request, kwargs.get("snapshots"), kwargs.get("plan")
+    )
 
 
 @router.register("push")
@@ -153,29 +187,43 @@ async def new_commit_pushed(event, gh, *arg, **kwargs):
                 issue = await util.issue_for_PR(gh, pr)
                 greeting = "There's a new commit after the PR has been approved."
                 await request_core_review(
-                    gh, issue, blocker=Blocker.core_review, greeting=greeting
+                    gh,
+                    issue,
+                    blocker=Blocker.core_review,
+                    greeting=greeting,
+                    snapshots=kwargs.get("snapshots"),
+                    plan=kwargs.get("plan"),
                 )
                 break
 
 
-async def core_dev_reviewers(gh, pull_request_url):
-    """Find the reviewers who are core developers."""
+async def _reviews(gh, pull_request_url, snapshots=None):
+    """Yield the (reviewer, state) of the reviews of a pull request."""
+    if snapshots is not None:
+        snapshot = await snapshots.load(pull_request_url)
+        if snapshot is not None:
+            for review in snapshot.reviews:
+                yield review
+            return
     # Unfortunately the reviews URL is not contained in a pull request's data.
     async for review in gh.getiter(pull_request_url + "/reviews"):
-        reviewer = util.user_login(review)
+        yield util.user_login(review), review["state"].lower()
+
+
+async def core_dev_reviewers(gh, pull_request_url, snapshots=None):
+    """Find the reviewers who are core developers."""
+    async for reviewer, state in _reviews(gh, pull_request_url, snapshots):
         # Ignoring "comment" reviews.
-        actual_review = review["state"].lower() in {"approved", "changes_requested"}
+        actual_review = state in {"approved", "changes_requested"}
         if actual_review and await util.is_core_dev(gh, reviewer):
             yield reviewer
 
 
-async def reviewers(gh, pull_request_url):
+async def reviewers(gh, pull_request_url, snapshots=None):
     """Find any type of reviewers."""
-    # Unfortunately the reviews URL is not contained in a pull request's data.
-    async for review in gh.getiter(pull_request_url + "/reviews"):
-        reviewer = util.user_login(review)
+    async for reviewer, state in _reviews(gh, pull_request_url, snapshots):
         # Ignoring "comment" reviews.
-        actual_review = review["state"].lower() in {"approved", "changes_requested"}
+        actual_review = state in {"approved", "changes_requested"}
         if actual_review:
             yield reviewer
 
@@ -184,6 +232,8 @@ async def reviewers(gh, pull_request_url):
 async def new_review(event, gh, *args, **kwargs):
     """Update the stage based on the latest review."""
     pull_request = event.data["pull_request"]
+    snapshots = kwargs.get("snapshots")
+    plan = kwargs.get("plan")
     review = event.data["review"]
     reviewer = util.user_login(review)
     state = review["state"].lower()
@@ -192,24 +242,23 @@ async def new_review(event, gh, *args, **kwargs):
         return
     elif not await util.is_core_dev(gh, reviewer):
         # Poor-man's asynchronous any().
-        async for _ in core_dev_reviewers(gh, pull_request["url"]):
+        async for _ in core_dev_reviewers(gh, pull_request["url"], snapshots):
             # No need to update the stage as a core developer has already
             # reviewed this PR.
             return
         else:
             # Waiting for a core developer to leave a review.
-            await stage(
-                gh, await util.issue_for_PR(gh, pull_request), Blocker.core_review
-            )
+            issue = await util.issue_for_PR(gh, pull_request, snapshots)
+            await stage(gh, issue, Blocker.core_review, plan)
     else:
         if state == "approved":
             if pull_request["state"] == "open":
-                await stage(
-                    gh, await util.issue_for_PR(gh, pull_request), Blocker.merge
-                )
+                issue = await util.issue_for_PR(gh, pull_request, snapshots)
+                await stage(gh, issue, Blocker.merge, plan)
         elif state == "changes_requested":
-            issue = await util.issue_for_PR(gh, pull_request)
-            if Blocker.changes.value in util.labels(issue):
+            issue = await util.issue_for_PR(gh, pull_request, snapshots)
+            writes = mutations.writer(gh, plan)
+            if Blocker.changes.value in writes.labels(issue):
                 # Contributor already knows what to do for this round of reviews.
                 return
             easter_egg = ""
@@ -221,8 +270,8 @@ async def new_review(event, gh, *args, **kwargs):
                 comment = CORE_DEV_CHANGES_REQUESTED_MESSAGE.format(
                     easter_egg=easter_egg
                 )
-            await stage(gh, issue, Blocker.changes)
-            await gh.post(pull_request["comments_url"], data={"body": comment})
+            await stage(gh, issue, Blocker.changes, plan)
+            await writes.add_comment(pull_request["comments_url"], comment)
         else:  # pragma: no cover
             raise ValueError(f"unexpected review state: {state!r}")
 
@@ -231,21 +280,23 @@ async def new_review(event, gh, *args, **kwargs):
 async def dismissed_review(event, gh, *args, **kwargs):
     """Update the stage based on a dismissed review."""
     pull_request = event.data["pull_request"]
+    snapshots = kwargs.get("snapshots")
+    plan = kwargs.get("plan")
 
     # Poor-man's asynchronous any().
-    async for _ in core_dev_reviewers(gh, pull_request["url"]):
+    async for _ in core_dev_reviewers(gh, pull_request["url"], snapshots):
         # No need to update the label as there is still a core dev review.
         return
     else:
-        async for _ in reviewers(gh, pull_request["url"]):
+        async for _ in reviewers(gh, pull_request["url"], snapshots):
             # Request review from core dev
-            await stage(
-                gh, await util.issue_for_PR(gh, pull_request), Blocker.core_review
-            )
+            issue = await util.issue_for_PR(gh, pull_request, snapshots)
+            await stage(gh, issue, Blocker.core_review, plan)
             return
         else:
             # Waiting for anybody to leave a review.
-            await stage(gh, await util.issue_for_PR(gh, pull_request), Blocker.review)
+            issue = await util.issue_for_PR(gh, pull_request, snapshots)
+            await stage(gh, issue, Blocker.review, plan)
 
 
 @router.register("issue_comment", action="created")
@@ -265,23 +316,32 @@ async def new_comment(event, gh, *args, **kwargs):
         else:
             thanks = BORING_THANKS
         await request_core_review(
-            gh, issue, blocker=Blocker.change_review, greeting=thanks
+            gh,
+            issue,
+            blocker=Blocker.change_review,
+            greeting=thanks,
+            snapshots=kwargs.get("snapshots"),
+            plan=kwargs.get("plan"),
         )
 
 
-async def request_core_review(gh, issue, *, blocker, greeting):
-    await stage(gh, issue, blocker)
+async def request_core_review(
+    gh, issue, *, blocker, greeting, snapshots=None, plan=None
+):
+    await stage(gh, issue, blocker, plan)
     pr_url = issue["pull_request"]["url"]
     # Using a set comprehension to remove duplicates.
     core_devs = ", ".join(
-        {"@" + core_dev async for core_dev in core_dev_reviewers(gh, pr_url)}
+        {"@" + core_dev async for core_dev in core_dev_reviewers(gh, pr_url, snapshots)}
     )
 
     comment = ACK.format(greeting=greeting, core_devs=core_devs)
-    await gh.post(issue["comments_url"], data={"body": comment})
+    await mutations.writer(gh, plan).add_comment(issue["comments_url"], comment)
     # Re-request reviews from core developers based on the new state of the PR.
     reviewers_url = f"{pr_url}/requested_reviewers"
-    reviewers = [core_dev async for core_dev in core_dev_reviewers(gh, pr_url)]
+    reviewers = [
+        core_dev async for core_dev in core_dev_reviewers(gh, pr_url, snapshots)
+    ]
     await gh.post(reviewers_url, data={"reviewers": reviewers})
 
 
@@ -289,5 +349,7 @@ async def request_core_review(gh, issue, *, blocker, greeting):
 async def closed_pr(event, gh, *args, **kwargs):
     """Remove all `awaiting ... ` labels when a PR is merged."""
     if event.data["pull_request"]["merged"]:
-        issue = await util.issue_for_PR(gh, event.data["pull_request"])
-        await _remove_stage_labels(gh, issue)
+        issue = await util.issue_for_PR(
+            gh, event.data["pull_request"], kwargs.get("snapshots")
+        )
+        await _remove_stage_labels(gh, issue, kwargs.get("plan"))
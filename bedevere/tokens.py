@@ -0,0 +1,55 @@
+"""Installation access tokens, reused until shortly before they expire.
+
+Every delivery used to get a new token for its installation, one more request
+to GitHub before any handler ran. Tokens last an hour, so they're kept in
+TOKENS and reused until less than MARGIN seconds are left.
+"""
+
+import datetime
+import os
+import time
+
+from gidgethub import apps
+
+from . import caches, metrics
+
+# Installation tokens last an hour.
+TTL = 60 * 60
+# Tokens aren't handed out with less than this many seconds left.
+MARGIN = 5 * 60
+
+HIT = metrics.CACHE_LOOKUPS.labels("installation_tokens", "hit")
+MISS = metrics.CACHE_LOOKUPS.labels("installation_tokens", "miss")
+
+# Installation ID -> {"token": ..., "expires_at": epoch time}.
+TOKENS = caches.Cache("installation_tokens", maxsize=100, ttl=TTL, warm_start=True)
+
+
+def app_jwt() -> str:
+    """Return a JWT authenticating as the app itself."""
+    # JWTs expire after ten minutes, so make one for each request.
+    return apps.get_jwt(
+        app_id=os.environ.get("GH_APP_ID"),
+        private_key=os.environ.get("GH_PRIVATE_KEY"),
+    )
+
+
+async def installation_token(gh, installation_id: int) -> str:
+    """Return an access token for the installation, reusing a recent one."""
+    token = await TOKENS.fetch(installation_id)
+    if token is not None and token["expires_at"] - time.time() > MARGIN:
+        HIT.inc()
+        return token["token"]
+    MISS.inc()
+    issued = await apps.get_installation_access_token(
+        gh,
+        installation_id=installation_id,
+        app_id=os.environ.get("GH_APP_ID"),
+        private_key=os.environ.get("GH_PRIVATE_KEY"),
+    )
+    # fromisoformat() only takes the trailing "Z" from Python 3.11 on.
+    expires_at = datetime.datetime.strptime(
+        issued["expires_at"], "%Y-%m-%dT%H:%M:%S%z"
+    ).timestamp()
+    TOKENS[installation_id] = {"token": issued["token"], "expires_at": expires_at}
+    return issued["token"]
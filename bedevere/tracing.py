@@ -0,0 +1,55 @@
+"""Sentry performance tracing of webhook deliveries.
+
+Each delivery is a transaction, with a child span per router handler and
+nested spans for the requests the handlers make. Set the
+SENTRY_TRACES_SAMPLE_RATE environment variable to the fraction of deliveries
+to trace; nothing is traced by default. Spans are only created for sampled
+deliveries, so the rest pay next to nothing.
+"""
+
+import contextlib
+import os
+from collections.abc import Iterator
+
+import sentry_sdk
+from gidgethub import sansio
+from sentry_sdk.tracing import NoOpSpan, Span
+
+_NO_SPAN = NoOpSpan()
+
+
+def sample_rate() -> float | None:
+    """The fraction of deliveries to trace, or None to disable tracing."""
+    rate = os.environ.get("SENTRY_TRACES_SAMPLE_RATE")
+    return float(rate) if rate else None
+
+
+def span(op: str, name: str) -> Span:
+    """Start a child of the current span, if it is being sampled."""
+    parent = sentry_sdk.get_current_span()
+    if parent is None or not parent.sampled:
+        return _NO_SPAN
+    return parent.start_child(op=op, name=name)
+
+
+@contextlib.contextmanager
+def delivery(event: sansio.Event) -> Iterator[Span]:
+    """Trace the handling of a delivery as a transaction named after the event.
+
+    Deliveries are handled after GitHub has its response, so the transaction
+    is separate from the request's (if Sentry's aiohttp integration started
+    one), though part of the same trace.
+    """
+    action = event.data.get("action")
+    name = f"{event.event}.{action}" if action else event.event
+    with sentry_sdk.isolation_scope():
+        request = sentry_sdk.get_current_scope().transaction
+        trace = {}
+        if request is not None:
+            trace = {"trace_id": request.trace_id, "parent_span_id": request.span_id}
+        with sentry_sdk.start_transaction(
+            op="webhook", name=name, **trace
+        ) as transaction:
+            transaction.set_tag("github.event", event.event)
+            transaction.set_tag("github.delivery", event.delivery_id)
+            yield transaction
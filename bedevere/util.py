@@ -1,11 +1,20 @@
+import asyncio
 import enum
+import functools
 import re
 import sys
-from typing import Any
+import traceback
+import weakref
+from collections.abc import Iterable
+from typing import Any, NamedTuple
 
+import aiohttp
+import cachetools
 import gidgethub
 from gidgethub.abc import GitHubAPI
 
+from . import caches, metrics, mutations, prstate
+
 NEWS_NEXT_DIR = "Misc/NEWS.d/next/"
 PR = "pr"
 ISSUE = "issue"
@@ -32,13 +41,27 @@ ISSUE_BODY_TASK_LIST_TEMPLATE = f"""\n
 {ISSUE_BODY_CLOSING_TAG}
 """
 
-# Regex pattern to search for tasklist in the issue body
-ISSUE_BODY_TASK_LIST_PATTERN = re.compile(
-    rf"(?P<start>{ISSUE_BODY_OPENING_TAG})"
-    rf"(?P<tasks>.*?)"
-    rf"(?P<end>{ISSUE_BODY_CLOSING_TAG})",
-    flags=re.DOTALL,
+# Regex pattern to find the issue/pr numbers referred to in a body
+BODY_REFERENCE_PATTERN = re.compile(r"(?:^|\b)(?:GH-|gh-|#)(\d+)\b")
+
+# Pull requests linked to the same issue within this many seconds of each other
+# (e.g. backports opened together) are added to the issue's body at once.
+ISSUE_LINK_WINDOW = 2.0
+_issue_link_batches: dict[str, "_IssueLinkBatch"] = {}
+# The tasks writing batches, kept here so they aren't garbage collected.
+_issue_link_writes: set[asyncio.Task] = set()
+metrics.ISSUE_LINK_BATCHES.set_function(lambda: len(_issue_link_batches))
+_issue_link_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+    weakref.WeakValueDictionary()
 )
+# Issues whose bodies were updated in the last minute, for as long as copies
+# fetched before the update might still be passed in (see gh_issue).
+_issue_links_written: cachetools.TTLCache = cachetools.TTLCache(maxsize=1_000, ttl=60)
+# Core developers are only added and removed now and again.
+CORE_DEV_TTL = 60 * 60
+# "core_team" -> the python core team, "roster" -> the logins of its members and
+# "member:<login>" -> True for core developers checked one at a time.
+_core_devs = caches.Cache("core_devs", maxsize=1_000, ttl=CORE_DEV_TTL, warm_start=True)
 
 
 @enum.unique
@@ -66,9 +89,18 @@ def create_status(context, state, *, description=None, target_url=None):
     return status
 
 
-async def post_status(gh, event, status):
-    """Post a status in reaction to an event."""
-    await gh.post(event.data["pull_request"]["statuses_url"], data=status)
+async def post_status(gh, event, status, plan=None, *, now=False):
+    """Post a status in reaction to an event.
+
+    With a plan, the status is posted when the plan is applied, unless now is
+    true.
+    """
+    statuses_url = event.data["pull_request"]["statuses_url"]
+    if now and plan is not None:
+        # An earlier status planned for the context would overwrite this one.
+        plan.discard_status(statuses_url, status["context"])
+        plan = None
+    await mutations.writer(gh, plan).set_status(statuses_url, status)
 
 
 def skip_label(what):
@@ -77,7 +109,7 @@ def skip_label(what):
 
 
 def labels(issue):
-    return {label_data["name"] for label_data in issue["labels"]}
+    return set(prstate.MIRROR.labels(issue))
 
 
 def skip(what, issue):
@@ -94,8 +126,16 @@ def user_login(item):
     return item["user"]["login"]
 
 
-async def files_for_PR(gh, pull_request):
-    """Get files for a pull request."""
+async def files_for_PR(gh, pull_request, snapshots=None):
+    """Get files for a pull request.
+
+    Files from a snapshot have the number of changed lines under "changes"
+    instead of a "patch".
+    """
+    if snapshots is not None:
+        pr_snapshot = await snapshots.load(pull_request["url"])
+        if pr_snapshot is not None and pr_snapshot.files is not None:
+            return pr_snapshot.files
     # For some unknown reason there isn't any files URL in a pull request
     # payload.
     files_url = f'{pull_request["url"]}/files'
@@ -110,8 +150,15 @@ async def files_for_PR(gh, pull_request):
     return data
 
 
-async def issue_for_PR(gh, pull_request):
+async def issue_for_PR(gh, pull_request, snapshots=None):
     """Return a dict with data about the given PR."""
+    state = prstate.MIRROR.get(pull_request)
+    if state is not None:
+        return state.issue()
+    if snapshots is not None:
+        pr_snapshot = await snapshots.load(pull_request["url"])
+        if pr_snapshot is not None:
+            return pr_snapshot.issue()
     # "issue_url" is the API endpoint for the given pull_request (despite the name)
     # It could also come from "url"
 
@@ -131,33 +178,70 @@ def build_pr_body(issue_number: int, body: str) -> str:
     )
 
 
-def build_issue_body(pr_number: int, body: str) -> str:
-    """Update the Issue body with related Pull Request."""
+class BodyScan(NamedTuple):
+    """What scan_body() found in a PR/Issue body."""
+
+    # Issue/pr numbers referred to as GH-NNN, gh-NNN or #NNN.
+    references: frozenset[str]
+    # Where the closing tag of the linked PRs tasklist starts, if there is one.
+    tasklist_end: int | None
+    # Whether the body uses the legacy <!-- gh-pr-number --> tags.
+    legacy: bool
+
+
+@functools.lru_cache(maxsize=256)
+def scan_body(body: str) -> BodyScan:
+    """Find everything bedevere needs to know about a body in a single pass.
+
+    The result is cached, so repeatedly checking the same body is cheap.
+    """
+    references = frozenset(BODY_REFERENCE_PATTERN.findall(body))
+    tasklist_end = None
+    start = body.find(ISSUE_BODY_OPENING_TAG)
+    if start != -1:
+        end = body.find(ISSUE_BODY_CLOSING_TAG, start + len(ISSUE_BODY_OPENING_TAG))
+        if end != -1:
+            tasklist_end = end
+    legacy = PR_BODY_CLOSING_TAG.format(tag_type=PR) in body
+    return BodyScan(references, tasklist_end, legacy)
+
+
+def build_issue_body(pr_number: int | Iterable[int], body: str) -> str:
+    """Update the Issue body with related Pull Request(s)."""
+    pr_numbers = [pr_number] if isinstance(pr_number, int) else list(pr_number)
+    scan = scan_body(body)
     # If the body already contains a legacy closing tag
     # (e.g. <!-- /gh-pr-number -->), then we use the legacy template
     # TODO: Remove this when all the open issues using the legacy tag are closed
-    if PR_BODY_CLOSING_TAG.format(tag_type=PR) in body:
-        return PR_BODY_TEMPLATE.format(
-            body=body,
-            pr_or_issue_number=pr_number,
-            key=PR.upper(),
-            tag_type=PR,
-        )
+    if scan.legacy:
+        for number in pr_numbers:
+            body = PR_BODY_TEMPLATE.format(
+                body=body,
+                pr_or_issue_number=number,
+                key=PR.upper(),
+                tag_type=PR,
+            )
+        return body
 
     # Check if the body already contains a tasklist
-    result = ISSUE_BODY_TASK_LIST_PATTERN.search(body)
+    tasklist_end = scan.tasklist_end
 
-    if not result:
+    if tasklist_end is None:
         # If the body doesn't contain a tasklist, we add one using the template
-        body += ISSUE_BODY_TASK_LIST_TEMPLATE.format(pr_number=pr_number)
-        return body
+        first, *pr_numbers = pr_numbers
+        body += ISSUE_BODY_TASK_LIST_TEMPLATE.format(pr_number=first)
+        if not pr_numbers:
+            return body
+        tasklist_end = len(body) - len(f"{ISSUE_BODY_CLOSING_TAG}\n")
+
+    # If the body already contains a tasklist, only append the new PRs to the list
+    tasks = "".join(f"* gh-{number}\n" for number in pr_numbers)
+    return body[:tasklist_end] + tasks + body[tasklist_end:]
 
-    # If the body already contains a tasklist, only append the new PR to the list
-    return ISSUE_BODY_TASK_LIST_PATTERN.sub(
-        rf"\g<start>\g<tasks>* gh-{pr_number}\n\g<end>",
-        body,
-        count=1,
-    )
+
+def _mentions(body: str, pr_or_issue_number: int) -> bool:
+    """Check if the body already refers to the issue/pr number."""
+    return str(pr_or_issue_number) in scan_body(body).references
 
 
 async def patch_body(
@@ -171,9 +255,8 @@ async def patch_body(
     returns if body exists with issue/pr number
     """
     body = pr_or_issue.get("body", None) or DEFAULT_BODY
-    body_search_pattern = rf"(^|\b)(GH-|gh-|#){pr_or_issue_number}\b"
 
-    if not body or not re.search(body_search_pattern, body):
+    if not body or not _mentions(body, pr_or_issue_number):
         updated_body = (
             build_issue_body(pr_or_issue_number, body)
             if content_type == ISSUE
@@ -183,16 +266,49 @@ async def patch_body(
     return None
 
 
-async def is_core_dev(gh, username):
-    """Check if the user is a CPython core developer."""
+async def _core_team(gh):
+    team = await _core_devs.fetch("core_team")
+    if team is not None:
+        return team
     org_teams = "/orgs/python/teams"
     team_name = "python core"
+    async for team in gh.getiter(org_teams):
+        if team["name"].lower() == team_name:  # pragma: no branch
+            _core_devs["core_team"] = {
+                "id": team["id"],
+                "name": team["name"],
+                "slug": team["slug"],
+            }
+            return team
+    raise ValueError(f"{team_name!r} not found at {org_teams!r}")
+
+
+async def core_devs(gh):
+    """Return the logins of all CPython core developers.
+
+    Cheaper than calling is_core_dev() for each of many users. The roster is
+    kept for CORE_DEV_TTL seconds, and is_core_dev() answers from it meanwhile.
+    """
+    roster = await _core_devs.fetch("roster")
+    if roster is not None:
+        return frozenset(roster)
+    team = await _core_team(gh)
+    members_url = "/orgs/python/teams/{team_slug}/members?per_page=100"
+    members = gh.getiter(members_url, {"team_slug": team["slug"]})
+    logins = [user["login"] async for user in members]
+    _core_devs["roster"] = sorted(logins)
+    return frozenset(logins)
+
+
+async def is_core_dev(gh, username):
+    """Check if the user is a CPython core developer."""
+    roster = await _core_devs.fetch("roster")
+    if roster is not None:
+        return username in roster
+    if await _core_devs.fetch(f"member:{username}"):
+        return True
     try:
-        async for team in gh.getiter(org_teams):
-            if team["name"].lower() == team_name:  # pragma: no branch
-                break
-        else:
-            raise ValueError(f"{team_name!r} not found at {org_teams!r}")
+        team = await _core_team(gh)
     except gidgethub.BadRequest as exc:
         # returns 403 error if the resource is not accessible by integration
         return False
@@ -207,6 +323,9 @@ async def is_core_dev(gh, username):
             return False
         raise
     else:
+        # Only members are remembered, so new core developers aren't kept
+        # waiting.
+        _core_devs[f"member:{username}"] = True
         return True
 
 
@@ -246,3 +365,83 @@ async def get_pr_for_commit(gh, sha, repo_full_name=None):
     if prs_for_commit["total_count"] > 0:  # there should only be one
         return prs_for_commit["items"][0]
     return None
+
+
+class _IssueLinkBatch:
+    """Pull requests waiting to be linked to the same issue."""
+
+    def __init__(self, gh: GitHubAPI) -> None:
+        # The batch is written with a client like the first caller's, whose
+        # own session closes once its delivery has been handled.
+        self.gh = gh
+        self.issue: dict[str, Any] | None = None
+        self.pr_numbers: set[int] = set()
+
+
+def link_pr_to_issue(
+    gh: GitHubAPI,
+    issue_url: str,
+    pr_number: int,
+    *,
+    issue: dict[str, Any] | None = None,
+) -> None:
+    """Add the PR number to the issue's list of linked PRs.
+
+    PRs linked to the same issue within ISSUE_LINK_WINDOW seconds are batched
+    together and written with a single update of the issue's body. The batch
+    is written in the background, so the caller doesn't wait for the window to
+    pass. The issue is fetched unless its freshly fetched data is passed in.
+    """
+    batch = _issue_link_batches.get(issue_url)
+    if batch is None:
+        batch = _issue_link_batches[issue_url] = _IssueLinkBatch(gh)
+        task = asyncio.create_task(_link_batch(issue_url, batch))
+        _issue_link_writes.add(task)
+        task.add_done_callback(_issue_link_writes.discard)
+    batch.pr_numbers.add(pr_number)
+    if issue is not None:
+        batch.issue = issue
+
+
+async def issue_links_written() -> None:
+    """Wait for the batches of issue links waiting to be written."""
+    await asyncio.gather(*_issue_link_writes)
+
+
+async def _link_batch(issue_url: str, batch: _IssueLinkBatch) -> None:
+    try:
+        await asyncio.sleep(ISSUE_LINK_WINDOW)
+    finally:
+        del _issue_link_batches[issue_url]
+    try:
+        async with aiohttp.ClientSession() as session:
+            gh = batch.gh.with_session(session)
+            await _write_issue_links(gh, issue_url, batch.issue, batch.pr_numbers)
+    except Exception:
+        print(
+            f"Linking {sorted(batch.pr_numbers)} to {issue_url} failed",
+            file=sys.stderr,
+        )
+        traceback.print_exc(file=sys.stderr)
+
+
+async def _write_issue_links(
+    gh: GitHubAPI,
+    issue_url: str,
+    issue: dict[str, Any] | None,
+    pr_numbers: set[int],
+) -> Any:
+    """Add all the PR numbers missing from the issue's body in one update."""
+    lock = _issue_link_locks.setdefault(issue_url, asyncio.Lock())
+    async with lock:
+        # If the issue was updated since the caller fetched it, re-read the
+        # body rather than overwrite the earlier update.
+        if issue is None or issue_url in _issue_links_written:
+            issue = await gh.getitem(issue_url)
+        body = issue.get("body", None) or DEFAULT_BODY
+        missing = sorted(number for number in pr_numbers if not _mentions(body, number))
+        if not missing:
+            return None
+        updated_body = build_issue_body(missing, body)
+        _issue_links_written[issue_url] = True
+        return await gh.patch(issue["url"], data={"body": updated_body})
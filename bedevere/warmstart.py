@@ -0,0 +1,87 @@
+"""Start with the caches the previous process left behind.
+
+Heroku restarts dynos at least daily, and bedevere used to start every day
+with empty caches: no ETags, no installation tokens, no core developers, so
+the first hour after a restart cost noticeably more of the rate limit.
+
+Set WARM_START_PATH to a file on storage which survives restarts. The caches
+created with ``warm_start=True`` (see bedevere.caches) are saved to it as
+gzipped JSON when bedevere stops (aiohttp runs the app's cleanup on SIGTERM,
+which is how Heroku stops dynos) and loaded from it when bedevere starts,
+leaving out the entries older than their cache's TTL by then. The file holds
+installation tokens, so it's only readable by its owner.
+
+On startup, warm_up() also gets a token for each of the app's installations
+and the roster of core developers, unless they were loaded, so the first
+deliveries don't wait for them.
+"""
+
+import gzip
+import json
+import os
+import sys
+from collections.abc import Mapping
+
+import aiohttp
+
+from . import caches, client, metrics, tokens, util
+
+LOADED = metrics.Counter(
+    "bedevere_warm_start_entries_total",
+    "Cache entries loaded from the previous process's caches.",
+    ("cache",),
+)
+
+
+def path() -> str | None:
+    """Return the path the caches are saved to, if warm starts are enabled."""
+    return os.environ.get("WARM_START_PATH")
+
+
+def save(
+    path: str, warm_caches: Mapping[str, caches.Cache] = caches.WARM_START
+) -> None:
+    """Save the caches to the file, replacing it atomically."""
+    data = {name: cache.dump() for name, cache in warm_caches.items()}
+    # Named after the process, in case another one is saving too.
+    temporary = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file, gzip.GzipFile(fileobj=file, mode="wb") as gz:
+        gz.write(json.dumps(data, separators=(",", ":")).encode())
+    os.replace(temporary, path)
+
+
+def load(path: str, warm_caches: Mapping[str, caches.Cache] = caches.WARM_START) -> int:
+    """Load the caches saved to the file, returning how many entries were loaded.
+
+    A missing or unreadable file loads nothing.
+    """
+    try:
+        with gzip.open(path, "rb") as file:
+            data = json.loads(file.read())
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as exc:
+        print(f"Not loading caches from {path}: {exc!r}", file=sys.stderr)
+        return 0
+    total = 0
+    for name, entries in data.items():
+        if name in warm_caches:
+            loaded = warm_caches[name].load(entries)
+            LOADED.labels(name).inc(loaded)
+            total += loaded
+    print(f"Loaded {total} cache entries from {path}", file=sys.stderr)
+    return total
+
+
+async def warm_up() -> None:
+    """Get installation tokens and the core developers before deliveries do."""
+    async with aiohttp.ClientSession() as session:
+        gh = client.from_environ(session)
+        installations = gh.getiter("/app/installations", jwt=tokens.app_jwt())
+        async for installation in installations:
+            token = await tokens.installation_token(gh, installation["id"])
+            if installation["account"]["login"] == "python":
+                gh.oauth_token = token
+        if gh.oauth_token is not None:
+            await util.core_devs(gh)
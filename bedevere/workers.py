@@ -0,0 +1,159 @@
+"""Serve webhooks from several worker processes sharing the listening port.
+
+One process handles deliveries on one core, while parsing large payloads,
+signing JWTs and scanning long bodies are CPU-bound. ``python -m bedevere
+--workers N`` forks N workers which each run the aiohttp application on the
+same port with SO_REUSEPORT, so the kernel spreads connections across them.
+
+The supervisor, the process which forked the workers, passes SIGTERM and
+SIGINT on to them. Each worker then stops accepting connections, finishes the
+deliveries it's handling and runs the app's cleanup, as a single process
+would. Workers still running GRACE seconds later are killed. If a worker exits
+on its own, the supervisor stops the others and exits with an error, so the
+platform restarts the lot.
+
+Only the first worker runs the background tasks (see bedevere.__main__).
+Workers share what's kept outside the process: set DELIVERIES_DB so a
+redelivery reaching another worker is still recognized (see
+bedevere.deliveries), and CACHE_URL so the workers share their caches (see
+bedevere.caches). Deliveries for the same pull request are only handled in
+order when they reach the same worker. Metrics are combined across workers on
+/metrics (see bedevere.metrics).
+"""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from collections.abc import Callable
+
+from aiohttp import web
+
+from . import metrics
+
+# Seconds workers get to finish after being asked to stop. Heroku kills
+# processes 30 seconds after SIGTERM.
+GRACE = 25.0
+# Seconds between checks on the workers.
+POLL_INTERVAL = 0.1
+# Signals which stop the workers.
+SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+class Supervisor:
+    """Fork workers, pass signals on to them and wait for them to exit."""
+
+    def __init__(
+        self, run_worker: Callable[[int], None], workers: int, *, grace: float = GRACE
+    ) -> None:
+        self.run_worker = run_worker
+        self.workers = workers
+        self.grace = grace
+        # PID -> worker index.
+        self.pids: dict[int, int] = {}
+        self.stopping_at: float | None = None
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            if self.stopping_at is not None:
+                # Told to stop while starting.
+                break
+            # Hold signals until the worker is known, so stop() reaches it.
+            signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+            try:
+                pid = os.fork()
+                if pid == 0:  # pragma: no cover
+                    self._run(index)
+                self.pids[pid] = index
+            finally:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+
+    def _run(self, index: int) -> None:  # pragma: no cover
+        # In the worker: run it, and never return to the supervisor's code.
+        code = 0
+        try:
+            for signum in SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+            self.run_worker(index)
+        except BaseException:
+            traceback.print_exc(file=sys.stderr)
+            code = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(code)
+
+    def stop(self, *args: object) -> None:
+        """Ask every worker to stop; a signal handler."""
+        if self.stopping_at is None:
+            self.stopping_at = time.monotonic()
+            self._signal(signal.SIGTERM)
+
+    def _signal(self, signum: int) -> None:
+        # Workers which have exited are zombies until they're waited for, so
+        # they can still be signalled.
+        for pid in self.pids:
+            os.kill(pid, signum)
+
+    def wait(self) -> int:
+        """Wait for every worker to exit, returning the exit status to use."""
+        status = 0
+        while self.pids:
+            if (
+                self.stopping_at is not None
+                and time.monotonic() - self.stopping_at > self.grace
+            ):
+                print(f"Killing {len(self.pids)} workers", file=sys.stderr)
+                self._signal(signal.SIGKILL)
+                status = 1
+            pid, wait_status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(POLL_INTERVAL)
+                continue
+            index = self.pids.pop(pid)
+            code = os.waitstatus_to_exitcode(wait_status)
+            if self.stopping_at is None:
+                print(f"Worker {index} exited ({code}), stopping", file=sys.stderr)
+                status = 1
+                self.stop()
+            elif code not in (0, -signal.SIGTERM, -signal.SIGKILL):
+                status = 1
+        return status
+
+
+def _run_worker(
+    create_app: Callable[..., web.Application],
+    port: int | None,
+    directory: str,
+    index: int,
+) -> None:  # pragma: no cover
+    # Runs in the forked worker.
+    app = create_app(
+        primary=index == 0, workers_metrics=metrics.Workers(directory, index)
+    )
+    web.run_app(app, port=port, reuse_port=True, print=None)
+
+
+def serve(
+    create_app: Callable[..., web.Application], *, port: int | None, workers: int
+) -> int:
+    """Serve the app from several workers until told to stop.
+
+    Return the exit status for the supervisor.
+    """
+    directory = tempfile.mkdtemp(prefix="bedevere-metrics-")
+    supervisor = Supervisor(
+        lambda index: _run_worker(create_app, port, directory, index), workers
+    )
+    previous = {signum: signal.signal(signum, supervisor.stop) for signum in SIGNALS}
+    supervisor.start()
+    print(f"Started {workers} workers on port {port or 8080}", file=sys.stderr)
+    try:
+        return supervisor.wait()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1 @@
+"""Benchmarks for bedevere, runnable with ``python -m benchmarks.<name>``."""
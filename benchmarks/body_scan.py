@@ -0,0 +1,66 @@
+"""Benchmark scanning issue bodies for references and the linked PRs tasklist.
+
+Compares util.scan_body() against the per-call regular expressions it
+replaced, on an issue body with a long traceback and many linked PRs::
+
+    python -m benchmarks.body_scan
+"""
+
+import re
+import timeit
+
+from bedevere import util
+
+LEGACY_TASK_LIST_PATTERN = re.compile(
+    rf"(?P<start>{util.ISSUE_BODY_OPENING_TAG})"
+    rf"(?P<tasks>.*?)"
+    rf"(?P<end>{util.ISSUE_BODY_CLOSING_TAG})",
+    flags=re.DOTALL,
+)
+
+
+def legacy_mentions(body, number):
+    return bool(re.search(rf"(^|\b)(GH-|gh-|#){number}\b", body))
+
+
+def legacy_build_issue_body(pr_number, body):
+    if not LEGACY_TASK_LIST_PATTERN.search(body):
+        return body + util.ISSUE_BODY_TASK_LIST_TEMPLATE.format(pr_number=pr_number)
+    return LEGACY_TASK_LIST_PATTERN.sub(
+        rf"\g<start>\g<tasks>* gh-{pr_number}\n\g<end>", body, count=1
+    )
+
+
+def make_body(traceback_lines=400, linked_prs=300):
+    frame = '  File "/usr/lib/python3.14/asyncio/base_events.py", line 691, in run\n'
+    body = "Crash when awaiting gh-100 (see #101)\n\n```\n"
+    body += frame * traceback_lines + "```\n"
+    body += util.ISSUE_BODY_TASK_LIST_TEMPLATE.format(pr_number=100000)
+    for number in range(100001, 100001 + linked_prs):
+        body = util.build_issue_body(number, body)
+    return body
+
+
+def main():
+    body = make_body()
+    numbers = range(100200, 100400)
+    print(f"Body: {len(body):,} characters")
+
+    def legacy():
+        for number in numbers:
+            if not legacy_mentions(body, number):
+                legacy_build_issue_body(number, body)
+
+    def scanner():
+        for number in numbers:
+            if not util._mentions(body, number):
+                util.build_issue_body(number, body)
+
+    for name, func in [("legacy", legacy), ("scan_body", scanner)]:
+        best = min(timeit.repeat(func, number=5, repeat=5)) / 5
+        per_check = best / len(numbers) * 1e6
+        print(f"{name:>10}: {best * 1e3:8.2f} ms ({per_check:6.2f} µs per check)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,566 @@
+"""An in-memory stand-in for the parts of the GitHub API bedevere uses.
+
+It serves issues, pull requests and their files, reviews and requested
+reviewers, labels, comments, statuses, teams, issue search, app installation
+tokens and the app's webhook deliveries, with configurable latency, rate limit
+headers and ETag support. Point bedevere at it with the GH_BASE_URL environment variable::
+
+    python -m benchmarks.fakegh --port 8081 --latency 0.05
+    GH_BASE_URL=http://localhost:8081 python -m bedevere
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import time
+from typing import Any
+
+from aiohttp import web
+
+
+def _timestamp(seconds: float | None = None) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+class FakeGitHub:
+    """GitHub API state for one repository, served by an aiohttp application."""
+
+    def __init__(
+        self,
+        *,
+        base_url: str = "http://localhost:8081",
+        repo: str = "python/cpython",
+        latency: float = 0.0,
+        rate_limit: int = 5_000,
+        per_page: int = 30,
+    ) -> None:
+        self.base_url = base_url
+        self.repo = repo
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.remaining = rate_limit
+        self.reset = int(time.time()) + 60 * 60
+        self.per_page = per_page
+        self.issues: dict[int, dict[str, Any]] = {}
+        self.pulls: dict[int, dict[str, Any]] = {}
+        self.files: dict[int, list[dict[str, Any]]] = {}
+        self.reviews: dict[int, list[dict[str, Any]]] = {}
+        self.comments: dict[int, list[dict[str, Any]]] = {}
+        self.statuses: dict[str, list[dict[str, Any]]] = {}
+        self.repo_labels: dict[str, dict[str, Any]] = {}
+        self.teams = [{"name": "Python core", "id": 1, "slug": "python-core"}]
+        self.installation_id = 123
+        # The account the app is installed on.
+        self.installation_account = "python"
+        self.core_devs: set[str] = set()
+        # Attempts to deliver webhooks to the app, oldest first.
+        self.hook_deliveries: list[dict[str, Any]] = []
+        # (method, path, status) of every request served.
+        self.requests: list[tuple[str, str, int]] = []
+        # Number of requests made with each authorization header. Requests for
+        # an installation token count towards that token.
+        self.calls: collections.Counter[str] = collections.Counter()
+        # Canned error responses served, in order, instead of handling requests.
+        self.failures: collections.deque[web.Response] = collections.deque()
+        self.app = self._make_app()
+
+    # State helpers.
+
+    def add_issue(
+        self,
+        number: int,
+        title: str = "An issue",
+        *,
+        body: str | None = "",
+        labels: tuple[str, ...] = (),
+        author: str = "contributor",
+    ) -> dict[str, Any]:
+        """Add an issue to the repository."""
+        self.issues[number] = {
+            "number": number,
+            "title": title,
+            "body": body,
+            "state": "open",
+            "user": {"login": author},
+            "labels": [{"name": name} for name in labels],
+            "updated_at": _timestamp(),
+        }
+        return self.issue(number)
+
+    def add_pull_request(
+        self,
+        number: int,
+        title: str,
+        *,
+        body: str | None = "",
+        labels: tuple[str, ...] = (),
+        author: str = "contributor",
+        author_association: str = "CONTRIBUTOR",
+        files: tuple[str, ...] = (),
+        base: str = "main",
+        head_sha: str | None = None,
+        draft: bool = False,
+    ) -> dict[str, Any]:
+        """Add a pull request, along with its issue and changed files."""
+        self.add_issue(number, title, body=body, labels=labels, author=author)
+        if head_sha is None:
+            head_sha = hashlib.sha1(f"{number}".encode()).hexdigest()
+        self.pulls[number] = {
+            "author_association": author_association,
+            "base": {"ref": base, "label": f"python:{base}"},
+            "head": {"sha": head_sha, "label": f"{author}:fix-{number}"},
+            "draft": draft,
+            "merged": False,
+            "requested_reviewers": [],
+            "requested_teams": [],
+        }
+        self.files[number] = [
+            {"filename": filename, "patch": "@@ -1 +1 @@"} for filename in files
+        ]
+        self.reviews[number] = []
+        return self.pull_request(number)
+
+    def add_review(self, number: int, reviewer: str, state: str) -> dict[str, Any]:
+        """Add a review (e.g. "APPROVED") to a pull request."""
+        review = {"user": {"login": reviewer}, "state": state}
+        self.reviews[number].append(review)
+        return review
+
+    def add_hook_delivery(
+        self,
+        event: str,
+        payload: dict[str, Any],
+        *,
+        guid: str | None = None,
+        status_code: int = 502,
+        delivered_at: float | None = None,
+    ) -> dict[str, Any]:
+        """Record an attempt to deliver a webhook; by default, a failed one."""
+        if guid is None:
+            guid = f"guid-{len(self.hook_deliveries) + 1}"
+        if delivered_at is None:
+            delivered_at = time.time()
+        delivery = {
+            "id": len(self.hook_deliveries) + 1,
+            "guid": guid,
+            "delivered_at": _timestamp(delivered_at),
+            "redelivery": any(d["guid"] == guid for d in self.hook_deliveries),
+            "status_code": status_code,
+            "event": event,
+            "action": payload.get("action"),
+            "installation_id": payload.get("installation", {}).get("id"),
+            "request": {"payload": payload},
+        }
+        self.hook_deliveries.append(delivery)
+        return delivery
+
+    def _repo_url(self) -> str:
+        return f"{self.base_url}/repos/{self.repo}"
+
+    def issue(self, number: int) -> dict[str, Any]:
+        """Return the API representation of an issue."""
+        issue = self.issues[number]
+        url = f"{self._repo_url()}/issues/{number}"
+        data = {
+            **issue,
+            "url": url,
+            "labels_url": f"{url}/labels{{/name}}",
+            "comments_url": f"{url}/comments",
+            "labels": [dict(label) for label in issue["labels"]],
+        }
+        if number in self.pulls:
+            data["pull_request"] = {"url": f"{self._repo_url()}/pulls/{number}"}
+        return data
+
+    def pull_request(self, number: int) -> dict[str, Any]:
+        """Return the API (and webhook) representation of a pull request."""
+        issue = self.issue(number)
+        pull = self.pulls[number]
+        return {
+            **pull,
+            "number": number,
+            "title": issue["title"],
+            "body": issue["body"],
+            "state": issue["state"],
+            "user": issue["user"],
+            "labels": issue["labels"],
+            "updated_at": issue["updated_at"],
+            "url": issue["pull_request"]["url"],
+            "issue_url": issue["url"],
+            "comments_url": issue["comments_url"],
+            "statuses_url": f"{self._repo_url()}/statuses/{pull['head']['sha']}",
+            "head": dict(pull["head"]),
+            "base": dict(pull["base"]),
+        }
+
+    def fail(
+        self,
+        status: int,
+        message: str = "Server Error",
+        *,
+        retry_after: int | None = None,
+        times: int = 1,
+    ) -> None:
+        """Answer the next requests with an error, e.g. a secondary rate limit."""
+        for _ in range(times):
+            headers = {}
+            if retry_after is not None:
+                headers["retry-after"] = str(retry_after)
+            response = web.json_response(
+                {"message": message}, status=status, headers=headers
+            )
+            self.failures.append(response)
+
+    def token(self, installation_id: int | str) -> str:
+        """Return the access token handed out for an installation."""
+        return f"ghs_fake{installation_id}"
+
+    def label_names(self, number: int) -> list[str]:
+        """Return the names of the labels on an issue or pull request."""
+        return [label["name"] for label in self.issues[number]["labels"]]
+
+    # The aiohttp application.
+
+    def _make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        repo = "/repos/{owner}/{repo}"
+        app.router.add_routes(
+            [
+                web.get(repo + "/issues/{number}", self.get_issue),
+                web.patch(repo + "/issues/{number}", self.patch_issue),
+                web.post(repo + "/issues/{number}/labels", self.add_labels),
+                web.delete(repo + "/issues/{number}/labels/{name}", self.remove_label),
+                web.post(repo + "/issues/{number}/comments", self.add_comment),
+                web.post(repo + "/labels", self.create_label),
+                web.get(repo + "/pulls/{number}", self.get_pull),
+                web.patch(repo + "/pulls/{number}", self.patch_pull),
+                web.get(repo + "/pulls/{number}/files", self.list_files),
+                web.get(repo + "/pulls/{number}/reviews", self.list_reviews),
+                web.post(
+                    repo + "/pulls/{number}/requested_reviewers",
+                    self.request_reviewers,
+                ),
+                web.delete(
+                    repo + "/pulls/{number}/requested_reviewers",
+                    self.remove_requested_reviewers,
+                ),
+                web.post(repo + "/statuses/{sha}", self.create_status),
+                web.get(repo + "/installation", self.get_installation),
+                web.get("/app/installations", self.list_installations),
+                web.get("/orgs/{org}/teams", self.list_teams),
+                web.get(
+                    "/orgs/{org}/teams/{team_slug}/members", self.list_team_members
+                ),
+                web.get("/teams/{team_id}/memberships/{username}", self.membership),
+                web.get("/search/issues", self.search_issues),
+                web.post("/graphql", self.graphql),
+                web.get("/app/hook/deliveries", self.list_hook_deliveries),
+                web.get("/app/hook/deliveries/{delivery_id}", self.get_hook_delivery),
+                web.post(
+                    "/app/installations/{installation_id}/access_tokens",
+                    self.create_token,
+                ),
+            ]
+        )
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            if self.failures:
+                response = self.failures.popleft()
+            else:
+                response = await handler(request)
+        except web.HTTPNotFound:
+            response = web.json_response({"message": "Not Found"}, status=404)
+        if request.method == "GET" and response.status == 200:
+            etag = '"{}"'.format(hashlib.sha1(response.body).hexdigest())
+            response.headers["etag"] = etag
+            if request.headers.get("if-none-match") == etag:
+                # Conditional requests that are answered with a 304 don't
+                # count against the rate limit.
+                response = web.Response(status=304, headers={"etag": etag})
+        if response.status != 304:
+            self.remaining = max(self.remaining - 1, 0)
+        response.headers.update(
+            {
+                "x-ratelimit-limit": str(self.rate_limit),
+                "x-ratelimit-remaining": str(self.remaining),
+                "x-ratelimit-reset": str(self.reset),
+            }
+        )
+        self.requests.append((request.method, request.path, response.status))
+        if installation_id := request.match_info.get("installation_id"):
+            self.calls[f"token {self.token(installation_id)}"] += 1
+        else:
+            self.calls[request.headers.get("authorization", "")] += 1
+        return response
+
+    def _number(self, request: web.Request, items: dict) -> int:
+        number = int(request.match_info["number"])
+        if number not in items:
+            raise web.HTTPNotFound()
+        return number
+
+    def _paginate(self, request: web.Request, items: list) -> web.Response:
+        page = int(request.query.get("page", 1))
+        start = (page - 1) * self.per_page
+        response = web.json_response(items[start : start + self.per_page])
+        if start + self.per_page < len(items):
+            next_url = request.url.update_query(page=page + 1)
+            response.headers["link"] = f'<{next_url}>; rel="next"'
+        return response
+
+    async def get_issue(self, request: web.Request) -> web.Response:
+        return web.json_response(self.issue(self._number(request, self.issues)))
+
+    async def patch_issue(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.issues)
+        data = await request.json()
+        for key in ("title", "body", "state"):
+            if key in data:
+                self.issues[number][key] = data[key]
+        self.issues[number]["updated_at"] = _timestamp()
+        return web.json_response(self.issue(number))
+
+    async def add_labels(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.issues)
+        data = await request.json()
+        names = data["labels"] if isinstance(data, dict) else data
+        labels = self.issues[number]["labels"]
+        for name in names:
+            if name not in self.label_names(number):
+                labels.append({"name": name})
+        self.issues[number]["updated_at"] = _timestamp()
+        return web.json_response(labels)
+
+    async def remove_label(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.issues)
+        name = request.match_info["name"]
+        if name not in self.label_names(number):
+            raise web.HTTPNotFound()
+        labels = self.issues[number]["labels"]
+        labels[:] = [label for label in labels if label["name"] != name]
+        self.issues[number]["updated_at"] = _timestamp()
+        return web.json_response(labels)
+
+    async def add_comment(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.issues)
+        comment = {"body": (await request.json())["body"]}
+        self.comments.setdefault(number, []).append(comment)
+        return web.json_response(comment, status=201)
+
+    async def create_label(self, request: web.Request) -> web.Response:
+        label = await request.json()
+        self.repo_labels[label["name"]] = label
+        return web.json_response(label, status=201)
+
+    async def get_pull(self, request: web.Request) -> web.Response:
+        return web.json_response(self.pull_request(self._number(request, self.pulls)))
+
+    async def patch_pull(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.pulls)
+        data = await request.json()
+        for key in ("title", "body", "state"):
+            if key in data:
+                self.issues[number][key] = data[key]
+        self.issues[number]["updated_at"] = _timestamp()
+        return web.json_response(self.pull_request(number))
+
+    async def list_files(self, request: web.Request) -> web.Response:
+        return self._paginate(request, self.files[self._number(request, self.pulls)])
+
+    async def list_reviews(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.pulls)
+        return self._paginate(request, self.reviews[number])
+
+    async def request_reviewers(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.pulls)
+        requested = self.pulls[number]["requested_reviewers"]
+        for login in (await request.json()).get("reviewers", []):
+            requested.append({"login": login})
+        return web.json_response(self.pull_request(number), status=201)
+
+    async def remove_requested_reviewers(self, request: web.Request) -> web.Response:
+        number = self._number(request, self.pulls)
+        removed = set((await request.json()).get("reviewers", []))
+        requested = self.pulls[number]["requested_reviewers"]
+        requested[:] = [user for user in requested if user["login"] not in removed]
+        return web.json_response(self.pull_request(number))
+
+    async def create_status(self, request: web.Request) -> web.Response:
+        status = await request.json()
+        self.statuses.setdefault(request.match_info["sha"], []).append(status)
+        return web.json_response(status, status=201)
+
+    async def list_teams(self, request: web.Request) -> web.Response:
+        return self._paginate(request, self.teams)
+
+    async def membership(self, request: web.Request) -> web.Response:
+        username = request.match_info["username"]
+        if username not in self.core_devs:
+            raise web.HTTPNotFound()
+        return web.json_response({"state": "active", "role": "member"})
+
+    async def search_issues(self, request: web.Request) -> web.Response:
+        terms = dict(
+            term.split(":", 1) for term in request.query["q"].split() if ":" in term
+        )
+        items = [
+            self.pull_request(number)
+            for number, pull in self.pulls.items()
+            if pull["head"]["sha"] == terms.get("sha")
+        ]
+        return web.json_response({"total_count": len(items), "items": items})
+
+    def _graphql_pull_request(self, number: int) -> dict[str, Any]:
+        issue = self.issues[number]
+        pull = self.pulls[number]
+        latest = {}
+        for review in self.reviews[number]:
+            if review["state"] in {"APPROVED", "CHANGES_REQUESTED", "DISMISSED"}:
+                latest[review["user"]["login"]] = review["state"]
+        files = self.files[number]
+        contexts = {}
+        for status in self.statuses.get(pull["head"]["sha"], []):
+            contexts[status["context"]] = {
+                "context": status["context"],
+                "state": status["state"].upper(),
+                "description": status.get("description"),
+                "targetUrl": status.get("target_url"),
+            }
+        return {
+            "number": number,
+            "title": issue["title"],
+            "body": issue["body"] or "",
+            "author": {"login": issue["user"]["login"]},
+            "authorAssociation": pull["author_association"],
+            "baseRefName": pull["base"]["ref"],
+            "isDraft": pull["draft"],
+            "headRefOid": pull["head"]["sha"],
+            "labels": {"nodes": [dict(label) for label in issue["labels"]]},
+            "latestOpinionatedReviews": {
+                "nodes": [
+                    {"author": {"login": login}, "state": state}
+                    for login, state in latest.items()
+                ]
+            },
+            "files": {
+                "nodes": [
+                    {
+                        "path": file["filename"],
+                        "additions": 1 if file["patch"] else 0,
+                        "deletions": 0,
+                    }
+                    for file in files[:100]
+                ],
+                "pageInfo": {"hasNextPage": len(files) > 100},
+            },
+            "commits": {
+                "nodes": [
+                    {
+                        "commit": {
+                            "status": (
+                                {"contexts": list(contexts.values())}
+                                if contexts
+                                else None
+                            )
+                        }
+                    }
+                ]
+            },
+        }
+
+    async def graphql(self, request: web.Request) -> web.Response:
+        # Only the queries made by bedevere.snapshot and bedevere.reconcile
+        # are understood.
+        payload = await request.json()
+        variables = payload.get("variables", {})
+        headers = {"x-ratelimit-resource": "graphql"}
+        if "query OpenPullRequests(" in payload["query"]:
+            numbers = sorted(
+                number
+                for number in self.pulls
+                if self.issues[number]["state"] == "open"
+            )
+            start = int(variables.get("cursor") or 0)
+            end = start + self.per_page
+            pull_requests = {
+                "nodes": [self._graphql_pull_request(n) for n in numbers[start:end]],
+                "pageInfo": {"hasNextPage": end < len(numbers), "endCursor": str(end)},
+            }
+            data = {
+                "rateLimit": {
+                    "limit": self.rate_limit,
+                    "remaining": self.remaining,
+                    "resetAt": _timestamp(self.reset),
+                },
+                "repository": {"pullRequests": pull_requests},
+            }
+            return web.json_response({"data": data}, headers=headers)
+        if "query PullRequestSnapshot(" not in payload["query"]:
+            errors = [{"message": "Query not supported by the fake GitHub API"}]
+            return web.json_response({"errors": errors}, headers=headers)
+        number = variables["number"]
+        if number not in self.pulls:
+            data = {"repository": {"pullRequest": None}}
+            errors = [{"type": "NOT_FOUND", "message": "Could not resolve"}]
+            return web.json_response({"data": data, "errors": errors}, headers=headers)
+        data = {"repository": {"pullRequest": self._graphql_pull_request(number)}}
+        return web.json_response({"data": data}, headers=headers)
+
+    async def get_installation(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": self.installation_id})
+
+    async def list_installations(self, request: web.Request) -> web.Response:
+        installation = {
+            "id": self.installation_id,
+            "account": {"login": self.installation_account},
+        }
+        return self._paginate(request, [installation])
+
+    async def list_team_members(self, request: web.Request) -> web.Response:
+        members = [{"login": login} for login in sorted(self.core_devs)]
+        return self._paginate(request, members)
+
+    async def list_hook_deliveries(self, request: web.Request) -> web.Response:
+        attempts = [
+            {key: value for key, value in delivery.items() if key != "request"}
+            for delivery in reversed(self.hook_deliveries)
+        ]
+        return self._paginate(request, attempts)
+
+    async def get_hook_delivery(self, request: web.Request) -> web.Response:
+        delivery_id = int(request.match_info["delivery_id"])
+        if not 0 < delivery_id <= len(self.hook_deliveries):
+            raise web.HTTPNotFound()
+        return web.json_response(self.hook_deliveries[delivery_id - 1])
+
+    async def create_token(self, request: web.Request) -> web.Response:
+        installation_id = request.match_info["installation_id"]
+        token = {
+            "token": self.token(installation_id),
+            "expires_at": _timestamp(self.reset),
+        }
+        return web.json_response(token, status=201)
+
+
+def main() -> None:  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=5_000)
+    args = parser.parse_args()
+    fake = FakeGitHub(
+        base_url=f"http://localhost:{args.port}",
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+    )
+    web.run_app(fake.app, port=args.port)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
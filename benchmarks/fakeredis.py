@@ -0,0 +1,139 @@
+"""An in-memory stand-in for the parts of a Redis server bedevere uses.
+
+It speaks enough of the Redis protocol for bedevere.caches: PING, AUTH,
+SELECT, GET, SET (with PX), DEL, SCAN (with MATCH) and FLUSHDB, from a thread
+of its own so blocking clients in the event loop can talk to it. Point
+bedevere at it with the CACHE_URL environment variable::
+
+    python -m benchmarks.fakeredis --port 6379
+    CACHE_URL=redis://localhost:6379 python -m bedevere
+"""
+
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Any
+
+
+def _encode(reply: Any) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-ERR %s\r\n" % str(reply).encode()
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "FakeRedis"
+
+    def _command(self) -> list[bytes] | None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self) -> None:
+        while (args := self._command()) is not None:
+            self.server.commands.append([arg.decode() for arg in args])
+            with self.server.lock:
+                reply = self.server.execute(args[0].decode().upper(), args[1:])
+            self.wfile.write(_encode(reply))
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Keys and values of one database, served from a thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, *, password: str | None = None) -> None:
+        super().__init__(("localhost", port), _Handler)
+        self.password = password
+        # Key -> (value, time.time() it expires at or None).
+        self.data: dict[bytes, tuple[bytes, float | None]] = {}
+        # Every command received, e.g. to count round trips.
+        self.commands: list[list[str]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}/1"
+
+    def _live(self, key: bytes) -> bytes | None:
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, command: str, args: list[bytes]) -> Any:
+        if command == "PING":
+            return "PONG"
+        if command == "AUTH":
+            if args[0].decode() != self.password:
+                return Exception("invalid password")
+            return "OK"
+        if command == "SELECT":
+            return "OK"
+        if command == "FLUSHDB":
+            self.data.clear()
+            return "OK"
+        if command == "GET":
+            return self._live(args[0])
+        if command == "SET":
+            expires_at = None
+            if len(args) == 4 and args[2].upper() == b"PX":
+                expires_at = time.time() + int(args[3]) / 1000
+            self.data[args[0]] = args[1], expires_at
+            return "OK"
+        if command == "DEL":
+            return sum(self.data.pop(key, None) is not None for key in args)
+        if command == "SCAN":
+            # The cursor is the index of the next key to look at.
+            cursor = int(args[0])
+            options = dict(zip(args[1::2], args[2::2]))
+            count = int(options.get(b"COUNT", 10))
+            pattern = options.get(b"MATCH", b"*").decode()
+            keys = list(self.data)
+            following = cursor + count if cursor + count < len(keys) else 0
+            matches = [
+                key
+                for key in keys[cursor : cursor + count]
+                if self._live(key) is not None
+                and fnmatch.fnmatchcase(key.decode(), pattern)
+            ]
+            return [str(following).encode(), matches]
+        return Exception(f"unknown command {command!r}")
+
+    def start(self) -> "FakeRedis":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    FakeRedis(args.port).serve_forever()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,339 @@
+"""Load test bedevere's webhook endpoint against the fake GitHub API.
+
+Realistic, signed deliveries for every event bedevere handles are sent to the
+application from bedevere.__main__ at a configurable rate and concurrency.
+Throughput, latency percentiles, GitHub API calls per event and event loop lag
+are reported, optionally as JSON for comparing releases::
+
+    python -m benchmarks.webhooks --deliveries 1000 --rate 100 --output results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections.abc import Mapping
+from typing import Any
+from unittest import mock
+
+import aiohttp
+from aiohttp import test_utils
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from bedevere import __main__ as bedevere_main
+from bedevere import ordering, stage
+
+from .fakegh import FakeGitHub
+
+# Relative frequency of each event, roughly following python/cpython's traffic.
+EVENT_WEIGHTS = {
+    "pull_request.opened": 10,
+    "pull_request.synchronize": 30,
+    "pull_request.labeled": 20,
+    "pull_request.edited": 5,
+    "pull_request_review.submitted": 15,
+    "pull_request_review.dismissed": 2,
+    "issue_comment.created": 10,
+    "push": 5,
+    "create": 1,
+}
+SECRET = "benchmark-secret"
+CORE_DEV = "core-dev"
+NEWS_ENTRY = "Misc/NEWS.d/next/Library/2024-01-01-00-00-00.gh-issue-{}.Ab_-c1.rst"
+
+
+class DeliveryFactory:
+    """Create webhook deliveries backed by matching fake GitHub state.
+
+    Every delivery gets its own installation ID, and so its own access token,
+    which lets the GitHub API calls made for it be counted.
+    """
+
+    def __init__(self, fake: FakeGitHub, *, secret: str = SECRET) -> None:
+        self.fake = fake
+        self.secret = secret
+        self.fake.core_devs.add(CORE_DEV)
+        self._next_number = 1
+
+    def _number(self) -> int:
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _pull_request(self, **kwargs: Any) -> tuple[int, dict[str, Any]]:
+        issue_number = self._number()
+        self.fake.add_issue(issue_number, "Something is broken")
+        number = self._number()
+        files = (f"Lib/module{number}.py", NEWS_ENTRY.format(issue_number))
+        kwargs.setdefault("title", f"gh-{issue_number}: Fix something")
+        kwargs.setdefault("files", files)
+        return number, self.fake.add_pull_request(number, **kwargs)
+
+    def _repository(self) -> dict[str, Any]:
+        url = f"{self.fake.base_url}/repos/{self.fake.repo}"
+        return {"full_name": self.fake.repo, "issues_url": f"{url}/issues{{/number}}"}
+
+    def payload(self, kind: str) -> dict[str, Any]:
+        """Create the payload for a kind of event, e.g. "pull_request.opened"."""
+        event, _, action = kind.partition(".")
+        data: dict[str, Any] = {"repository": self._repository()}
+        if action:
+            data["action"] = action
+        if kind == "pull_request.edited":
+            # A backport whose title was fixed up.
+            original, _ = self._pull_request(labels=("needs backport to 3.13",))
+            title = f"[3.13] gh-{original - 1}: Fix something (GH-{original})"
+            number, pr = self._pull_request(title=title, base="3.13")
+            data.update(number=number, pull_request=pr)
+            data["changes"] = {"title": {"from": "Fix something"}}
+        elif event == "pull_request":
+            number, pr = self._pull_request()
+            data.update(number=number, pull_request=pr)
+            if action == "labeled":
+                data["label"] = {"name": "skip news"}
+        elif event == "pull_request_review":
+            number, pr = self._pull_request()
+            self.fake.add_review(number, "contributor2", "APPROVED")
+            if action == "submitted":
+                self.fake.add_review(number, CORE_DEV, "CHANGES_REQUESTED")
+                review = {"user": {"login": CORE_DEV}, "state": "changes_requested"}
+            else:
+                review = {"user": {"login": CORE_DEV}, "state": "dismissed"}
+            data.update(pull_request=pr, review=review)
+        elif event == "issue_comment":
+            labels = (stage.Blocker.changes.value,)
+            number, pr = self._pull_request(labels=labels)
+            self.fake.add_review(number, CORE_DEV, "CHANGES_REQUESTED")
+            comment = {"user": pr["user"], "body": stage.BORING_TRIGGER_PHRASE}
+            data.update(issue=self.fake.issue(number), comment=comment)
+        elif event == "push":
+            number, pr = self._pull_request(labels=(stage.Blocker.merge.value,))
+            self.fake.add_review(number, CORE_DEV, "APPROVED")
+            data["commits"] = [{"id": pr["head"]["sha"]}]
+        elif event == "create":
+            data.update(ref=f"3.{self._number()}", ref_type="branch")
+        else:
+            raise ValueError(f"unknown event {kind!r}")
+        return data
+
+    def delivery(self, kind: str, delivery_id: int) -> tuple[dict[str, str], bytes]:
+        """Create the signed headers and body of a delivery."""
+        data = self.payload(kind)
+        data["installation"] = {"id": delivery_id}
+        body = json.dumps(data).encode()
+        digest = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        headers = {
+            "content-type": "application/json",
+            "x-github-event": kind.partition(".")[0],
+            "x-github-delivery": str(delivery_id),
+            "x-hub-signature-256": f"sha256={digest}",
+        }
+        return headers, body
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Summarize durations in seconds as milliseconds."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(percent: float) -> float:
+        index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": ordered[-1] * 1000,
+    }
+
+
+async def _monitor_lag(samples: list[float], interval: float = 0.01) -> None:
+    """Record how late the event loop wakes up from sleeping."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - start - interval, 0))
+
+
+def _private_key() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+@contextlib.contextmanager
+def _configured(base_url: str):
+    """Point bedevere at the fake GitHub API for the duration of a run."""
+    environ = {
+        "GH_BASE_URL": base_url,
+        "GH_SECRET": SECRET,
+        "GH_APP_ID": "1",
+        "GH_PRIVATE_KEY": _private_key(),
+    }
+    with (
+        mock.patch.dict(os.environ, environ),
+        mock.patch.object(bedevere_main, "CONSISTENCY_DELAY", 0),
+        mock.patch.object(ordering.LABEL_BURSTS, "window", 0),
+        contextlib.redirect_stdout(None),
+    ):
+        yield
+
+
+async def run(
+    *,
+    deliveries: int = 200,
+    rate: float = 0,
+    concurrency: int = 10,
+    latency: float = 0.0,
+    weights: Mapping[str, float] = EVENT_WEIGHTS,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Send deliveries to bedevere and return the measurements.
+
+    A rate of 0 sends deliveries as fast as the concurrency allows.
+    """
+    rng = random.Random(seed)
+    kinds = rng.choices(list(weights), list(weights.values()), k=deliveries)
+    fake = FakeGitHub(latency=latency, rate_limit=10**9)
+    fake_server = test_utils.TestServer(fake.app)
+    app_server = test_utils.TestServer(bedevere_main.create_app())
+    samples: dict[str, list[float]] = {kind: [] for kind in weights}
+    calls: dict[str, list[int]] = {kind: [] for kind in weights}
+    statuses: dict[int, int] = {}
+    lag: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with fake_server, app_server, aiohttp.ClientSession() as session:
+        fake.base_url = str(fake_server.make_url("")).rstrip("/")
+        factory = DeliveryFactory(fake)
+        requests = [
+            factory.delivery(kind, delivery_id)
+            for delivery_id, kind in enumerate(kinds, 1)
+        ]
+        url = app_server.make_url("/")
+
+        async def deliver(delivery_id: int, kind: str, headers, body) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(url, headers=headers, data=body) as response:
+                    await response.read()
+                # Deliveries are acknowledged before they're handled.
+                await bedevere_main.handled(str(delivery_id))
+                samples[kind].append(time.perf_counter() - start)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                calls[kind].append(fake.calls[f"token {fake.token(delivery_id)}"])
+
+        with _configured(fake.base_url):
+            monitor = asyncio.create_task(_monitor_lag(lag))
+            start = time.perf_counter()
+            tasks = []
+            for delivery_id, (kind, (headers, body)) in enumerate(
+                zip(kinds, requests), 1
+            ):
+                if rate:
+                    delay = start + (delivery_id - 1) / rate - time.perf_counter()
+                    await asyncio.sleep(max(delay, 0))
+                tasks.append(
+                    asyncio.create_task(deliver(delivery_id, kind, headers, body))
+                )
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+            monitor.cancel()
+
+    all_samples = [sample for values in samples.values() for sample in values]
+    return {
+        "config": {
+            "deliveries": deliveries,
+            "rate": rate,
+            "concurrency": concurrency,
+            "latency": latency,
+            "seed": seed,
+        },
+        "python": platform.python_version(),
+        "duration": duration,
+        "throughput": deliveries / duration,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "latency_ms": percentiles(all_samples),
+        "event_loop_lag_ms": percentiles(lag),
+        "github_calls": sum(map(sum, calls.values())),
+        "events": {
+            kind: {
+                "count": len(samples[kind]),
+                "latency_ms": percentiles(samples[kind]),
+                "github_calls_per_event": sum(calls[kind]) / len(calls[kind]),
+            }
+            for kind in weights
+            if samples[kind]
+        },
+    }
+
+
+def report(results: dict[str, Any], file=sys.stdout) -> None:
+    """Print a human-readable summary of the results."""
+    latency = results["latency_ms"]
+    print(
+        f"{results['config']['deliveries']} deliveries in {results['duration']:.2f}s"
+        f" ({results['throughput']:.1f}/s), statuses {results['statuses']}",
+        file=file,
+    )
+    print(
+        f"latency p50 {latency['p50']:.1f}ms p90 {latency['p90']:.1f}ms"
+        f" p99 {latency['p99']:.1f}ms max {latency['max']:.1f}ms;"
+        f" event loop lag p99 {results['event_loop_lag_ms'].get('p99', 0):.1f}ms",
+        file=file,
+    )
+    for kind, details in results["events"].items():
+        print(
+            f"  {kind:<32} {details['count']:>5} events"
+            f" {details['latency_ms']['p50']:>8.1f}ms p50"
+            f" {details['github_calls_per_event']:>6.1f} GitHub calls/event",
+            file=file,
+        )
+
+
+def main(argv: list[str] | None = None) -> None:  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--deliveries", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0, help="deliveries/second")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="GitHub latency")
+    parser.add_argument("--event", action="append", choices=list(EVENT_WEIGHTS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    weights = EVENT_WEIGHTS
+    if args.event:
+        weights = {kind: EVENT_WEIGHTS[kind] for kind in args.event}
+    results = asyncio.run(
+        run(
+            deliveries=args.deliveries,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            latency=args.latency,
+            weights=weights,
+            seed=args.seed,
+        )
+    )
+    report(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,54 @@
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from bedevere import (  # isort: skip
+    deliveries,
+    gh_issue,
+    ordering,
+    prstate,
+    ratelimit,
+    retry,
+    tokens,
+    util,
+)
+from benchmarks import fakegh
+
+
+@pytest.fixture(autouse=True)
+def clear_caches(monkeypatch):
+    """Keep module-level caches from leaking state between tests."""
+    monkeypatch.setattr(util, "ISSUE_LINK_WINDOW", 0)
+    monkeypatch.setattr(ordering.LABEL_BURSTS, "window", 0)
+    yield
+    util._issue_links_written.clear()
+    gh_issue._found_issues.clear()
+    gh_issue._missing_issues.clear()
+    gh_issue._fetched_issues.clear()
+    ratelimit.SCHEDULER._quotas.clear()
+    retry.WRITE_LIMITERS.clear()
+    ordering.HEADS.clear()
+    deliveries.SEEN.clear()
+    prstate.MIRROR.clear()
+    util._core_devs.clear()
+    tokens.TOKENS.clear()
+
+
+@pytest.fixture
+async def fake(aiohttp_server):
+    """A fake GitHub API, served for the test."""
+    # Paginate after a couple of items, so tests go through several pages.
+    fake = fakegh.FakeGitHub(per_page=2)
+    server = await aiohttp_server(fake.app)
+    fake.base_url = str(server.make_url("")).rstrip("/")
+    return fake
+
+
+@pytest.fixture
+def private_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
@@ -1,9 +1,11 @@
+import asyncio
 from unittest import mock
 
 from aiohttp import web
 from gidgethub import sansio
 
 from bedevere import __main__ as main
+from bedevere import deliveries
 
 app_installation_payload = {
     "installation": {
@@ -62,6 +64,95 @@ async def test_success_with_installation(get_access_token_mock, aiohttp_client):
     data.update(app_installation_payload)
     response = await client.post("/", headers=headers, json=data)
     assert response.status == 200
+    await main.handled()
+    assert get_access_token_mock.call_count == 1
+
+
+async def retried():
+    while main._retrying:
+        await asyncio.gather(*main._retrying)
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_retry(get_access_token_mock, aiohttp_client, monkeypatch):
+    monkeypatch.setattr(main, "RETRY_DELAYS", (0, 0))
+    get_access_token_mock.side_effect = [
+        RuntimeError("GitHub is down"),
+        RuntimeError("GitHub is down"),
+        {"token": "ghs_blablabla", "expires_at": "2023-06-14T19:02:50Z"},
+    ]
+    app = web.Application()
+    app.router.add_post("/", main.main)
+    client = await aiohttp_client(app)
+    headers = {"x-github-event": "project", "x-github-delivery": "1234"}
+    data = {"action": "created"}
+    data.update(app_installation_payload)
+    duplicates = deliveries.DUPLICATES.labels().get()
+    retries = main.RETRIED.labels().get()
+    # GitHub got its response already, so a failed delivery is handled again.
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled("1234")
+    await retried()
+    assert get_access_token_mock.call_count == 3
+    assert main.RETRIED.labels().get() == retries + 2
+    # A redelivery is only acknowledged.
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    assert get_access_token_mock.call_count == 3
+    assert deliveries.DUPLICATES.labels().get() == duplicates + 1
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_redelivery(get_access_token_mock, aiohttp_client, monkeypatch, capsys):
+    monkeypatch.setattr(main, "RETRY_DELAYS", (0,))
+    get_access_token_mock.side_effect = [
+        RuntimeError("GitHub is down"),
+        RuntimeError("GitHub is down"),
+        {"token": "ghs_blablabla", "expires_at": "2023-06-14T19:02:50Z"},
+    ]
+    app = web.Application()
+    app.router.add_post("/", main.main)
+    client = await aiohttp_client(app)
+    headers = {"x-github-event": "project", "x-github-delivery": "1234"}
+    data = {"action": "created"}
+    data.update(app_installation_payload)
+    duplicates = deliveries.DUPLICATES.labels().get()
+    # A delivery given up on can be redelivered ...
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled("1234")
+    await retried()
+    assert "Giving up on 1234 until the next restart" in capsys.readouterr().err
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled("1234")
+    # ... but a handled one is only acknowledged.
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    assert get_access_token_mock.call_count == 3
+    assert deliveries.DUPLICATES.labels().get() == duplicates + 1
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_process(get_access_token_mock):
+    get_access_token_mock.return_value = {
+        "token": "ghs_blablabla",
+        "expires_at": "2023-06-14T19:02:50Z",
+    }
+    data = {"action": "created"}
+    data.update(app_installation_payload)
+    event = sansio.Event(data, event="project", delivery_id="1")
+    # Handled before the response.
+    response = await main.process(event)
+    assert response.status == 200
+    assert get_access_token_mock.call_count == 1
+
+
+async def test_process_without_installation():
+    event = sansio.Event({"action": "created"}, event="project", delivery_id="1")
+    response = await main.process(event)
+    assert response.status == 400
 
 
 class FakeGH:
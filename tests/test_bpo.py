@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from bedevere import bpo
+
+
+def test_ranges_from_numbers():
+    assert bpo.ranges_from_numbers([]) == []
+    assert bpo.ranges_from_numbers([5, 3, 4, 10, 1, 4]) == [(1, 1), (3, 5), (10, 10)]
+
+
+def test_index_round_trip(tmp_path):
+    path = tmp_path / "bpo.idx"
+    assert bpo.write_index([1000, 1001, 1002, 1005, 1677872], path) == 3
+    index = bpo.BPOIndex(path)
+    assert index.available
+    for number in (1000, 1001, 1002, 1005, 1677872):
+        assert index.lookup(number) is True
+    for number in (0, 999, 1003, 1004, 1006, 1677871, 1677873):
+        assert index.lookup(number) is False
+
+
+def test_empty_index(tmp_path):
+    path = tmp_path / "bpo.idx"
+    with pytest.raises(ValueError, match="0 issue numbers"):
+        bpo.write_index([], path)
+    assert not path.exists()
+
+
+def test_truncated_export(tmp_path, monkeypatch):
+    source = tmp_path / "issues.csv"
+    source.write_text("id\n1000\n1001\n1001\n")
+    path = tmp_path / "bpo.idx"
+    with pytest.raises(ValueError, match="2 issue numbers; expected at least 3"):
+        bpo.write_index(bpo.read_numbers(str(source)), path, minimum=3)
+    assert not path.exists()
+
+    monkeypatch.setenv("BPO_INDEX_MINIMUM", "3")
+    with pytest.raises(SystemExit) as exc_info:
+        bpo.main([str(source), str(path)])
+    assert exc_info.value.code == os.EX_DATAERR
+    assert not path.exists()
+    monkeypatch.setenv("BPO_INDEX_MINIMUM", "2")
+    bpo.main([str(source), str(path)])
+    assert bpo.BPOIndex(path).lookup(1001) is True
+
+
+def test_missing_index(tmp_path):
+    index = bpo.BPOIndex(tmp_path / "missing.idx")
+    assert not index.available
+    assert index.lookup(1234) is None
+
+
+def test_index_is_loaded_lazily(tmp_path):
+    path = tmp_path / "bpo.idx"
+    index = bpo.BPOIndex(path)
+    bpo.write_index([1234], path)
+    assert index.lookup(1234) is True
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / "bpo.idx"
+    path.write_bytes(b"\0" * bpo.HEADER.size)
+    with pytest.raises(ValueError):
+        bpo.BPOIndex(path).lookup(1234)
+
+
+def test_read_numbers(tmp_path):
+    path = tmp_path / "issues.csv"
+    path.write_text('id,title\n1000,"Something"\n"1001"\n\n  1002  \nnot a number\n')
+    assert list(bpo.read_numbers(str(path))) == [1000, 1001, 1002]
+    assert list(bpo.read_numbers(path.as_uri())) == [1000, 1001, 1002]
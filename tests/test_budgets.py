@@ -0,0 +1,91 @@
+"""Budgets for the GitHub API requests made while handling each event.
+
+Rate limit quota is what bedevere costs to run, so handling an event must not
+quietly start making more requests. If a change legitimately needs more (or
+fewer!) requests, update the budget along with it.
+"""
+
+from typing import NamedTuple
+
+import aiohttp
+import pytest
+from gidgethub import sansio
+
+from bedevere import __main__ as main
+from bedevere import client, mutations, prstate, snapshot, util
+from benchmarks import fakegh, webhooks
+
+
+class Budget(NamedTuple):
+    # Requests which count against the rate limit; 304s are free.
+    reads: int
+    writes: int
+
+
+BUDGETS = {
+    "pull_request.opened": Budget(reads=4, writes=5),
+    "pull_request.synchronize": Budget(reads=2, writes=4),
+    "pull_request.labeled": Budget(reads=0, writes=1),
+    "pull_request.edited": Budget(reads=2, writes=6),
+    "pull_request_review.submitted": Budget(reads=4, writes=2),
+    "pull_request_review.dismissed": Budget(reads=3, writes=1),
+    "issue_comment.created": Budget(reads=5, writes=4),
+    "push": Budget(reads=7, writes=4),
+    "create": Budget(reads=0, writes=1),
+}
+
+
+async def dispatch_recorded(
+    fake: fakegh.FakeGitHub, event: sansio.Event, *, cache=None
+) -> list[client.RequestRecord]:
+    """Dispatch the event to bedevere, recording the requests made to GitHub."""
+    records: list[client.RequestRecord] = []
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(
+            session, "bedevere-test", cache=cache, base_url=fake.base_url
+        )
+        gh.observers.append(records.append)
+        plan = mutations.Plan()
+        prstate.MIRROR.update(event)
+        await main.router.dispatch(
+            event, gh, session=session, snapshots=snapshot.Loader(gh), plan=plan
+        )
+        await plan.apply(gh)
+        await util.issue_links_written()
+    return records
+
+
+def check_budget(kind: str, records: list[client.RequestRecord]) -> None:
+    budget = BUDGETS[kind]
+    reads = [r for r in records if r.costs_quota and not r.is_write]
+    writes = [r for r in records if r.costs_quota and r.is_write]
+    details = "\n".join(
+        f"  {record.method} {record.url} ({record.cache})" for record in records
+    )
+    assert len(reads) <= budget.reads and len(writes) <= budget.writes, (
+        f"{kind} made {len(reads)} reads and {len(writes)} writes, over its"
+        f" budget of {budget.reads} reads and {budget.writes} writes:\n{details}"
+    )
+
+
+@pytest.mark.parametrize("kind", list(BUDGETS))
+async def test_budget(fake, kind):
+    factory = webhooks.DeliveryFactory(fake)
+    data = factory.payload(kind)
+    event = sansio.Event(data, event=kind.partition(".")[0], delivery_id="1")
+    records = await dispatch_recorded(fake, event)
+    check_budget(kind, records)
+
+
+def test_over_budget():
+    records = [
+        client.RequestRecord("GET", "/orgs/python/teams", "uncached", 200),
+        client.RequestRecord("GET", "/orgs/python/teams", "304", 304),
+    ]
+    check_budget("create", records[1:])
+    with pytest.raises(AssertionError, match="create made 1 reads and 0 writes"):
+        check_budget("create", records)
+
+
+def test_budgets_cover_every_benchmarked_event():
+    assert set(BUDGETS) == set(webhooks.EVENT_WEIGHTS)
@@ -0,0 +1,268 @@
+import io
+import json
+import os
+import socket
+import time
+from unittest import mock
+
+import pytest
+
+from bedevere import caches
+from benchmarks import fakeredis
+
+
+def test_cache(monkeypatch):
+    cache = caches.Cache("test", maxsize=2, ttl=60)
+    cache["a"] = 1
+    cache[("bpo", 2)] = [2]
+    assert cache["a"] == 1
+    assert "b" not in cache
+    assert sorted(cache, key=str) == [("bpo", 2), "a"]
+    cache["c"] = 3
+    # The least recently used entry was evicted.
+    assert len(cache) == 2
+    assert ("bpo", 2) not in cache
+    del cache["c"]
+    assert list(cache) == ["a"]
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert "a" not in cache
+    assert not len(cache)
+
+
+def test_warm_start():
+    cache = caches.Cache("test", maxsize=10, ttl=60)
+    assert "test" not in caches.WARM_START
+    warm = caches.Cache("warm-test", maxsize=10, ttl=60, warm_start=True)
+    assert caches.WARM_START.pop("warm-test") is warm
+
+
+def test_dump_and_load(monkeypatch):
+    cache = caches.Cache("test", maxsize=10, ttl=60)
+    cache[("gh", 1)] = True
+    cache["etag"] = ("W/1", None, {"a": 1}, None)
+    now = time.time()
+    cache.backend.set("old", (now - 61, "expired"), 60)
+    entries = json.loads(json.dumps(cache.dump()))
+    assert len(entries) == 2
+
+    loaded = caches.Cache("test", maxsize=10, ttl=60)
+    assert loaded.load(entries) == 2
+    assert loaded[("gh", 1)]
+    assert loaded["etag"] == ["W/1", None, {"a": 1}, None]
+    # Entries are as old as when they were first stored.
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert loaded.load(entries) == 0
+    assert not loaded.dump()
+
+
+@pytest.fixture
+def redis():
+    server = fakeredis.FakeRedis(password="secret").start()
+    yield server
+    server.stop()
+
+
+def redis_cache(redis, name="test", ttl=60):
+    connection = caches.RedisConnection.from_url(redis.url)
+    return caches.Cache(
+        name, maxsize=10, ttl=ttl, backend=caches.Redis(connection, f"bedevere:{name}:")
+    )
+
+
+def test_redis(redis):
+    cache = redis_cache(redis)
+    cache[("gh", 1)] = True
+    cache["etag"] = ("W/1", None, {"a": 1}, None)
+    # Another worker sees the same entries.
+    other = redis_cache(redis)
+    assert other[("gh", 1)]
+    assert other["etag"] == ["W/1", None, {"a": 1}, None]
+    assert sorted(other, key=str) == [("gh", 1), "etag"]
+    assert len(other) == 2
+    # Keys are listed a few at a time.
+    other.backend.SCAN_COUNT = 1
+    assert len(other) == 2
+    # Caches don't see each other's entries.
+    assert not len(redis_cache(redis, "other"))
+    del other["etag"]
+    assert "etag" not in cache
+    with pytest.raises(KeyError):
+        del cache["etag"]
+    assert [command[0] for command in redis.commands[:2]] == ["AUTH", "SELECT"]
+
+
+def test_redis_expiry(redis, monkeypatch):
+    cache = redis_cache(redis, ttl=60)
+    now = time.time()
+    cache.load([["old", now - 61, 1], ["recent", now - 59.9, 2]])
+    # The server expires entries with the cache.
+    assert list(redis.data) == [b'bedevere:test:"recent"']
+    expires_at = redis.data[b'bedevere:test:"recent"'][1]
+    assert expires_at == pytest.approx(now + 0.1, abs=0.05)
+
+    # Entries which have expired already aren't stored.
+    cache.backend.set("older", (now - 120, 3), 60)
+    assert b'bedevere:test:"older"' not in redis.data
+
+    cache["a"] = 1
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert "a" not in cache
+    assert not cache.dump()
+
+
+async def test_redis_unavailable(redis, capsys):
+    cache = redis_cache(redis)
+    cache["a"] = 1
+    errors = caches.BACKEND_ERRORS.labels("test").get()
+    redis.stop()
+    cache.backend.connection.close()
+    # Lookups miss and stores are dropped.
+    assert await cache.fetch("a", 2) == 2
+    assert "a" not in cache
+    cache["b"] = 2
+    with pytest.raises(KeyError):
+        del cache["a"]
+    assert list(cache) == []
+    assert caches.BACKEND_ERRORS.labels("test").get() >= errors + 5
+    assert "Cache 'test' unavailable" in capsys.readouterr().err
+
+
+def test_redis_retry_after(redis, monkeypatch, capsys):
+    cache = redis_cache(redis)
+    errors = caches.BACKEND_ERRORS.labels("test").get()
+    redis.stop()
+    assert "a" not in cache
+    assert "Cache 'test' unavailable" in capsys.readouterr().err
+    # The server is left be for a while, without a word for each lookup.
+    connect = mock.Mock(side_effect=socket.create_connection)
+    monkeypatch.setattr(socket, "create_connection", connect)
+    assert "a" not in cache
+    cache["a"] = 1
+    connect.assert_not_called()
+    assert caches.BACKEND_ERRORS.labels("test").get() == errors + 3
+    assert capsys.readouterr().err == ""
+    # Then tried again.
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + caches.REDIS_RETRY_AFTER)
+    restarted = fakeredis.FakeRedis(password="secret").start()
+    cache.backend.connection.port = restarted.server_address[1]
+    cache["a"] = 1
+    assert cache["a"] == 1
+    restarted.stop()
+
+
+async def test_tiered(redis, capsys):
+    connection = caches.RedisConnection.from_url(redis.url)
+    backend = caches.Tiered(
+        caches.Redis(connection, "bedevere:test:"), 10, ttl=60, name="test"
+    )
+    cache = caches.Cache("test", maxsize=10, ttl=60, backend=backend)
+    other = redis_cache(redis)
+    other["a"] = 1
+    # Only fetching goes to the server.
+    assert "a" not in cache
+    assert await cache.fetch("a") == 1
+    commands = len(redis.commands)
+    # Kept in the process after the first lookup ...
+    assert cache["a"] == 1
+    assert await cache.fetch("a") == 1
+    cache["b"] = 2
+    assert cache["b"] == 2
+    assert sorted(cache) == ["a", "b"]
+    assert [command[0] for command in redis.commands[commands:]][:1] == ["SET"]
+    assert await cache.fetch("c", 3) == 3
+    # ... and still served without the server.
+    redis.stop()
+    connection.close()
+    assert cache["a"] == 1
+    # Deleting it forgets it in the process, though it can't be deleted from
+    # the server.
+    errors = caches.BACKEND_ERRORS.labels("test").get()
+    del cache["a"]
+    backend.flush()
+    assert "a" not in cache
+    assert caches.BACKEND_ERRORS.labels("test").get() == errors + 1
+    assert "Cache 'test' unavailable" in capsys.readouterr().err
+
+
+async def test_tiered_fetch_expired(redis, monkeypatch):
+    cache = caches.Cache("test", maxsize=10, ttl=60, backend=caches.Memory(10))
+    cache["a"] = 1
+    assert await cache.fetch("a") == 1
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert await cache.fetch("a") is None
+    assert await redis_cache(redis).fetch("a", 2) == 2
+
+
+async def test_tiered_after_fork(redis, monkeypatch):
+    connection = caches.RedisConnection.from_url(redis.url)
+    backend = caches.Tiered(caches.Redis(connection, "bedevere:test:"), 10, name="test")
+    backend.set("a", (time.time(), 1), 60)
+    parent = backend._executor
+    # A forked child starts a thread of its own.
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    backend.set("b", (time.time(), 2), 60)
+    assert backend._executor is not parent
+    assert sorted(backend.keys()) == ["a", "b"]
+
+
+def test_redis_reconnect(redis):
+    cache = redis_cache(redis)
+    cache["a"] = 1
+    # The server closed the idle connection.
+    cache.backend.connection._socket.shutdown(socket.SHUT_RDWR)
+    assert cache["a"] == 1
+
+
+def test_redis_connection(redis):
+    connection = caches.RedisConnection.from_url(redis.url)
+    assert (connection.port, connection.db, connection.password) == (
+        redis.server_address[1],
+        1,
+        "secret",
+    )
+    assert connection.command("PING") == "PONG"
+    assert connection.command("DEL", "a", "b") == 0
+    assert connection.command("FLUSHDB") == "OK"
+    with pytest.raises(caches.RedisError):
+        connection.command("HGET", "a", "b")
+    connection.close()
+    connection.close()
+
+    # Without a password or a database to select.
+    connection = caches.RedisConnection(redis.server_address[0], connection.port)
+    redis.password = None
+    assert connection.command("SET", "a", "b") == "OK"
+    assert redis.data[b"a"] == (b"b", None)
+    assert redis.commands[-1][0] == "SET"
+
+    defaults = caches.RedisConnection.from_url("redis://")
+    assert (defaults.host, defaults.port, defaults.db) == ("localhost", 6379, 0)
+
+    connection._reader = io.BytesIO(b"?\r\n")
+    with pytest.raises(ConnectionError):
+        connection._read()
+    connection._reader = io.BytesIO(b"")
+    with pytest.raises(ConnectionError):
+        connection._read()
+
+
+def test_redis_wrong_password(redis):
+    redis.password = "other"
+    connection = caches.RedisConnection.from_url(redis.url.replace("other", "wrong"))
+    with pytest.raises(caches.RedisError):
+        connection.command("PING")
+
+
+def test_from_environ(redis, monkeypatch):
+    monkeypatch.delenv("CACHE_URL", raising=False)
+    assert isinstance(caches.from_environ("test", 10), caches.Memory)
+    monkeypatch.setenv("CACHE_URL", redis.url)
+    backend = caches.from_environ("test", 10).shared
+    assert backend.prefix == "bedevere:test:"
+    # Caches share the connection.
+    assert caches.from_environ("other", 10).shared.connection is backend.connection
+    caches._connections.clear()
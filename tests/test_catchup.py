@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from gidgethub import sansio
+
+from bedevere import __main__ as main
+from bedevere import catchup, client, deliveries, journal, ratelimit
+
+
+@pytest.fixture
+def app_env(fake, private_key, monkeypatch):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+
+
+def payload(number, action="opened", installation_id=123):
+    return {
+        "action": action,
+        "number": number,
+        "repository": {"full_name": "python/cpython"},
+        "installation": {"id": installation_id},
+    }
+
+
+def test_startup_window(monkeypatch):
+    monkeypatch.delenv("CATCH_UP_MINUTES", raising=False)
+    assert catchup.startup_window() == 0
+    monkeypatch.setenv("CATCH_UP_MINUTES", "90")
+    assert catchup.startup_window() == 90 * 60
+
+
+def test_delivered_at():
+    delivery = {"delivered_at": "2019-06-03T00:57:16Z"}
+    assert catchup._delivered_at(delivery) == 1559523436
+
+
+async def test_failed_deliveries(fake, app_env):
+    now = time.time()
+    fake.add_hook_delivery("pull_request", payload(1), delivered_at=now - 7200)
+    fake.add_hook_delivery("pull_request", payload(2), status_code=200)
+    retried = fake.add_hook_delivery("pull_request", payload(3))
+    fake.add_hook_delivery("pull_request", payload(3), guid=retried["guid"])
+    fixed = fake.add_hook_delivery("pull_request", payload(4))
+    fake.add_hook_delivery(
+        "pull_request", payload(4), guid=fixed["guid"], status_code=202
+    )
+    fake.add_hook_delivery("issue_comment", payload(5))
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(session, "bedevere-test", base_url=fake.base_url)
+        failed = await catchup.failed_deliveries(gh, now - 3600)
+    # The latest attempt at each delivery, oldest first.
+    assert [attempt["id"] for attempt in failed] == [4, 7]
+    # Listing stopped at the first delivery which was too old.
+    listed = [r for r in fake.requests if r[1] == "/app/hook/deliveries"]
+    assert len(listed) == 4
+
+
+async def test_catch_up(fake, app_env, tmp_path, monkeypatch, capsys):
+    fake.add_hook_delivery("pull_request", payload(1))
+    fake.add_hook_delivery("pull_request", payload(2, installation_id=456))
+    handled = fake.add_hook_delivery("pull_request", payload(3))
+    fake.add_hook_delivery("pull_request", payload(4))
+    journaled = fake.add_hook_delivery("pull_request", payload(5))
+    deliveries.SEEN.add(handled["guid"])
+    db = journal.Journal(str(tmp_path / "journal.db"))
+    monkeypatch.setattr(journal, "JOURNAL", db)
+    # Journaled, so handled or to be replayed.
+    db.append(
+        sansio.Event(payload(5), event="pull_request", delivery_id=journaled["guid"])
+    )
+    waited = []
+
+    async def wait(installation_id, reserve):
+        waited.append(installation_id)
+
+    monkeypatch.setattr(ratelimit.SCHEDULER, "wait", wait)
+    processed = []
+
+    async def process(event):
+        processed.append(event.data["number"])
+        if event.data["number"] == 4:
+            raise RuntimeError("GitHub is down")
+
+    caught_up = catchup.CAUGHT_UP.labels().get()
+    assert await catchup.catch_up(process, since=0, concurrency=2) == 2
+    assert processed == [1, 2, 4]
+    assert sorted(waited) == [123, 123, 456]
+    assert catchup.CAUGHT_UP.labels().get() == caught_up + 2
+    err = capsys.readouterr().err
+    assert "Warning" not in err
+    assert "Catching up on 3 of 5 failed deliveries" in err
+    assert "Catching up on guid-4 failed: RuntimeError('GitHub is down')" in err
+
+
+async def test_catch_up_on_startup(fake, app_env, aiohttp_client, monkeypatch):
+    pr = fake.add_pull_request(101, "gh-100: Fix the bug", files=("Lib/bug.py",))
+    fake.add_issue(100, "A bug")
+    fake.add_hook_delivery("pull_request", dict(payload(101), pull_request=pr))
+    monkeypatch.setenv("CATCH_UP_MINUTES", "60")
+    await aiohttp_client(main.create_app())
+
+    async def caught_up():
+        while pr["head"]["sha"] not in fake.statuses:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(caught_up(), timeout=5)
+    assert "guid-1" in deliveries.SEEN
+
+
+async def test_catch_up_failure(fake, app_env, monkeypatch, capsys):
+    fake.fail(500, times=10)
+    await main.catch_up(60)
+    err = capsys.readouterr().err
+    assert "Warning: set JOURNAL_DB or DELIVERIES_DB" in err
+    assert "Traceback" in err
+
+
+def test_parse_args():
+    assert main.parse_args([]).command is None
+    args = main.parse_args(["catch-up", "--minutes", "30"])
+    assert args.command == "catch-up"
+    assert args.minutes == 30
+    assert args.concurrency == catchup.CONCURRENCY
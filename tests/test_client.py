@@ -0,0 +1,59 @@
+import aiohttp
+import pytest
+
+from bedevere import client
+
+
+@pytest.mark.parametrize(
+    "url,template",
+    [
+        ("/orgs/python/teams", "/orgs/python/teams"),
+        (
+            "https://api.github.com/repos/python/cpython/pulls/42/files",
+            "/repos/python/cpython/pulls/{number}/files",
+        ),
+        (
+            "https://api.github.com/repos/python/cpython/statuses/" + "a1" * 20,
+            "/repos/python/cpython/statuses/{sha}",
+        ),
+        ("/search/issues?q=type:pr+sha:abc", "/search/issues"),
+        ("https://example.com/issues/1", "https://example.com/issues/{number}"),
+    ],
+)
+def test_url_template(url, template):
+    assert client.url_template(url, "https://api.github.com") == template
+
+
+async def test_observers(fake):
+    fake.add_issue(42)
+    records = []
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(
+            session, "bedevere-test", cache={}, base_url=fake.base_url
+        )
+        gh.observers.append(records.append)
+        await gh.getitem("/repos/python/cpython/issues/42")
+        await gh.getitem("/repos/python/cpython/issues/42")
+        fake.issues[42]["body"] = "Changed"
+        await gh.getitem("/repos/python/cpython/issues/42")
+        await gh.patch("/repos/python/cpython/issues/42", data={"body": "Again"})
+    url = "/repos/python/cpython/issues/{number}"
+    assert records == [
+        client.RequestRecord("GET", url, "uncached", 200),
+        client.RequestRecord("GET", url, "304", 304),
+        client.RequestRecord("GET", url, "cached", 200),
+        client.RequestRecord("PATCH", url, "uncached", 200),
+    ]
+    assert [record.costs_quota for record in records] == [True, False, True, True]
+    assert [record.is_write for record in records] == [False, False, False, True]
+
+
+async def test_from_environ(fake, monkeypatch):
+    async with aiohttp.ClientSession() as session:
+        gh = client.from_environ(session)
+        assert gh.base_url == "https://api.github.com"
+        assert gh.requester == "python/bedevere"
+        monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+        gh = client.from_environ(session, cache={})
+        assert gh.base_url == fake.base_url
+        assert gh._cache == {}
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from bedevere import deliveries
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def seen(request, tmp_path):
+    if request.param == "memory":
+        return deliveries.SeenDeliveries()
+    return deliveries.SQLiteSeenDeliveries(str(tmp_path / "deliveries.db"))
+
+
+def test_seen(seen):
+    assert "1" not in seen
+    assert seen.add("1")
+    assert "1" in seen
+    assert not seen.add("1")
+    assert seen.add("2")
+    seen.discard("1")
+    seen.discard("3")
+    assert seen.add("1")
+    seen.clear()
+    assert seen.add("2")
+
+
+def test_memory_is_bounded():
+    seen = deliveries.SeenDeliveries(maxsize=2)
+    for delivery_id in "123":
+        assert seen.add(delivery_id)
+    assert seen.add("1")
+
+
+def test_sqlite_is_shared_and_expires(tmp_path, monkeypatch):
+    path = str(tmp_path / "deliveries.db")
+    seen = deliveries.SQLiteSeenDeliveries(path)
+    other = deliveries.SQLiteSeenDeliveries(path)
+    assert seen.add("1")
+    assert not other.add("1")
+    assert "1" not in deliveries.SQLiteSeenDeliveries(path, ttl=-1)
+
+    monkeypatch.setattr(deliveries.SQLiteSeenDeliveries, "PURGE_EVERY", 2)
+    expiring = deliveries.SQLiteSeenDeliveries(path, ttl=-1)
+    assert expiring.add("1")
+    # Purged along the way.
+    assert expiring.add("2")
+    assert not seen.add("2")
+    assert expiring._db.execute("SELECT count(*) FROM seen_deliveries").fetchone() == (
+        1,
+    )
+
+
+def test_sqlite_connection_per_process(tmp_path, monkeypatch):
+    seen = deliveries.SQLiteSeenDeliveries(str(tmp_path / "deliveries.db"))
+    assert seen._connection is None
+    assert seen.add("1")
+    connection = seen._db
+    # As in a forked worker.
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert "1" in seen
+    assert seen._db is not connection
+    assert deliveries._inherited[-1] is connection
+
+
+def test_from_environ(tmp_path, monkeypatch):
+    monkeypatch.delenv("DELIVERIES_DB", raising=False)
+    assert isinstance(deliveries.from_environ(), deliveries.SeenDeliveries)
+    monkeypatch.setenv("DELIVERIES_DB", str(tmp_path / "deliveries.db"))
+    assert isinstance(deliveries.from_environ(), deliveries.SQLiteSeenDeliveries)
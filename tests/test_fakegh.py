@@ -0,0 +1,195 @@
+import time
+
+import aiohttp
+import gidgethub
+import pytest
+from aiohttp import web
+from gidgethub import aiohttp as gh_aiohttp
+from gidgethub import apps
+
+from bedevere import __main__ as main
+
+
+@pytest.fixture
+async def gh(fake):
+    async with aiohttp.ClientSession() as session:
+        yield gh_aiohttp.GitHubAPI(
+            session, "bedevere-test", cache={}, base_url=fake.base_url
+        )
+
+
+async def test_issues(fake, gh):
+    fake.add_issue(42, "An issue", body=None)
+    issue = await gh.getitem("/repos/python/cpython/issues/42")
+    assert issue["url"] == f"{fake.base_url}/repos/python/cpython/issues/42"
+    assert issue["body"] is None
+    assert "pull_request" not in issue
+
+    await gh.patch(issue["url"], data={"body": "Fixed"})
+    assert fake.issues[42]["body"] == "Fixed"
+
+    with pytest.raises(gidgethub.BadRequest) as exc_info:
+        await gh.getitem("/repos/python/cpython/issues/43")
+    assert exc_info.value.status_code == 404
+
+
+async def test_labels_and_comments(fake, gh):
+    issue = fake.add_issue(42, labels=("type-bug",))
+    await gh.post(issue["labels_url"], data=["docs", "type-bug"])
+    await gh.post(issue["labels_url"], data={"labels": ["tests"]})
+    assert fake.label_names(42) == ["type-bug", "docs", "tests"]
+    await gh.delete(issue["labels_url"], {"name": "docs"})
+    assert fake.label_names(42) == ["type-bug", "tests"]
+    with pytest.raises(gidgethub.BadRequest):
+        await gh.delete(issue["labels_url"], {"name": "docs"})
+
+    await gh.post(issue["comments_url"], data={"body": "Hi!"})
+    assert fake.comments[42] == [{"body": "Hi!"}]
+
+    await gh.post("/repos/python/cpython/labels", data={"name": "needs backport"})
+    assert "needs backport" in fake.repo_labels
+
+
+async def test_pull_requests(fake, gh):
+    pr = fake.add_pull_request(
+        7, "gh-42: Fix", files=("a.py", "b.py", "c.py"), labels=("docs",)
+    )
+    assert pr["labels"] == [{"name": "docs"}]
+    assert await gh.getitem(pr["url"]) == pr
+    assert (await gh.getitem(pr["issue_url"]))["pull_request"]["url"] == pr["url"]
+    await gh.patch(pr["url"], data={"body": "Updated", "state": "closed"})
+    assert fake.pull_request(7)["body"] == "Updated"
+    assert fake.pull_request(7)["state"] == "closed"
+
+    files = [item["filename"] async for item in gh.getiter(f"{pr['url']}/files")]
+    assert files == ["a.py", "b.py", "c.py"]
+
+    fake.add_review(7, "core-dev", "APPROVED")
+    reviews = [review async for review in gh.getiter(f"{pr['url']}/reviews")]
+    assert reviews == [{"user": {"login": "core-dev"}, "state": "APPROVED"}]
+
+    reviewers_url = f"{pr['url']}/requested_reviewers"
+    await gh.post(reviewers_url, data={"reviewers": ["a", "b"]})
+    await gh.delete(reviewers_url, data={"reviewers": ["a"]})
+    assert fake.pulls[7]["requested_reviewers"] == [{"login": "b"}]
+
+    await gh.post(pr["statuses_url"], data={"context": "ci", "state": "success"})
+    assert fake.statuses[pr["head"]["sha"]] == [{"context": "ci", "state": "success"}]
+
+    sha = pr["head"]["sha"]
+    found = await gh.getitem(f"/search/issues?q=type:pr+repo:python/cpython+sha:{sha}")
+    assert found["total_count"] == 1
+    assert found["items"][0]["number"] == 7
+    found = await gh.getitem("/search/issues?q=type:pr+repo:python/cpython+sha:abc")
+    assert found["total_count"] == 0
+    fake.add_pull_request(8, "Another fix", head_sha="abc")
+    found = await gh.getitem("/search/issues?q=type:pr+repo:python/cpython+sha:abc")
+    assert [item["number"] for item in found["items"]] == [8]
+
+    with pytest.raises(gidgethub.BadRequest):
+        await gh.getitem("/repos/python/cpython/pulls/9")
+
+
+async def test_teams(fake, gh):
+    fake.core_devs.add("guido")
+    teams = [team async for team in gh.getiter("/orgs/python/teams")]
+    assert teams == [{"name": "Python core", "id": 1, "slug": "python-core"}]
+    await gh.getitem("/teams/1/memberships/guido")
+    with pytest.raises(gidgethub.BadRequest):
+        await gh.getitem("/teams/1/memberships/someone")
+
+
+async def test_installation_token(fake, gh, private_key):
+    token = await apps.get_installation_access_token(
+        gh, installation_id="123", app_id="1", private_key=private_key
+    )
+    assert token["token"] == "ghs_fake123"
+    gh.oauth_token = token["token"]
+    fake.add_issue(42)
+    await gh.getitem("/repos/python/cpython/issues/42")
+    assert fake.calls == {"token ghs_fake123": 2}
+
+
+async def test_etag_and_rate_limit(fake, gh):
+    fake.add_issue(42)
+    await gh.getitem("/repos/python/cpython/issues/42")
+    assert gh.rate_limit.remaining == fake.rate_limit - 1
+    assert gh.rate_limit.limit == fake.rate_limit
+    # Unchanged, so served from the cache with a 304 that's free of charge.
+    await gh.getitem("/repos/python/cpython/issues/42")
+    assert fake.requests[-1] == ("GET", "/repos/python/cpython/issues/42", 304)
+    assert fake.remaining == fake.rate_limit - 1
+
+    fake.issues[42]["body"] = "Changed"
+    issue = await gh.getitem("/repos/python/cpython/issues/42")
+    assert issue["body"] == "Changed"
+    assert fake.requests[-1][-1] == 200
+    assert fake.remaining == fake.rate_limit - 2
+
+
+async def test_graphql(fake, gh):
+    with pytest.raises(gidgethub.GraphQLException):
+        await gh.graphql(
+            "query { viewer { login } }", endpoint=f"{fake.base_url}/graphql"
+        )
+
+
+async def test_hook_deliveries(fake, gh):
+    fake.add_hook_delivery("pull_request", {"action": "opened"}, status_code=200)
+    first = fake.add_hook_delivery("issue_comment", {"installation": {"id": 1}})
+    fake.add_hook_delivery("issue_comment", {}, guid=first["guid"])
+    attempts = [a async for a in gh.getiter("/app/hook/deliveries")]
+    assert [a["id"] for a in attempts] == [3, 2, 1]
+    assert [a["redelivery"] for a in attempts] == [True, False, False]
+    assert attempts[1]["installation_id"] == 1
+    assert "request" not in attempts[0]
+    delivery = await gh.getitem("/app/hook/deliveries/2")
+    assert delivery["request"]["payload"] == {"installation": {"id": 1}}
+    with pytest.raises(gidgethub.BadRequest):
+        await gh.getitem("/app/hook/deliveries/4")
+
+
+async def test_latency(fake, gh):
+    fake.latency = 0.05
+    fake.add_issue(42)
+    start = time.monotonic()
+    await gh.getitem("/repos/python/cpython/issues/42")
+    assert time.monotonic() - start >= 0.05
+
+
+async def test_main_against_fake_github(fake, aiohttp_client, private_key, monkeypatch):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.delenv("GH_SECRET", raising=False)
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+    fake.add_issue(100, "A bug")
+    pr = fake.add_pull_request(
+        101, "gh-100: Fix the bug", files=("Lib/test/test_bug.py",)
+    )
+    app = web.Application()
+    app.router.add_post("/", main.main)
+    client = await aiohttp_client(app)
+    headers = {"x-github-event": "pull_request", "x-github-delivery": "1"}
+    data = {
+        "action": "opened",
+        "number": 101,
+        "pull_request": pr,
+        "repository": {"full_name": "python/cpython"},
+        "installation": {"id": 123},
+    }
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled()
+
+    statuses = {
+        status["context"]: status["state"]
+        for status in fake.statuses[pr["head"]["sha"]]
+    }
+    assert statuses == {
+        "bedevere/issue-number": "success",
+        "bedevere/news": "failure",
+    }
+    assert set(fake.label_names(101)) == {"tests", "awaiting review"}
+    assert "gh-101" in fake.issues[100]["body"]
+    assert "gh-100" in fake.issues[101]["body"]
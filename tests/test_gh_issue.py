@@ -1,3 +1,4 @@
+import contextlib
 import http
 from unittest import mock
 
@@ -6,7 +7,7 @@ import gidgethub
 import pytest
 from gidgethub import sansio
 
-from bedevere import gh_issue
+from bedevere import bpo, gh_issue, mutations, util
 
 
 class FakeGH:
@@ -18,8 +19,10 @@ class FakeGH:
         self.post_data = []
         self.patch_url = []
         self.patch_data = []
+        self.getitem_url = []
 
     async def getitem(self, url):
+        self.getitem_url.append(url)
         if isinstance(self._getitem_return, Exception):
             raise self._getitem_return
         return self._getitem_return
@@ -34,6 +37,27 @@ class FakeGH:
         self.patch_data.append(data)
         return self._patch_return
 
+    def with_session(self, session):
+        return self
+
+
+class FakeSession:
+    def __init__(self, status):
+        self.status = status
+        self.head_url = []
+
+    @contextlib.asynccontextmanager
+    async def head(self, url):
+        self.head_url.append(url)
+        yield mock.Mock(status=self.status)
+
+
+@pytest.fixture
+def bpo_index(tmp_path, monkeypatch):
+    path = tmp_path / "bpo.idx"
+    bpo.write_index([1000, 1001, 1234, 12345], path)
+    monkeypatch.setattr(bpo, "INDEX", bpo.BPOIndex(path))
+
 
 @pytest.fixture
 async def issue_number():
@@ -103,7 +127,7 @@ async def test_set_status_failure_via_issue_not_found_on_github(action, monkeypa
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize("action", ["opened", "synchronize", "reopened"])
-async def test_set_status_success_issue_found_on_bpo(action):
+async def test_set_status_success_issue_found_on_bpo(action, bpo_index):
     data = {
         "action": action,
         "pull_request": {
@@ -182,6 +206,7 @@ async def test_set_status_success_issue_found_on_gh(action, monkeypatch, issue_n
     gh = FakeGH(getitem=issue_data)
     async with aiohttp.ClientSession() as session:
         await gh_issue.router.dispatch(event, gh, session=session)
+        await util.issue_links_written()
     status = gh.post_data[0]
     assert status["state"] == "success"
     assert (
@@ -227,6 +252,7 @@ async def test_set_status_success_issue_found_on_gh_ignore_case(
     gh = FakeGH(getitem=issue_data)
     async with aiohttp.ClientSession() as session:
         await gh_issue.router.dispatch(event, gh, session=session)
+        await util.issue_links_written()
     status = gh.post_data[0]
     assert status["state"] == "success"
     assert (
@@ -368,6 +394,7 @@ async def test_no_body_when_edit_title(monkeypatch, issue_number):
     event = sansio.Event(data, event="pull_request", delivery_id="12345")
     gh = FakeGH(getitem=issue_data)
     await gh_issue.router.dispatch(event, gh, session=None)
+    await util.issue_links_written()
     gh_issue._validate_issue_number.assert_awaited_with(
         gh, issue_number, session=None, kind="gh"
     )
@@ -590,7 +617,7 @@ async def test_validate_issue_number_valid_on_github():
 
 
 @pytest.mark.asyncio
-async def test_validate_issue_number_valid_on_bpo():
+async def test_validate_issue_number_valid_on_bpo(bpo_index):
     gh = FakeGH(getitem={"number": 1234})
     async with aiohttp.ClientSession() as session:
         response = await gh_issue._validate_issue_number(
@@ -632,3 +659,171 @@ async def test_validate_issue_number_coverage100():
             await gh_issue._validate_issue_number(
                 gh, 123, session=session, kind="invalid"  # type: ignore
             )
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_found_is_cached():
+    gh = FakeGH(getitem={"number": 123})
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is True
+    gh = FakeGH(getitem=gidgethub.BadRequest(status_code=http.HTTPStatus(404)))
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is True
+    assert not gh.getitem_url
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_missing_is_cached_briefly():
+    gh = FakeGH(getitem=gidgethub.BadRequest(status_code=http.HTTPStatus(404)))
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is False
+    gh = FakeGH(getitem={"number": 123})
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is False
+    assert not gh.getitem_url
+    assert gh_issue._missing_issues.ttl < gh_issue._found_issues.ttl
+
+    # Once the negative entry expires, the issue is looked up again.
+    gh_issue._missing_issues.clear()
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is True
+    assert len(gh.getitem_url) == 1
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_cache_is_keyed_by_kind():
+    gh_issue._found_issues[("bpo", 123)] = True
+    gh = FakeGH(getitem=gidgethub.BadRequest(status_code=http.HTTPStatus(404)))
+    assert await gh_issue._validate_issue_number(gh, 123, session=None) is False
+    assert await gh_issue._validate_issue_number(gh, 123, session=None, kind="bpo")
+
+
+@pytest.mark.asyncio
+async def test_set_status_reuses_issue_for_linking(issue_number):
+    data = {
+        "action": "opened",
+        "pull_request": {
+            "statuses_url": "https://api.github.com/blah/blah/git-sha",
+            "title": f"gh-{issue_number}: an issue!",
+            "url": "url",
+            "issue_url": "issue URL",
+            "number": 1234,
+        },
+    }
+    issue_data = {"url": "url", "labels": []}
+    event = sansio.Event(data, event="pull_request", delivery_id="12345")
+    gh = FakeGH(getitem=issue_data)
+    await gh_issue.router.dispatch(event, gh, session=None)
+    await util.issue_links_written()
+    # The issue fetched to validate the title is the one updated.
+    assert gh.getitem_url == [
+        "issue URL",
+        f"/repos/python/cpython/issues/{issue_number}",
+    ]
+    assert len(gh.patch_url) == 2
+
+    # The issue is known to exist now, so it is only fetched for its body.
+    gh = FakeGH(getitem=issue_data)
+    await gh_issue.router.dispatch(event, gh, session=None)
+    await util.issue_links_written()
+    assert gh.getitem_url == [
+        "issue URL",
+        f"/repos/python/cpython/issues/{issue_number}",
+    ]
+    assert gh.post_data[0]["state"] == "success"
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_bpo_uses_index(bpo_index):
+    session = FakeSession(200)
+    gh = FakeGH()
+    assert await gh_issue._validate_issue_number(gh, 12345, kind="bpo", session=session)
+    assert not await gh_issue._validate_issue_number(
+        gh, 12346, kind="bpo", session=session
+    )
+    assert not session.head_url
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_bpo_head_fallback(bpo_index, monkeypatch):
+    monkeypatch.setattr(bpo, "HEAD_FALLBACK", True)
+    session = FakeSession(200)
+    gh = FakeGH()
+    assert await gh_issue._validate_issue_number(gh, 12345, kind="bpo", session=session)
+    assert not session.head_url
+    assert await gh_issue._validate_issue_number(gh, 12346, kind="bpo", session=session)
+    assert session.head_url == ["https://bugs.python.org/issue12346"]
+
+
+@pytest.mark.asyncio
+async def test_validate_issue_number_bpo_without_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(bpo, "INDEX", bpo.BPOIndex(tmp_path / "missing.idx"))
+    session = FakeSession(404)
+    gh = FakeGH()
+    assert not await gh_issue._validate_issue_number(
+        gh, 12345, kind="bpo", session=session
+    )
+    assert session.head_url == ["https://bugs.python.org/issue12345"]
+
+
+@pytest.mark.asyncio
+async def test_set_status_posts_status_before_linking(monkeypatch, issue_number):
+    monkeypatch.setattr(
+        gh_issue, "_validate_issue_number", mock.AsyncMock(return_value=True)
+    )
+
+    class StatusFirstGH(FakeGH):
+        async def patch(self, url, *, data):
+            # The status has to be out before any of the body updates.
+            assert len(self.post_data) == 1
+            return await super().patch(url, data=data)
+
+    data = {
+        "action": "opened",
+        "pull_request": {
+            "statuses_url": "https://api.github.com/blah/blah/git-sha",
+            "title": f"gh-{issue_number}: an issue!",
+            "url": "url",
+            "issue_url": "issue URL",
+            "number": 1234,
+        },
+    }
+    issue_data = {"url": "url", "labels": []}
+    event = sansio.Event(data, event="pull_request", delivery_id="12345")
+    gh = StatusFirstGH(getitem=issue_data)
+    await gh_issue.router.dispatch(event, gh, session=None)
+    await util.issue_links_written()
+    assert gh.post_data[0]["state"] == "success"
+    assert len(gh.patch_url) == 2
+
+    # With a plan, the status isn't held until the plan is applied either.
+    gh = StatusFirstGH(getitem=issue_data)
+    plan = mutations.Plan()
+    await gh_issue.router.dispatch(event, gh, session=None, plan=plan)
+    await util.issue_links_written()
+    assert gh.post_data[0]["state"] == "success"
+    assert len(gh.patch_url) == 2
+    assert not plan.describe()
+
+
+@pytest.mark.asyncio
+async def test_set_status_replaces_planned_status(monkeypatch):
+    monkeypatch.setattr(
+        gh_issue, "_validate_issue_number", mock.AsyncMock(return_value=True)
+    )
+    data = {
+        "action": "unlabeled",
+        "label": {"name": "skip issue"},
+        "pull_request": {
+            "statuses_url": "https://api.github.com/blah/blah/git-sha",
+            "title": "No issue in title",
+            "issue_url": "issue URL",
+            "url": "url",
+            "number": 1234,
+        },
+    }
+    event = sansio.Event(data, event="pull_request", delivery_id="12345")
+    gh = FakeGH(getitem={"url": "url", "labels": []})
+    plan = mutations.Plan()
+    # E.g. the label was added and removed again in the same burst.
+    await plan.set_status(
+        data["pull_request"]["statuses_url"], gh_issue.SKIP_ISSUE_STATUS
+    )
+    await gh_issue.router.dispatch(event, gh, session=None, plan=plan)
+    await plan.apply(gh)
+    assert [status["state"] for status in gh.post_data] == ["failure"]
@@ -0,0 +1,230 @@
+import asyncio
+import os
+import sqlite3
+from unittest import mock
+
+import pytest
+from gidgethub import sansio
+
+from bedevere import __main__ as main
+from bedevere import deliveries, journal, ordering
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = journal.Journal(str(tmp_path / "journal.db"))
+    monkeypatch.setattr(journal, "JOURNAL", db)
+    return db
+
+
+def journal_earlier(db, monkeypatch, *events):
+    """Journal the deliveries in an earlier run of bedevere."""
+    boot = journal.BOOT
+    monkeypatch.setattr(journal, "BOOT", "earlier")
+    for event in events:
+        db.append(event)
+    monkeypatch.setattr(journal, "BOOT", boot)
+
+
+def project_event(delivery_id):
+    data = {"action": "created", "installation": {"id": 123}}
+    return sansio.Event(data, event="project", delivery_id=delivery_id)
+
+
+def test_journal(db, tmp_path):
+    db.append(project_event("1"))
+    db.append(project_event("2"))
+    db.append(project_event("1"))
+    db.done("2")
+    assert "2" in db and "3" not in db
+    [event] = db.unfinished()
+    assert (event.delivery_id, event.event) == ("1", "project")
+    assert event.data["installation"] == {"id": 123}
+    # Survives a restart.
+    assert len(journal.Journal(str(tmp_path / "journal.db")).unfinished()) == 1
+
+    assert db.compact() == 0
+    assert db.compact(retention=-1) == 1
+    assert [event.delivery_id for event in db.unfinished()] == ["1"]
+
+
+def test_null_journal():
+    null = journal.NullJournal()
+    null.append(project_event("1"))
+    null.done("1")
+    assert "1" not in null
+    assert null.unfinished() == []
+    assert null.compact() == 0
+
+
+def test_connection_per_process(tmp_path, monkeypatch):
+    db = journal.Journal(str(tmp_path / "journal.db"))
+    # Nothing is opened until the journal is used.
+    assert db._connection is None
+    db.append(project_event("1"))
+    connection = db._db
+    assert db._db is connection
+    # A forked worker opens its own, leaving its parent's be.
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert [event.delivery_id for event in db.unfinished()] == ["1"]
+    assert db._db is not connection
+    assert journal._inherited[-1] is connection
+
+
+def test_claim(db, tmp_path, monkeypatch):
+    journal_earlier(db, monkeypatch, project_event("1"), project_event("2"))
+    db.append(project_event("3"))
+    db.done("2")
+    assert [event.delivery_id for event in db.claim()] == ["1"]
+    # Another worker of the same run finds nothing left to claim.
+    other = journal.Journal(str(tmp_path / "journal.db"))
+    assert other.claim() == []
+    assert journal.NullJournal().claim() == []
+
+
+def test_journal_before_boot_ids(tmp_path):
+    path = str(tmp_path / "journal.db")
+    old = sqlite3.connect(path)
+    old.execute(
+        "CREATE TABLE deliveries (delivery_id TEXT PRIMARY KEY, event TEXT NOT NULL,"
+        " data TEXT NOT NULL, received_at REAL NOT NULL, done_at REAL)"
+    )
+    old.execute("INSERT INTO deliveries VALUES ('1', 'project', '{}', 0, NULL)")
+    old.commit()
+    db = journal.Journal(path)
+    db.append(project_event("2"))
+    assert [event.delivery_id for event in db.claim()] == ["1"]
+
+
+def test_from_environ(tmp_path, monkeypatch):
+    monkeypatch.delenv("JOURNAL_DB", raising=False)
+    assert isinstance(journal.from_environ(), journal.NullJournal)
+    monkeypatch.setenv("JOURNAL_DB", str(tmp_path / "journal.db"))
+    assert isinstance(journal.from_environ(), journal.Journal)
+
+
+async def test_compact_periodically(db, capsys):
+    task = asyncio.create_task(journal.compact_periodically(db, interval=0))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert "Compacted the journal, dropping 0 deliveries" in capsys.readouterr().err
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_replay(get_access_token_mock, db, monkeypatch, capsys):
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+    monkeypatch.setattr(main, "RETRY_DELAYS", ())
+    get_access_token_mock.side_effect = [
+        {"token": "ghs_blablabla", "expires_at": "2023-06-14T19:02:50Z"},
+        RuntimeError("GitHub is down"),
+    ]
+    journal_earlier(db, monkeypatch, project_event("1"), project_event("2"))
+    # Being handled by another worker.
+    db.append(project_event("3"))
+    replayed = journal.REPLAYED.labels().get()
+    await main.replay()
+    assert journal.REPLAYED.labels().get() == replayed + 2
+    assert get_access_token_mock.call_count == 2
+    # The failed delivery is left for the next restart.
+    assert [event.delivery_id for event in db.unfinished()] == ["2", "3"]
+    assert "Replaying 2 deliveries" in capsys.readouterr().err
+
+    # Claimed already.
+    await main.replay()
+    assert journal.REPLAYED.labels().get() == replayed + 2
+
+
+async def test_replay_seen_delivery(db, tmp_path, monkeypatch):
+    handled = []
+
+    async def handle_delivery(event, key, head_sha):
+        handled.append(event.delivery_id)
+
+    monkeypatch.setattr(main, "_handle_delivery", handle_delivery)
+    seen = deliveries.SQLiteSeenDeliveries(str(tmp_path / "deliveries.db"))
+    monkeypatch.setattr(deliveries, "SEEN", seen)
+    # Seen, and journaled, before the restart cut it short.
+    seen.add("1")
+    journal_earlier(db, monkeypatch, project_event("1"))
+    await main.replay()
+    assert handled == ["1"]
+    assert db.unfinished() == []
+    # A redelivery is still only acknowledged.
+    assert "1" in seen
+
+
+async def test_label_burst_is_journaled_until_handled(db, monkeypatch):
+    monkeypatch.setattr(ordering.LABEL_BURSTS, "window", 0.05)
+    release = asyncio.Event()
+
+    async def handle_delivery(event, key, head_sha):
+        await release.wait()
+
+    monkeypatch.setattr(main, "_handle_delivery", handle_delivery)
+
+    def label_event(delivery_id, name):
+        data = {
+            "action": "labeled",
+            "label": {"name": name},
+            "pull_request": {"number": 101},
+            "repository": {"full_name": "python/cpython"},
+            "installation": {"id": 123},
+        }
+        return sansio.Event(data, event="pull_request", delivery_id=delivery_id)
+
+    main.acknowledge(label_event("1", "docs"))
+    main.acknowledge(label_event("2", "skip news"))
+    # The first is held for the second, which is being handled.
+    await asyncio.sleep(0.1)
+    assert "1" not in main._handling
+    assert [event.delivery_id for event in db.unfinished()] == ["1", "2"]
+    release.set()
+    await main.handled()
+    assert db.unfinished() == []
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_deliveries_are_journaled(
+    get_access_token_mock, db, aiohttp_client, monkeypatch
+):
+    get_access_token_mock.return_value = {
+        "token": "ghs_blablabla",
+        "expires_at": "2023-06-14T19:02:50Z",
+    }
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+    journal_earlier(db, monkeypatch, project_event("1"))
+    client = await aiohttp_client(main.create_app())
+
+    async def replayed():
+        while db.unfinished():
+            await asyncio.sleep(0.01)
+
+    # Replayed in the background on startup.
+    await asyncio.wait_for(replayed(), timeout=5)
+
+    headers = {"x-github-event": "project", "x-github-delivery": "2"}
+    data = {"action": "created", "installation": {"id": 123}}
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled()
+    assert db.unfinished() == []
+    assert db._db.execute("SELECT count(*) FROM deliveries").fetchone() == (2,)
+
+
+@mock.patch("gidgethub.apps.get_installation_access_token")
+async def test_retry_cut_short(get_access_token_mock, db, aiohttp_client, monkeypatch):
+    get_access_token_mock.side_effect = RuntimeError("GitHub is down")
+    monkeypatch.setattr(main, "RETRY_DELAYS", (60,))
+    client = await aiohttp_client(main.create_app())
+    headers = {"x-github-event": "project", "x-github-delivery": "1"}
+    data = {"action": "created", "installation": {"id": 123}}
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled()
+    assert main._retrying
+    # Stopping doesn't wait for the retry, which is left for the next restart.
+    await client.close()
+    assert not main._retrying
+    assert [event.delivery_id for event in db.unfinished()] == ["1"]
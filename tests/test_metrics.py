@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+
+import pytest
+from gidgethub import sansio
+
+from bedevere import __main__ as main
+from bedevere import client, metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter(registry):
+    counter = metrics.Counter("things_total", "Things.", registry=registry)
+    counter.inc()
+    counter.inc(2)
+    assert registry.render() == (
+        "# HELP things_total Things.\n# TYPE things_total counter\nthings_total 3\n"
+    )
+
+
+def test_labels(registry):
+    counter = metrics.Counter(
+        "things_total", "Things.", ("kind", "size"), registry=registry
+    )
+    small = counter.labels("a", "small")
+    assert counter.labels("a", "small") is small
+    small.inc(0.5)
+    counter.labels('b"\\\n', 1).inc()
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'things_total{kind="a",size="small"} 0.5',
+        'things_total{kind="b\\"\\\\\\n",size="1"} 1',
+    ]
+    with pytest.raises(ValueError):
+        counter.labels("a")
+
+
+def test_duplicate_name(registry):
+    metrics.Counter("things_total", "Things.", registry=registry)
+    with pytest.raises(ValueError):
+        metrics.Gauge("things_total", "Things.", registry=registry)
+
+
+def test_gauge(registry):
+    gauge = metrics.Gauge("level", "Level.", registry=registry)
+    gauge.inc(5)
+    gauge.dec(2)
+    assert registry.render().endswith("level 3\n")
+    gauge.set(float("inf"))
+    assert registry.render().endswith("level +Inf\n")
+    gauge.set_function(lambda: 7)
+    assert registry.render().endswith("level 7\n")
+
+
+def test_histogram(registry):
+    histogram = metrics.Histogram(
+        "latency_seconds", "Latency.", ("handler",), buckets=(1, 0.1), registry=registry
+    )
+    child = histogram.labels("stage.new_review")
+    for value in (0.05, 0.1, 0.5, 2):
+        child.observe(value)
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{handler="stage.new_review",le="0.1"} 2',
+        'latency_seconds_bucket{handler="stage.new_review",le="1"} 3',
+        'latency_seconds_bucket{handler="stage.new_review",le="+Inf"} 4',
+        'latency_seconds_sum{handler="stage.new_review"} 2.65',
+        'latency_seconds_count{handler="stage.new_review"} 4',
+    ]
+    unlabeled = metrics.Histogram("size", "Size.", buckets=(1,), registry=registry)
+    unlabeled.observe(1)
+    assert 'size_bucket{le="1"} 1' in registry.render()
+
+
+def test_combine_workers(registry):
+    counter = metrics.Counter("things_total", "Things.", ("kind",), registry=registry)
+    level = metrics.Gauge("level", "Level.", registry=registry)
+    lowest = metrics.Gauge("lowest", "Lowest.", aggregate="min", registry=registry)
+    highest = metrics.Gauge("highest", "Highest.", aggregate="max", registry=registry)
+    histogram = metrics.Histogram("size", "Size.", buckets=(1,), registry=registry)
+    counter.labels("a").inc()
+    level.set(2)
+    lowest.set(5)
+    highest.set(5)
+    histogram.observe(0.5)
+    other = json.loads(json.dumps(registry.snapshot()))
+    other["things_total"] = [[["b"], 4]]
+    other["lowest"] = other["highest"] = [[[], 3]]
+    # A worker running newer code can have metrics this one hasn't.
+    other["new_total"] = [[[], 1]]
+    lines = registry.render([other]).splitlines()
+    assert 'things_total{kind="a"} 1' in lines
+    assert 'things_total{kind="b"} 4' in lines
+    assert "level 4" in lines
+    assert "lowest 3" in lines
+    assert "highest 5" in lines
+    assert 'size_bucket{le="1"} 2' in lines
+    assert "size_sum 1" in lines
+    assert "size_count 2" in lines
+    assert not [line for line in lines if line.startswith("new_total")]
+
+
+def test_workers(tmp_path, registry):
+    counter = metrics.Counter("things_total", "Things.", registry=registry)
+    counter.inc(2)
+    first = metrics.Workers(str(tmp_path), 0)
+    second = metrics.Workers(str(tmp_path), 1)
+    first.publish(registry)
+    second.publish(registry)
+    assert sorted(os.listdir(tmp_path)) == ["0.json", "1.json"]
+    assert first.others() == [{"things_total": [[[], 2]]}]
+    # Snapshots being written, or unreadable, are skipped.
+    (tmp_path / "2.json.tmp").write_text("{")
+    (tmp_path / "3.json").write_text("{")
+    assert len(first.others()) == 1
+
+
+async def test_metrics_endpoint_workers(aiohttp_client, tmp_path):
+    first = metrics.Workers(str(tmp_path), 0)
+    app = await aiohttp_client(main.create_app(workers_metrics=first))
+    second = metrics.Workers(str(tmp_path), 1)
+    second.publish()
+    response = await app.get("/metrics")
+    text = await response.text()
+    # Every worker has the gauge, so its values are added up.
+    assert "bedevere_issue_link_batches 0" in text
+    # The worker published its own snapshot when it started.
+    assert os.path.exists(tmp_path / "0.json")
+    await app.close()
+    await asyncio.sleep(0)
+
+
+def test_observe_request():
+    url = "/orgs/python/teams"
+    requests = metrics.GITHUB_REQUESTS.labels("GET", url, 304)
+    before = (
+        requests.get(),
+        metrics.GITHUB_CACHE_HIT.get(),
+        metrics.GITHUB_CACHE_MISS.get(),
+    )
+    metrics.observe_request(client.RequestRecord("GET", url, "304", 304))
+    metrics.observe_request(client.RequestRecord("GET", url, "cached", 200))
+    metrics.observe_request(client.RequestRecord("POST", url, "uncached", 201))
+    after = (
+        requests.get(),
+        metrics.GITHUB_CACHE_HIT.get(),
+        metrics.GITHUB_CACHE_MISS.get(),
+    )
+    assert [b - a for a, b in zip(before, after)] == [1, 1, 1]
+
+
+def test_observe_delivery(monkeypatch):
+    event = sansio.Event(
+        {"action": "closed"}, event="pull_request", delivery_id="12345"
+    )
+    deliveries = metrics.DELIVERIES.labels("pull_request", "closed")
+    before = deliveries.get()
+    metrics.observe_delivery(event)
+    # The child is bound once, not looked up for every delivery.
+    monkeypatch.setattr(metrics.DELIVERIES, "labels", None)
+    metrics.observe_delivery(event)
+    assert deliveries.get() == before + 2
+
+
+async def test_router_times_handlers():
+    router = metrics.Router()
+
+    @router.register("push")
+    @router.register("pull_request", action="opened")
+    async def handle(event, *args, **kwargs):
+        if event.data.get("fail"):
+            raise RuntimeError
+
+    name = "test_metrics.test_router_times_handlers.<locals>.handle"
+    timer = metrics.HANDLER_SECONDS.labels(name)
+    await router.dispatch(sansio.Event({}, event="push", delivery_id="1"))
+    with pytest.raises(RuntimeError):
+        await router.dispatch(
+            sansio.Event({"fail": True}, event="push", delivery_id="2")
+        )
+    assert sum(timer.counts) == 2
+
+
+def test_main_router_names():
+    names = {metrics.handler_name(callback) for callback in main.router._timers}
+    assert {
+        "stage.new_review",
+        "news.label_added",
+        "__main__.repo_installation_added",
+    } <= names
+
+
+async def test_metrics_endpoint(aiohttp_client):
+    app = await aiohttp_client(main.create_app())
+    response = await app.get("/metrics")
+    assert response.status == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    text = await response.text()
+    assert "# TYPE bedevere_handler_seconds histogram" in text
+    assert "bedevere_issue_link_batches 0" in text
+
+
+async def test_router_continues_after_dropped_request():
+    router = metrics.Router()
+    handled = []
+
+    @router.register("push")
+    async def drop(event, *args, **kwargs):
+        raise client.RequestDropped("rate limit too low")
+
+    @router.register("push")
+    async def handle(event, *args, **kwargs):
+        handled.append(event)
+
+    await router.dispatch(sansio.Event({}, event="push", delivery_id="1"))
+    assert len(handled) == 1
@@ -0,0 +1,164 @@
+import http
+from unittest import mock
+
+import gidgethub
+import pytest
+from gidgethub import sansio
+
+from bedevere import client, mutations, prstate, prtype, stage
+
+ISSUE_URL = "https://api.github.com/repos/python/cpython/issues/42"
+STATUSES_URL = "https://api.github.com/repos/python/cpython/statuses/abc"
+
+
+class FakeGH:
+    def __init__(self, *, fail=None):
+        self.requests = []
+        # URL -> exception to raise
+        self._fail = fail or {}
+
+    async def _request(self, method, url, url_vars={}, data=None):
+        url = sansio.format_url(url, url_vars)
+        self.requests.append((method, url, data))
+        if url in self._fail:
+            raise self._fail[url]
+
+    async def post(self, url, url_vars={}, *, data):
+        await self._request("POST", url, url_vars, data)
+
+    async def delete(self, url, url_vars={}):
+        await self._request("DELETE", url, url_vars)
+
+
+def make_issue(*labels):
+    return {
+        "labels_url": f"{ISSUE_URL}/labels{{/name}}",
+        "comments_url": f"{ISSUE_URL}/comments",
+        "labels": [{"name": name} for name in labels],
+    }
+
+
+def status(context, state):
+    return {"context": context, "state": state}
+
+
+async def test_immediate():
+    gh = FakeGH()
+    writes = mutations.writer(gh)
+    issue = make_issue("docs")
+    assert writes.labels(issue) == ["docs"]
+    await writes.add_labels(issue, ["docs", "tests"])
+    await writes.remove_label(issue, "docs")
+    await writes.set_status(STATUSES_URL, status("bedevere/news", "success"))
+    await writes.add_comment(issue["comments_url"], "Hi!")
+    assert gh.requests == [
+        ("POST", f"{ISSUE_URL}/labels", ["docs", "tests"]),
+        ("DELETE", f"{ISSUE_URL}/labels/docs", None),
+        ("POST", STATUSES_URL, status("bedevere/news", "success")),
+        ("POST", f"{ISSUE_URL}/comments", {"body": "Hi!"}),
+    ]
+
+
+async def test_labels():
+    plan = mutations.Plan()
+    assert mutations.writer(FakeGH(), plan) is plan
+    issue = make_issue("awaiting review", "docs")
+    await plan.add_labels(issue, ["docs", "tests", "type-bug"])
+    await plan.remove_label(issue, "type-bug")
+    await plan.remove_label(issue, "awaiting review")
+    await plan.remove_label(issue, "skip news")
+    # Later handlers see the labels the plan will leave, whatever issue data
+    # they have.
+    stale_issue = make_issue("awaiting review", "docs")
+    stale_issue["labels_url"] = f"{ISSUE_URL}/labels"
+    assert plan.labels(stale_issue) == ["docs", "tests"]
+    await plan.add_labels(stale_issue, ["awaiting review", "awaiting merge"])
+    await plan.remove_label(stale_issue, "awaiting review")
+
+    gh = FakeGH()
+    await plan.apply(gh)
+    assert gh.requests == [
+        ("POST", f"{ISSUE_URL}/labels", ["tests", "awaiting merge"]),
+        ("DELETE", f"{ISSUE_URL}/labels/awaiting%20review", None),
+    ]
+
+
+async def test_statuses_and_comments():
+    plan = mutations.Plan()
+    await plan.set_status(STATUSES_URL, status("bedevere/issue-number", "failure"))
+    await plan.set_status(STATUSES_URL, status("bedevere/news", "failure"))
+    await plan.set_status(STATUSES_URL, status("bedevere/issue-number", "success"))
+    await plan.add_comment(f"{ISSUE_URL}/comments", "Hi!")
+    await plan.add_comment(f"{ISSUE_URL}/comments", "Bye!")
+    await plan.add_comment(f"{ISSUE_URL}/comments", "Hi!")
+
+    gh = FakeGH()
+    await plan.apply(gh)
+    assert gh.requests == [
+        ("POST", STATUSES_URL, status("bedevere/news", "failure")),
+        ("POST", STATUSES_URL, status("bedevere/issue-number", "success")),
+        ("POST", f"{ISSUE_URL}/comments", {"body": "Hi!"}),
+        ("POST", f"{ISSUE_URL}/comments", {"body": "Bye!"}),
+    ]
+
+
+async def test_describe():
+    plan = mutations.Plan()
+    issue = make_issue("awaiting review")
+    await plan.add_labels(issue, ["docs", "tests"])
+    await plan.remove_label(issue, "awaiting review")
+    other_issue = make_issue("docs")
+    other_issue["labels_url"] = other_issue["labels_url"].replace("/42/", "/43/")
+    await plan.remove_label(other_issue, "docs")
+    await plan.set_status(STATUSES_URL, status("bedevere/news", "success"))
+    await plan.set_status(
+        STATUSES_URL,
+        dict(status("bedevere/issue-number", "failure"), description="No issue"),
+    )
+    await plan.add_comment(issue["comments_url"], "Hi!\n\nBye!")
+    with mock.patch.object(prstate.MIRROR, "forget") as forget:
+        lines = plan.describe()
+    # A dry run leaves the mirrored labels be.
+    forget.assert_not_called()
+    assert lines == [
+        "add labels 'docs', 'tests'",
+        "remove label 'awaiting review'",
+        "remove label 'docs'",
+        "set bedevere/news to success",
+        "set bedevere/issue-number to failure (No issue)",
+        "comment 'Hi!'",
+    ]
+
+
+async def test_apply_failures(capsys):
+    plan = mutations.Plan()
+    issue = make_issue()
+    await plan.add_labels(issue, ["tests"])
+    await plan.set_status(STATUSES_URL, status("bedevere/news", "success"))
+    await plan.add_comment(issue["comments_url"], "Hi!")
+    gh = FakeGH(
+        fail={
+            f"{ISSUE_URL}/comments": client.RequestDropped("comment dropped"),
+            STATUSES_URL: gidgethub.BadRequest(http.HTTPStatus(422)),
+        }
+    )
+    with pytest.raises(gidgethub.BadRequest):
+        await plan.apply(gh)
+    # The failures didn't stop the other writes.
+    assert len(gh.requests) == 3
+    assert "comment dropped" in capsys.readouterr().err
+
+
+async def test_handlers_share_a_plan():
+    gh = FakeGH()
+    plan = mutations.Plan()
+    issue = make_issue("awaiting core review")
+    await stage.stage(gh, issue, stage.Blocker.review, plan)
+    await prtype.add_labels(gh, issue, [prtype.Labels.docs], plan)
+    await stage.stage(gh, issue, stage.Blocker.review, plan)
+    assert gh.requests == []
+    await plan.apply(gh)
+    assert gh.requests == [
+        ("POST", f"{ISSUE_URL}/labels", ["awaiting review", "docs"]),
+        ("DELETE", f"{ISSUE_URL}/labels/awaiting%20core%20review", None),
+    ]
@@ -0,0 +1,315 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from gidgethub import sansio
+
+from bedevere import __main__ as main
+from bedevere import ordering
+
+
+def test_key():
+    repository = {"full_name": "python/cpython"}
+    pull_request = sansio.Event(
+        {"pull_request": {"number": 7}, "repository": repository},
+        event="pull_request",
+        delivery_id="1",
+    )
+    assert ordering.key(pull_request) == ("python/cpython", 7)
+    comment = sansio.Event(
+        {"issue": {"number": 8}, "repository": repository},
+        event="issue_comment",
+        delivery_id="2",
+    )
+    assert ordering.key(comment) == ("python/cpython", 8)
+    push = sansio.Event({"repository": repository}, event="push", delivery_id="3")
+    assert ordering.key(push) is None
+
+
+async def test_same_key_in_arrival_order():
+    executor = ordering.KeyedExecutor()
+    log = []
+
+    async def work(key, name, delay):
+        async with executor.turn(key):
+            log.append(f"{name} started")
+            await asyncio.sleep(delay)
+            log.append(f"{name} done")
+
+    await asyncio.gather(
+        work(("python/cpython", 7), "first", 0.02),
+        work(("python/cpython", 7), "second", 0),
+        work(("python/cpython", 8), "other", 0),
+        work(None, "unkeyed", 0),
+    )
+    assert log.index("first done") < log.index("second started")
+    # Work for other pull requests didn't wait.
+    assert log.index("other done") < log.index("first done")
+    assert log.index("unkeyed done") < log.index("first done")
+    assert executor.backlog(("python/cpython", 7)) == 0
+    assert not executor._queues
+
+
+async def test_backlog_and_cancellation():
+    executor = ordering.KeyedExecutor()
+    key = ("python/cpython", 7)
+    release = asyncio.Event()
+
+    async def hold():
+        async with executor.turn(key):
+            await release.wait()
+
+    async def wait():
+        async with executor.turn(key):
+            pass  # pragma: no cover
+
+    holder = asyncio.create_task(hold())
+    waiter = asyncio.create_task(wait())
+    await asyncio.sleep(0)
+    assert executor.backlog(key) == 2
+    assert ordering.BACKLOG.labels().get() == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert executor.backlog(key) == 1
+    assert ordering.BACKLOG.labels().get() == 0
+    release.set()
+    await holder
+    assert executor.backlog(key) == 0
+
+
+def test_head_sha():
+    data = {"action": "synchronize", "pull_request": {"head": {"sha": "abc"}}}
+    event = sansio.Event(data, event="pull_request", delivery_id="1")
+    assert ordering.head_sha(event) == "abc"
+    data["action"] = "labeled"
+    assert ordering.head_sha(event) is None
+
+
+async def test_heads():
+    heads = ordering.Heads()
+    key = ("python/cpython", 7)
+    assert not heads.superseded(key, "abc")
+    assert not heads.superseded(key, None)
+    heads.pushed(key, "abc")
+    assert await heads.run(key, "abc", asyncio.sleep(0))
+    assert await heads.run(key, None, asyncio.sleep(0))
+
+    cancelled = ordering.CANCELLED.get()
+    running = asyncio.create_task(heads.run(key, "abc", asyncio.sleep(1)))
+    await asyncio.sleep(0)
+    heads.pushed(key, "abc")  # Redelivered.
+    heads.pushed(key, "def")
+    assert not await running
+    assert heads.superseded(key, "abc")
+    assert not heads.superseded(key, "def")
+    assert ordering.CANCELLED.get() == cancelled + 1
+    skipped = ordering.SKIPPED.get()
+    assert not await heads.run(key, "abc", asyncio.sleep(0))
+    assert ordering.SKIPPED.get() == skipped + 1
+
+    # Cancelling the delivery itself isn't swallowed.
+    running = asyncio.create_task(heads.run(key, "def", asyncio.sleep(1)))
+    await asyncio.sleep(0)
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+    assert not heads._running
+
+    # Nor are the work's errors.
+    async def fail():
+        raise RuntimeError("GitHub is down")
+
+    with pytest.raises(RuntimeError):
+        await heads.run(key, "def", fail())
+    assert not heads._running
+
+
+async def test_superseded_synchronize(fake, aiohttp_client, private_key, monkeypatch):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.delenv("GH_SECRET", raising=False)
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0.3)
+    fake.add_issue(100, "A bug")
+    pr = fake.add_pull_request(101, "gh-100: Fix the bug", files=("Lib/bug.py",))
+    app = web.Application()
+    app.router.add_post("/", main.main)
+    client = await aiohttp_client(app)
+
+    async def deliver(action, sha, **data):
+        data.update(
+            action=action,
+            number=101,
+            pull_request=dict(pr, head={**pr["head"], "sha": sha}),
+            repository={"full_name": "python/cpython"},
+            installation={"id": 123},
+        )
+        headers = {"x-github-event": "pull_request", "x-github-delivery": sha}
+        response = await client.post("/", headers=headers, json=data)
+        assert response.status == 200
+
+    skipped, cancelled = ordering.SKIPPED.get(), ordering.CANCELLED.get()
+    deliveries = [
+        # (delay, action, head SHA)
+        (0, "labeled", "0" * 40),
+        # Waits for the labeled delivery, by which time it's been pushed over.
+        (0.05, "synchronize", "a" * 40),
+        # Pushed over while it's handled.
+        (0.05, "synchronize", "b" * 40),
+        (0.35, "synchronize", "c" * 40),
+    ]
+    tasks = []
+    for delay, action, sha in deliveries:
+        await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(deliver(action, sha, label={"name": "x"})))
+    await asyncio.gather(*tasks)
+    await main.handled()
+    assert ordering.SKIPPED.get() == skipped + 1
+    assert ordering.CANCELLED.get() == cancelled + 1
+    # Only the last push got statuses (posted to the pull request's URL).
+    assert len(fake.statuses[pr["head"]["sha"]]) == 2
+
+
+def label_event(action, name, delivery_id="1"):
+    data = {"action": action, "label": {"name": name}}
+    return sansio.Event(data, event="pull_request", delivery_id=delivery_id)
+
+
+def test_is_label_change():
+    assert ordering.is_label_change(label_event("unlabeled", "docs"))
+    assert not ordering.is_label_change(label_event("edited", "docs"))
+
+
+def test_label_debounce(monkeypatch):
+    monkeypatch.delenv("LABEL_DEBOUNCE_SECONDS", raising=False)
+    assert ordering.label_debounce() == 2
+    monkeypatch.setenv("LABEL_DEBOUNCE_SECONDS", "0.5")
+    assert ordering.label_debounce() == 0.5
+
+
+async def test_bursts():
+    bursts = ordering.Bursts(window=0.05)
+    key = ("python/cpython", 7)
+    events = [
+        label_event("labeled", "skip news"),
+        label_event("labeled", "docs"),
+        label_event("unlabeled", "skip news"),
+        label_event("labeled", "docs"),
+    ]
+    coalesced = ordering.COALESCED.labels().get()
+
+    async def arrive(delay, key, event):
+        await asyncio.sleep(delay)
+        burst = bursts.arrived(key, event)
+        return await bursts.settle(key, burst, event, time.monotonic())
+
+    results = await asyncio.gather(
+        *(arrive(0.01 * n, key, event) for n, event in enumerate(events)),
+        arrive(0, ("python/cpython", 8), events[0]),
+    )
+    # Only the last change is handled, as its payload has the final labels.
+    assert results == [False, False, False, True, True]
+    assert ordering.COALESCED.labels().get() == coalesced + 3
+    assert not bursts._bursts
+
+
+async def test_bursts_closed():
+    bursts = ordering.Bursts(window=0.05)
+    key = ("python/cpython", 7)
+    first, second = label_event("labeled", "docs"), label_event("labeled", "docs")
+    burst = bursts.arrived(key, first)
+    # Another kind of delivery arrived, so later label changes start afresh.
+    bursts.close(key)
+    later = bursts.arrived(key, second)
+    assert later is not burst
+    assert await bursts.settle(key, burst, first, time.monotonic())
+    # The later burst is left for its own delivery.
+    assert bursts._bursts == {key: [second]}
+    assert await bursts.settle(key, later, second, time.monotonic())
+    assert not bursts._bursts
+
+
+async def test_label_burst_delivery(fake, aiohttp_client, private_key, monkeypatch):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.delenv("GH_SECRET", raising=False)
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+    monkeypatch.setattr(ordering.LABEL_BURSTS, "window", 0.1)
+    pr = fake.add_pull_request(101, "Fix the bug", files=("Lib/bug.py",))
+    app = web.Application()
+    app.router.add_post("/", main.main)
+    client = await aiohttp_client(app)
+
+    async def deliver(action, name, delivery_id):
+        data = {
+            "action": action,
+            "number": 101,
+            "label": {"name": name},
+            "pull_request": pr,
+            "repository": {"full_name": "python/cpython"},
+            "installation": {"id": 123},
+        }
+        headers = {"x-github-event": "pull_request", "x-github-delivery": delivery_id}
+        response = await client.post("/", headers=headers, json=data)
+        assert response.status == 200
+
+    await asyncio.gather(
+        deliver("labeled", "skip news", "1"),
+        deliver("unlabeled", "skip news", "2"),
+        deliver("labeled", "skip issue", "3"),
+    )
+    await main.handled()
+    # One token for the whole burst.
+    tokens = [r for r in fake.requests if r[1].endswith("/access_tokens")]
+    assert len(tokens) == 1
+    statuses = {
+        status["context"]: status["state"]
+        for status in fake.statuses[pr["head"]["sha"]]
+    }
+    # Only the last change is handled: "skip news" was added and removed
+    # again, so the news status is left alone.
+    assert statuses == {"bedevere/issue-number": "success"}
+    assert len(fake.statuses[pr["head"]["sha"]]) == 1
+
+
+async def test_label_change_before_synchronize(
+    fake, aiohttp_client, private_key, monkeypatch
+):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.delenv("GH_SECRET", raising=False)
+    monkeypatch.setattr(ordering.LABEL_BURSTS, "window", 0.1)
+    pr = fake.add_pull_request(101, "Fix the bug", files=("Lib/bug.py",))
+    handled = []
+
+    async def handle(event, gh, session):
+        handled.append(event.data["action"])
+
+    monkeypatch.setattr(main, "handle", handle)
+    client = await aiohttp_client(main.create_app())
+
+    async def deliver(action, delivery_id, **data):
+        data.update(
+            action=action,
+            number=101,
+            pull_request=pr,
+            repository={"full_name": "python/cpython"},
+            installation={"id": 123},
+        )
+        headers = {"x-github-event": "pull_request", "x-github-delivery": delivery_id}
+        response = await client.post("/", headers=headers, json=data)
+        assert response.status == 200
+
+    # Both are acknowledged while the label change waits for the labels to
+    # settle, but the synchronize delivery waits for it.
+    await deliver("labeled", "1", label={"name": "skip news"})
+    await deliver("synchronize", "2")
+    # A later label change doesn't join the earlier one's burst.
+    await deliver("labeled", "3", label={"name": "docs"})
+    await main.handled()
+    assert handled == ["labeled", "synchronize", "labeled"]
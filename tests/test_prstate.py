@@ -0,0 +1,179 @@
+from gidgethub import sansio
+
+from bedevere import mutations, prstate, util
+
+ISSUE_URL = "https://api.github.com/repos/python/cpython/issues/7"
+PR_URL = "https://api.github.com/repos/python/cpython/pulls/7"
+
+
+def pull_request(updated_at="2024-01-01T00:00:00Z", labels=("docs",), **kwargs):
+    data = {
+        "url": PR_URL,
+        "issue_url": ISSUE_URL,
+        "state": "open",
+        "draft": False,
+        "user": {"login": "miss-islington"},
+        "author_association": "CONTRIBUTOR",
+        "head": {"sha": "f" * 40},
+        "labels": [{"name": name} for name in labels],
+        "requested_reviewers": [{"login": "brettcannon"}],
+        "updated_at": updated_at,
+    }
+    data.update(kwargs)
+    return data
+
+
+def issue(updated_at="2024-01-01T00:00:01Z", labels=("docs",), **kwargs):
+    data = {
+        "url": ISSUE_URL,
+        "state": "open",
+        "labels": [{"name": name} for name in labels],
+        "updated_at": updated_at,
+        "pull_request": {"url": PR_URL},
+    }
+    data.update(kwargs)
+    return data
+
+
+def event(**data):
+    return sansio.Event(data, event="pull_request", delivery_id="1")
+
+
+def test_update():
+    mirror = prstate.Mirror()
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    state = mirror.get(pull_request())
+    assert state.author == "miss-islington"
+    assert state.author_association == "CONTRIBUTOR"
+    assert not state.draft
+    assert state.head_sha == "f" * 40
+    assert state.labels == ("docs",)
+    assert state.requested_reviewers == ("brettcannon",)
+    assert len(mirror) == 1
+
+    pr_issue = state.issue()
+    assert pr_issue["number"] == 7
+    assert pr_issue["url"] == ISSUE_URL
+    assert pr_issue["user"]["login"] == "miss-islington"
+    assert util.labels(pr_issue) == {"docs"}
+    assert pr_issue["labels_url"] == f"{ISSUE_URL}/labels{{/name}}"
+    assert pr_issue["pull_request"]["url"] == PR_URL
+    # Issues are looked up by their own URL.
+    assert mirror.get(issue()) == state
+
+
+def test_update_out_of_order():
+    mirror = prstate.Mirror()
+    newer = pull_request("2024-01-02T00:00:00Z", labels=("awaiting review",))
+    mirror.update(event(action="labeled", pull_request=newer))
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    assert mirror.get(newer).labels == ("awaiting review",)
+
+
+def test_update_closed():
+    mirror = prstate.Mirror()
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    closed = pull_request("2024-01-02T00:00:00Z", state="closed")
+    mirror.update(event(action="closed", pull_request=closed))
+    assert mirror.get(closed) is None
+    assert not len(mirror)
+
+
+def test_update_ignored():
+    mirror = prstate.Mirror()
+    # Without updated_at, deliveries can't be ordered.
+    minimal = pull_request()
+    del minimal["updated_at"]
+    mirror.update(event(action="opened", pull_request=minimal))
+    # Issues which aren't pull requests, and pull requests not mirrored yet.
+    plain_issue = issue()
+    del plain_issue["pull_request"]
+    mirror.update(event(action="created", issue=plain_issue))
+    mirror.update(event(action="created", issue=issue()))
+    mirror.update(event(ref="main"))
+    assert not len(mirror)
+
+
+def test_update_from_issue():
+    mirror = prstate.Mirror()
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    labeled = issue(labels=("docs", "skip news"))
+    mirror.update(event(action="created", issue=labeled))
+    state = mirror.get(labeled)
+    assert state.labels == ("docs", "skip news")
+    assert state.updated_at == labeled["updated_at"]
+    # Older issue deliveries don't undo the labels.
+    mirror.update(event(action="created", issue=issue("2023-12-31T00:00:00Z")))
+    assert mirror.get(labeled).labels == ("docs", "skip news")
+    closed = issue("2024-01-02T00:00:00Z", state="closed")
+    mirror.update(event(action="closed", issue=closed))
+    assert mirror.get(closed) is None
+
+
+def test_get_stale():
+    mirror = prstate.Mirror(max_age=-1)
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    stale = prstate.STALE.get()
+    assert mirror.get(pull_request()) is None
+    assert prstate.STALE.get() == stale + 1
+    missed = prstate.MISS.get()
+    assert mirror.get({"labels": []}) is None
+    assert prstate.MISS.get() == missed + 1
+
+
+def test_labels():
+    mirror = prstate.Mirror()
+    mirror.update(event(action="labeled", pull_request=pull_request(labels=("a",))))
+    # The item's labels are as new as the mirror's.
+    assert mirror.labels(issue("2024-01-01T00:00:00Z", labels=("b",))) == ["b"]
+    # Items without updated_at are taken at their word.
+    search_result = issue(labels=("b",))
+    del search_result["updated_at"]
+    assert mirror.labels(search_result) == ["b"]
+    # Older items are overridden.
+    assert mirror.labels(issue("2023-12-31T00:00:00Z", labels=("b",))) == ["a"]
+
+
+def test_forget():
+    mirror = prstate.Mirror()
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    mirror.forget(ISSUE_URL)
+    mirror.forget(ISSUE_URL)
+    assert mirror.get(pull_request()) is None
+    mirror.update(event(action="opened", pull_request=pull_request()))
+    mirror.clear()
+    assert not len(mirror)
+
+
+async def test_issue_for_PR():
+    prstate.MIRROR.update(event(action="opened", pull_request=pull_request()))
+    hits = prstate.HIT.get()
+    # No requests are made.
+    pr_issue = await util.issue_for_PR(None, pull_request())
+    assert pr_issue["labels"] == [{"name": "docs"}]
+    assert prstate.HIT.get() == hits + 1
+    assert prstate.MIRRORED.labels().get() == 1
+
+
+class FakeGH:
+    def __init__(self):
+        self.writes = []
+
+    async def post(self, url, url_vars={}, *, data):
+        self.writes.append(("POST", url))
+
+    async def delete(self, url, url_vars={}):
+        self.writes.append(("DELETE", url))
+
+
+async def test_label_writes_forget():
+    prstate.MIRROR.update(event(action="opened", pull_request=pull_request()))
+    pr_issue = prstate.MIRROR.get(pull_request()).issue()
+    await mutations.Immediate(FakeGH()).add_labels(pr_issue, ["skip news"])
+    assert prstate.MIRROR.get(pull_request()) is None
+
+    prstate.MIRROR.update(event(action="opened", pull_request=pull_request()))
+    plan = mutations.Plan()
+    await plan.remove_label(pr_issue, "docs")
+    await plan.apply(FakeGH())
+    assert prstate.MIRROR.get(pull_request()) is None
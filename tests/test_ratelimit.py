@@ -0,0 +1,209 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from gidgethub import sansio
+
+from bedevere import client, metrics, ratelimit, tokens
+from benchmarks import fakegh
+
+Priority = ratelimit.Priority
+
+
+def headers(remaining, *, limit=5000, reset_in=60.0):
+    return {
+        "x-ratelimit-limit": str(limit),
+        "x-ratelimit-remaining": str(remaining),
+        "x-ratelimit-reset": str(time.time() + reset_in),
+    }
+
+
+@pytest.mark.parametrize(
+    "method,template,priority",
+    [
+        ("GET", "/repos/python/cpython/issues/{number}/comments", Priority.READ),
+        ("POST", "/repos/python/cpython/statuses/{sha}", Priority.STATUS),
+        ("POST", "/repos/python/cpython/issues/{number}/labels", Priority.LABEL),
+        ("DELETE", "/repos/python/cpython/issues/{number}/labels/x", Priority.LABEL),
+        ("POST", "/repos/python/cpython/labels", Priority.LABEL),
+        ("PATCH", "/repos/python/cpython/issues/{number}", Priority.BODY),
+        ("PATCH", "/repos/python/cpython/pulls/{number}", Priority.BODY),
+        ("POST", "/repos/python/cpython/issues/{number}/comments", Priority.COMMENT),
+    ],
+)
+def test_classify(method, template, priority):
+    assert ratelimit.classify(method, template, b'{"body": "gh-1"}') == priority
+
+
+def test_classify_closing():
+    template = "/repos/python/cpython/pulls/{number}"
+    assert ratelimit.classify("PATCH", template, b'{"state": "closed"}') == (
+        Priority.LABEL
+    )
+    assert ratelimit.classify("PATCH", template, b"") == Priority.LABEL
+
+
+COMMENT = "/repos/python/cpython/issues/{number}/comments"
+BODY = "/repos/python/cpython/issues/{number}"
+STATUS = "/repos/python/cpython/statuses/{sha}"
+
+
+def request(template, method="POST", body=b'{"body": "Hi"}', *, base_url=""):
+    url = base_url + template.format(number=42, sha="a" * 40)
+    return client.Request(method, url, {"authorization": "token old"}, body)
+
+
+def test_unknown_installation():
+    scheduler = ratelimit.Scheduler()
+    scheduler.acquire(1, COMMENT, request(COMMENT))
+
+
+def test_reserves():
+    scheduler = ratelimit.Scheduler(max_defer=0)
+    scheduler.update(1, {})  # No rate limit details.
+    scheduler.update(1, headers(400))
+    with pytest.raises(client.RequestDropped):
+        scheduler.acquire(1, COMMENT, request(COMMENT))
+    scheduler.acquire(1, BODY, request(BODY, "PATCH", b'{"body": ""}'))
+    scheduler.update(1, headers(0))
+    with pytest.raises(client.RequestDropped):
+        scheduler.acquire(1, STATUS, request(STATUS))
+    # Other installations have their own rate limit.
+    scheduler.acquire(2, COMMENT, request(COMMENT))
+    # The rate limit has been reset since it was last seen.
+    scheduler.update(1, headers(0, reset_in=-1))
+    scheduler.acquire(1, COMMENT, request(COMMENT))
+    assert not scheduler.deferred
+
+
+def test_reads_are_not_deferred():
+    scheduler = ratelimit.Scheduler()
+    scheduler.update(1, headers(400))
+    scheduler.acquire(1, COMMENT, request(COMMENT, "GET", b""))
+    scheduler.update(1, headers(0))
+    dropped = ratelimit.DROPPED.labels("read")
+    before = dropped.get()
+    # Nothing would be waiting for the response once the rate limit resets.
+    with pytest.raises(client.RequestDropped) as exc_info:
+        scheduler.acquire(1, COMMENT, request(COMMENT, "GET", b""))
+    assert not isinstance(exc_info.value, client.RequestDeferred)
+    assert dropped.get() == before + 1
+    assert not scheduler.deferred
+    assert not scheduler._flushes
+
+
+@pytest.fixture
+def fake(fake, monkeypatch):
+    fake.add_issue(42)
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+
+    async def installation_token(gh, installation_id):
+        return "ghs_new"
+
+    monkeypatch.setattr(tokens, "installation_token", installation_token)
+    return fake
+
+
+async def test_defer_until_reset(fake, capsys):
+    scheduler = ratelimit.Scheduler(max_deferred=2)
+    scheduler.update(1, headers(0, reset_in=0.05))
+    deferred = ratelimit.DEFERRED.labels("comment")
+    before = deferred.get()
+    comment = request(COMMENT, body=b'{"body": "Thanks!"}', base_url=fake.base_url)
+    for _ in range(2):
+        # The caller doesn't wait for the reset.
+        with pytest.raises(client.RequestDeferred):
+            scheduler.acquire(1, COMMENT, comment)
+    assert scheduler.deferred == 2
+    assert deferred.get() == before + 2
+    # Only so many requests may be queued at a time.
+    with pytest.raises(client.RequestDropped) as exc_info:
+        scheduler.acquire(1, COMMENT, comment)
+    assert not isinstance(exc_info.value, client.RequestDeferred)
+    assert not fake.comments
+    # The queued requests are made once the rate limit resets.
+    await asyncio.gather(*scheduler._flushes.values())
+    assert scheduler.deferred == 0
+    assert [comment["body"] for comment in fake.comments[42]] == ["Thanks!"] * 2
+    scheduler.acquire(1, COMMENT, comment)
+
+
+async def test_deferred_request_fails(fake, capsys):
+    scheduler = ratelimit.Scheduler()
+    scheduler.update(1, headers(0, reset_in=0.01))
+    missing = fake.base_url + COMMENT.format(number=43)
+    unreachable = "http://127.0.0.1:1/"
+    for url in (missing, unreachable):
+        with pytest.raises(client.RequestDeferred):
+            scheduler.acquire(
+                1, COMMENT, client.Request("POST", url, {}, b'{"body": "Hi"}')
+            )
+    await asyncio.gather(*scheduler._flushes.values())
+    err = capsys.readouterr().err
+    assert "Making 2 deferred requests for installation 1" in err
+    assert f"Deferred POST {missing} failed: HTTP 404" in err
+    assert f"Deferred POST {unreachable} failed: " in err
+
+
+async def test_deferred_request_dropped_again(fake, capsys):
+    scheduler = ratelimit.Scheduler()
+    scheduler.update(1, headers(0, reset_in=0.01))
+    comment = request(COMMENT, base_url=fake.base_url)
+    for _ in range(2):
+        with pytest.raises(client.RequestDeferred):
+            scheduler.acquire(1, COMMENT, comment)
+    # The first request uses up the rate limit again, for the next hour.
+    fake.remaining = 1
+    await asyncio.gather(*scheduler._flushes.values())
+    assert "dropped as the rate limit is too low" in capsys.readouterr().err
+    assert len(fake.comments[42]) == 1
+
+
+async def test_deferred_without_token(fake, monkeypatch, capsys):
+    async def installation_token(gh, installation_id):
+        raise RuntimeError("GitHub is down")
+
+    monkeypatch.setattr(tokens, "installation_token", installation_token)
+    scheduler = ratelimit.Scheduler()
+    scheduler.update(1, headers(0, reset_in=0.01))
+    with pytest.raises(client.RequestDeferred):
+        scheduler.acquire(1, COMMENT, request(COMMENT, base_url=fake.base_url))
+    await asyncio.gather(*scheduler._flushes.values())
+    assert "Dropping deferred requests" in capsys.readouterr().err
+    assert not fake.comments
+
+
+async def test_wait():
+    scheduler = ratelimit.Scheduler()
+    await scheduler.wait(1, 0.25)
+    scheduler.update(1, headers(2000))
+    await scheduler.wait(1, 0.25)
+    scheduler.update(1, headers(1000, reset_in=0.05))
+    start = time.perf_counter()
+    await scheduler.wait(1, 0.25)
+    assert time.perf_counter() - start >= 0.04
+    assert 1 not in scheduler._quotas
+
+
+async def test_client_uses_scheduler(aiohttp_server):
+    fake = fakegh.FakeGitHub(rate_limit=10)
+    server = await aiohttp_server(fake.app)
+    fake.base_url = str(server.make_url("")).rstrip("/")
+    fake.add_issue(42)
+    scheduler = ratelimit.Scheduler()
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(
+            session, "bedevere-test", base_url=fake.base_url, scheduler=scheduler
+        )
+        # Without an installation, requests aren't scheduled.
+        await gh.getitem("/repos/python/cpython/issues/42")
+        assert not scheduler._quotas
+        gh.installation_id = 1
+        await gh.getitem("/repos/python/cpython/issues/42")
+        assert scheduler._quotas[1][:2] == (10, 8)
+        fake.remaining = 1
+        await gh.getitem("/repos/python/cpython/issues/42")
+        with pytest.raises(client.RequestDropped):
+            await gh.post("/repos/python/cpython/issues/42/comments", data={})
+    assert not fake.comments
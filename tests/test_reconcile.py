@@ -0,0 +1,162 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from bedevere import __main__ as main
+from bedevere import gh_issue, reconcile, tokens
+
+from .test_catchup import app_env
+
+NEWS = "Misc/NEWS.d/next/Library/2024-01-01-00-00-00.gh-issue-100.abc123.rst"
+
+
+@pytest.fixture
+def repo(fake, app_env):
+    fake.core_devs = {"brettcannon"}
+    fake.add_issue(100, "A bug")
+    fake.add_pull_request(101, "gh-100: Fix the bug", files=("Lib/bug.py", NEWS))
+    fake.add_pull_request(
+        102,
+        "Fix a typo",
+        author="brettcannon",
+        author_association="NONE",
+        labels=("awaiting review",),
+        files=("Doc/index.rst",),
+    )
+    fake.add_pull_request(103, "gh-100: Draft", labels=("awaiting review",), draft=True)
+    fake.add_pull_request(
+        104,
+        "gh-100: Approved",
+        labels=("awaiting merge", "skip news"),
+        files=("Lib/bug.py",),
+    )
+    fake.add_review(104, "brettcannon", "APPROVED")
+    fake.add_pull_request(105, "gh-100: Fix the bug", base="3.12", files=(NEWS,))
+    return fake
+
+
+def latest_statuses(fake, number):
+    statuses = {}
+    for status in fake.statuses.get(fake.pulls[number]["head"]["sha"], []):
+        statuses[status["context"]] = status["state"]
+    return statuses
+
+
+async def test_reconcile(repo, capsys):
+    progress = await reconcile.reconcile(dry_run=True)
+    assert (progress.checked, progress.changed, progress.failed) == (5, 5, 0)
+    out = capsys.readouterr().out
+    assert "#103: remove label 'awaiting review'" in out
+    assert "#104: set bedevere/news to success" in out
+    # Nothing was changed.
+    assert not repo.statuses
+    assert repo.label_names(101) == []
+
+    progress = await reconcile.reconcile()
+    assert (progress.checked, progress.changed, progress.failed) == (5, 5, 0)
+    assert repo.label_names(101) == ["awaiting review"]
+    assert repo.label_names(102) == ["awaiting core review"]
+    assert repo.label_names(103) == []
+    assert repo.label_names(104) == ["awaiting merge", "skip news"]
+    assert latest_statuses(repo, 101) == {
+        "bedevere/news": "success",
+        "bedevere/issue-number": "success",
+    }
+    assert latest_statuses(repo, 102) == {
+        "bedevere/news": "failure",
+        "bedevere/issue-number": "failure",
+    }
+    assert latest_statuses(repo, 105)["bedevere/maintenance-branch-pr"] == "failure"
+    # Comments aren't left again.
+    assert not repo.comments
+
+    # Everything is up to date, and issues found before aren't looked up again.
+    gh_issue._found_issues.clear()
+    requests = len(repo.requests)
+    progress = await reconcile.reconcile()
+    assert (progress.checked, progress.changed, progress.failed) == (5, 0, 0)
+    paths = [path for _, path, _ in repo.requests[requests:]]
+    assert "/repos/python/cpython/issues/100" not in paths
+    # Reading happens a page at a time.
+    assert paths.count("/graphql") == 3
+
+
+async def test_checkpoint(repo, tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "reconcile.json")
+
+    async def interrupt(rate_limit, reserve):
+        raise KeyboardInterrupt
+
+    wait_for_graphql = reconcile._wait_for_graphql
+    monkeypatch.setattr(reconcile, "_wait_for_graphql", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        await reconcile.reconcile(checkpoint=checkpoint)
+    with open(checkpoint) as file:
+        saved = json.load(file)
+    assert saved == {"cursor": "2", "checked": 2, "changed": 2, "failed": 0}
+
+    monkeypatch.setattr(reconcile, "_wait_for_graphql", wait_for_graphql)
+    monkeypatch.setattr(tokens, "MARGIN", 2 * 60 * 60)
+    issued = len([r for r in repo.requests if r[1].endswith("/access_tokens")])
+    progress = await reconcile.reconcile(checkpoint=checkpoint)
+    assert (progress.checked, progress.changed) == (5, 5)
+    # Resumed from the checkpoint.
+    assert "awaiting review" in repo.label_names(101)
+    assert not (tmp_path / "reconcile.json").exists()
+    # The token was renewed for each page as it was close to expiring.
+    assert len([r for r in repo.requests if r[1].endswith("/access_tokens")]) == (
+        issued + 3
+    )
+
+
+async def test_failures(repo, monkeypatch, capsys):
+    async def check(gh, pull_request, *args, **kwargs):
+        if pull_request["number"] == 102:
+            raise RuntimeError("check broke")
+        await original_check(gh, pull_request, *args, **kwargs)
+
+    async def apply(self, gh):
+        raise RuntimeError("GitHub is down")
+
+    original_check = reconcile.check
+    monkeypatch.setattr(reconcile, "check", check)
+    monkeypatch.setattr(reconcile.Diff, "apply", apply)
+    progress = await reconcile.reconcile(concurrency=1)
+    assert (progress.checked, progress.changed, progress.failed) == (5, 4, 5)
+    err = capsys.readouterr().err
+    assert "#102: check failed: RuntimeError('check broke')" in err
+    assert "#101: changes failed: RuntimeError('GitHub is down')" in err
+    assert "Checked 5 pull requests: 4 changed, 5 failed" in err
+
+
+async def test_wait_for_graphql(monkeypatch):
+    reset_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 1))
+    await reconcile._wait_for_graphql(
+        {"limit": 5000, "remaining": 5000, "resetAt": reset_at}, 0.25
+    )
+    await reconcile._wait_for_graphql(
+        {"limit": 5000, "remaining": 100, "resetAt": reset_at}, 0.25
+    )
+
+    # Waits until the reset, read as UTC.
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    reset_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 60))
+    await reconcile._wait_for_graphql(
+        {"limit": 5000, "remaining": 100, "resetAt": reset_at}, 0.25
+    )
+    assert waits == [pytest.approx(60, abs=2)]
+
+
+def test_parse_args():
+    args = main.parse_args(["reconcile", "--dry-run", "--checkpoint", "x.json"])
+    assert args.command == "reconcile"
+    assert args.dry_run
+    assert args.checkpoint == "x.json"
+    assert args.concurrency == reconcile.CONCURRENCY
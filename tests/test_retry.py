@@ -0,0 +1,175 @@
+import asyncio
+
+import aiohttp
+import gidgethub
+import pytest
+
+from bedevere import client, metrics, ratelimit, retry
+
+SECONDARY = "You have exceeded a secondary rate limit."
+
+
+@pytest.fixture
+async def gh(fake, monkeypatch):
+    fake.add_issue(42)
+    sleeps = []
+
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(
+            session,
+            "bedevere-test",
+            base_url=fake.base_url,
+            write_limiters=retry.WriteLimiters(),
+        )
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        gh.sleep = sleep
+        gh.sleeps = sleeps
+        gh.records = []
+        gh.observers.append(gh.records.append)
+        yield gh
+
+
+@pytest.mark.parametrize(
+    "status,headers,body,throttled",
+    [
+        (429, {}, b"", True),
+        (403, {"retry-after": "5"}, b"", True),
+        (403, {}, b'{"message": "You have exceeded a Secondary Rate Limit"}', True),
+        (403, {}, b'{"message": "Resource not accessible by integration"}', False),
+        (502, {}, b"", False),
+    ],
+)
+def test_is_throttled(status, headers, body, throttled):
+    assert retry.is_throttled(status, headers, body) == throttled
+
+
+def test_backoff(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    assert [retry.backoff(attempt) for attempt in range(7)] == [1, 2, 4, 8, 16, 30, 30]
+
+
+@pytest.mark.parametrize(
+    "method,template,attempt,status,headers,delay",
+    [
+        ("GET", "/orgs/python/teams", 0, 200, {}, None),
+        ("GET", "/orgs/python/teams", 0, 404, {}, None),
+        ("GET", "/orgs/python/teams", 1, 502, {}, 2),
+        ("GET", "/orgs/python/teams", retry.MAX_ATTEMPTS - 1, 502, {}, None),
+        ("POST", "/repos/python/cpython/issues/{number}/comments", 0, 502, {}, None),
+        ("POST", "/repos/python/cpython/issues/{number}/comments", 0, 429, {}, 61),
+        ("POST", "/repos/python/cpython/labels", 0, 403, {"retry-after": "9"}, 10),
+        ("POST", "/repos/python/cpython/labels", 0, 403, {"retry-after": "x"}, 61),
+        ("POST", "/repos/python/cpython/labels", 0, 403, {"retry-after": "600"}, None),
+    ],
+)
+def test_retry_delay(monkeypatch, method, template, attempt, status, headers, delay):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    assert retry.retry_delay(method, template, attempt, status, headers, b"") == delay
+
+
+async def test_retry_server_error(fake, gh):
+    fake.fail(502, times=2)
+    issue = await gh.getitem("/repos/python/cpython/issues/42")
+    assert issue["number"] == 42
+    assert len(gh.sleeps) == 2
+    assert [(record.status, record.attempt) for record in gh.records] == [
+        (502, 0),
+        (502, 1),
+        (200, 2),
+    ]
+
+
+async def test_give_up(fake, gh):
+    fake.fail(503, times=retry.MAX_ATTEMPTS)
+    with pytest.raises(gidgethub.GitHubBroken):
+        await gh.getitem("/repos/python/cpython/issues/42")
+    assert len(gh.records) == retry.MAX_ATTEMPTS
+
+
+async def test_retry_secondary_rate_limit(fake, gh):
+    gh.installation_id = 1
+    limiter = gh.write_limiters[1]
+    fake.fail(403, SECONDARY, retry_after=3)
+    await gh.post("/repos/python/cpython/issues/42/comments", data={"body": "Hi"})
+    assert fake.comments[42] == [{"body": "Hi"}]
+    assert 3 <= gh.sleeps[0] <= 4
+    # Halved by the throttling, then increased by the success.
+    assert limiter.limit == pytest.approx(retry.INITIAL_WRITE_CONCURRENCY / 2 + 0.5)
+    retries = metrics.GITHUB_RETRIES._children[()].get()
+    metrics.observe_request(gh.records[-1])
+    assert metrics.GITHUB_RETRIES._children[()].get() == retries + 1
+
+
+async def test_long_retry_is_deferred(fake, gh):
+    gh.installation_id = 1
+    gh.scheduler = ratelimit.Scheduler()
+    fake.fail(403, SECONDARY, retry_after=60)
+    # The delivery doesn't wait a minute for the retry.
+    with pytest.raises(client.RequestDeferred):
+        await gh.post("/repos/python/cpython/issues/42/comments", data={"body": "Hi"})
+    assert not gh.sleeps
+    (queued,) = gh.scheduler._queues[1]
+    assert queued.url.endswith("/repos/python/cpython/issues/42/comments")
+    for flush in gh.scheduler._flushes.values():
+        flush.cancel()
+
+
+async def test_long_retry_gives_up(fake, gh):
+    # Reads, and writes without a scheduler, can't be queued.
+    fake.fail(429, SECONDARY, retry_after=60)
+    with pytest.raises(gidgethub.GitHubException):
+        await gh.getitem("/repos/python/cpython/issues/42")
+    gh.installation_id = 1
+    fake.fail(429, SECONDARY, retry_after=60)
+    with pytest.raises(gidgethub.GitHubException):
+        await gh.post("/repos/python/cpython/issues/42/comments", data={"body": "Hi"})
+    assert not gh.sleeps
+    assert 42 not in fake.comments
+
+
+async def test_writes_without_installation_are_not_limited(fake, gh):
+    await gh.post("/repos/python/cpython/issues/42/comments", data={"body": "Hi"})
+    assert not gh.write_limiters._limiters
+
+
+async def test_failed_write_keeps_limit(fake, gh):
+    gh.installation_id = 1
+    with pytest.raises(gidgethub.BadRequest):
+        await gh.delete("/repos/python/cpython/issues/42/labels/missing")
+    assert gh.write_limiters[1].limit == retry.INITIAL_WRITE_CONCURRENCY
+
+
+def test_limiter_bounds():
+    limiter = retry.WriteLimiter(initial=2, maximum=3)
+    for _ in range(20):
+        limiter.succeeded()
+    assert limiter.limit == 3
+    for _ in range(5):
+        limiter.throttled()
+    assert limiter.limit == 1
+
+
+async def test_limiter_concurrency():
+    limiter = retry.WriteLimiter(initial=2)
+    running = []
+    peak = 0
+    release = asyncio.Event()
+
+    async def write():
+        nonlocal peak
+        async with limiter.slot():
+            running.append(1)
+            peak = max(peak, len(running))
+            await release.wait()
+            running.pop()
+
+    tasks = [asyncio.create_task(write()) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    assert limiter.in_flight == 2
+    release.set()
+    await asyncio.gather(*tasks)
+    assert peak == 2
+    assert limiter.in_flight == 0
@@ -0,0 +1,154 @@
+import aiohttp
+import pytest
+
+from bedevere import client, news, snapshot, stage, util
+
+
+@pytest.fixture
+async def gh(fake):
+    async with aiohttp.ClientSession() as session:
+        yield client.GitHubAPI(session, "bedevere-test", base_url=fake.base_url)
+
+
+@pytest.fixture
+def records(gh):
+    records = []
+    gh.observers.append(records.append)
+    return records
+
+
+def test_parse():
+    data = {
+        "repository": {
+            "pullRequest": {
+                "author": None,
+                "isDraft": True,
+                "headRefOid": "f" * 40,
+                "labels": {"nodes": [{"name": "docs"}]},
+                "latestOpinionatedReviews": {
+                    "nodes": [
+                        {"author": {"login": "brettcannon"}, "state": "APPROVED"},
+                        {"author": None, "state": "CHANGES_REQUESTED"},
+                    ]
+                },
+                "files": {
+                    "nodes": [{"path": "a.py", "additions": 2, "deletions": 1}],
+                    "pageInfo": {"hasNextPage": False},
+                },
+            }
+        }
+    }
+    url = "https://api.github.com/repos/python/cpython/pulls/7"
+    pr_snapshot = snapshot.parse(url, data)
+    assert pr_snapshot.author == "ghost"
+    assert pr_snapshot.draft
+    assert pr_snapshot.labels == ("docs",)
+    assert pr_snapshot.reviews == (
+        ("brettcannon", "approved"),
+        ("ghost", "changes_requested"),
+    )
+    assert pr_snapshot.files == [{"file_name": "a.py", "changes": 3}]
+
+    issue = pr_snapshot.issue()
+    issue_url = "https://api.github.com/repos/python/cpython/issues/7"
+    assert issue["number"] == 7
+    assert issue["url"] == issue_url
+    assert util.labels(issue) == {"docs"}
+    assert issue["comments_url"] == f"{issue_url}/comments"
+    assert issue["pull_request"]["url"] == url
+
+    data["repository"]["pullRequest"]["files"]["pageInfo"]["hasNextPage"] = True
+    assert snapshot.parse(url, data).files is None
+
+
+async def test_load(fake, gh, records):
+    pr = fake.add_pull_request(7, "gh-42: Fix", files=("a.py",), labels=("docs",))
+    fake.add_review(7, "brettcannon", "CHANGES_REQUESTED")
+    fake.add_review(7, "brettcannon", "COMMENTED")
+    fake.add_review(7, "brettcannon", "APPROVED")
+    fake.add_review(7, "miss-islington", "COMMENTED")
+    loader = snapshot.Loader(gh)
+
+    pr_snapshot = await loader.load(pr["url"])
+    assert pr_snapshot.author == "contributor"
+    assert pr_snapshot.head_sha == pr["head"]["sha"]
+    assert pr_snapshot.labels == ("docs",)
+    assert pr_snapshot.reviews == (("brettcannon", "approved"),)
+    assert await util.files_for_PR(gh, pr, loader) == [
+        {"file_name": "a.py", "changes": 1}
+    ]
+    issue = await util.issue_for_PR(gh, pr, loader)
+    assert issue["labels_url"] == f"{pr['issue_url']}/labels{{/name}}"
+    assert [record.url for record in records] == ["/graphql"]
+
+    # Statuses and comments don't change the pull request ...
+    await gh.post(issue["comments_url"], data={"body": "Hi!"})
+    assert await loader.load(pr["url"]) is pr_snapshot
+    # ... but labels do.
+    await gh.post(issue["labels_url"], data=["tests"])
+    pr_snapshot = await loader.load(pr["url"])
+    assert pr_snapshot.labels == ("docs", "tests")
+    assert [record.url for record in records].count("/graphql") == 2
+
+
+async def test_load_failure(fake, gh, records):
+    loader = snapshot.Loader(gh)
+    pr = fake.add_pull_request(7, "gh-42: Fix", files=("a.py",))
+    missing_url = pr["url"].replace("/7", "/8")
+    assert await loader.load(missing_url) is None
+    assert await loader.load(missing_url) is None
+    assert [record.url for record in records] == ["/graphql"]
+
+    # Not a pull request.
+    assert await loader.load(pr["issue_url"]) is None
+    assert len(records) == 1
+
+    # Falling back to the REST API.
+    pr["url"] = missing_url.replace("/8", "/7")
+    loader._snapshots[pr["url"]] = None
+    issue = await util.issue_for_PR(gh, pr, loader)
+    assert issue["number"] == 7
+    files = await util.files_for_PR(gh, pr, loader)
+    assert files == [{"file_name": "a.py", "patch": "@@ -1 +1 @@"}]
+
+
+async def test_add(fake, gh, records):
+    pr = fake.add_pull_request(7, "gh-42: Fix", files=("a.py",))
+    loader = snapshot.Loader(gh)
+    pr_snapshot = snapshot.Snapshot(pr["url"], "contributor", False, "abc", (), (), [])
+    loader.add(pr_snapshot)
+    assert await loader.load(pr["url"]) is pr_snapshot
+    assert not records
+
+
+async def test_too_many_files(fake, gh):
+    files = tuple(f"Lib/test_{n}.py" for n in range(101))
+    pr = fake.add_pull_request(7, "gh-42: Fix", files=files)
+    loader = snapshot.Loader(gh)
+    assert (await loader.load(pr["url"])).files is None
+    assert len(await util.files_for_PR(gh, pr, loader)) == 101
+
+
+async def test_stage_reviews(fake, gh, records):
+    pr = fake.add_pull_request(7, "gh-42: Fix")
+    fake.add_review(7, "contributor2", "APPROVED")
+    loader = snapshot.Loader(gh)
+    reviewers = [reviewer async for reviewer in stage.reviewers(gh, pr["url"], loader)]
+    assert reviewers == ["contributor2"]
+    assert [record.url for record in records] == ["/graphql"]
+
+    loader._snapshots[pr["url"]] = None
+    reviewers = [reviewer async for reviewer in stage.reviewers(gh, pr["url"], loader)]
+    assert reviewers == ["contributor2"]
+    assert records[-1].url == "/repos/python/cpython/pulls/{number}/reviews"
+
+
+async def test_news_with_snapshot(fake, gh):
+    pr = fake.add_pull_request(
+        7,
+        "gh-42: Fix",
+        files=("Misc/NEWS.d/next/Library/2017-05-20.gh-issue-42.abc.rst",),
+    )
+    await news.check_news(gh, pr, snapshots=snapshot.Loader(gh))
+    [status] = fake.statuses[pr["head"]["sha"]]
+    assert status["state"] == "success"
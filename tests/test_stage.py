@@ -46,6 +46,9 @@ class FakeGH:
         patch_url = sansio.format_url(url, url_vars)
         self.patch_.append((patch_url, data))
 
+    def with_session(self, session):
+        return self
+
 
 async def test_stage():
     # Skip changing labels if the label is already set.
@@ -88,7 +91,7 @@ async def test_opened_draft_pr():
         },
     }
     event = sansio.Event(data, event="pull_request", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": "OK",
         issue_url: {"labels": [], "labels_url": "https://api.github.com/labels"},
@@ -161,7 +164,7 @@ async def test_edited_pr_title():
         },
     }
     event = sansio.Event(data, event="pull_request", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     encoded_label = "awaiting%20review"
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
@@ -203,7 +206,7 @@ async def test_opened_pr():
         },
     }
     event = sansio.Event(data, event="pull_request", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": "OK",
         issue_url: {"labels": [], "labels_url": "https://api.github.com/labels"},
@@ -231,7 +234,7 @@ async def test_opened_pr():
         },
     }
     event = sansio.Event(data, event="pull_request", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -266,7 +269,7 @@ async def test_new_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -364,7 +367,7 @@ async def test_new_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": True,
         "https://api.github.com/issue/42": {
@@ -400,7 +403,7 @@ async def test_new_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": True,
         "https://api.github.com/issue/42": {
@@ -520,7 +523,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -559,7 +562,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -595,7 +598,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -633,7 +636,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": True,
         f"https://api.github.com/teams/6/memberships/notbrettcannon": gidgethub.BadRequest(
@@ -672,7 +675,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": True,
         f"https://api.github.com/teams/6/memberships/notbrettcannon": gidgethub.BadRequest(
@@ -711,7 +714,7 @@ async def test_dismissed_review():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": True,
         f"https://api.github.com/teams/6/memberships/brettcannonalias": True,
@@ -734,7 +737,7 @@ async def test_dismissed_review():
 async def test_non_core_dev_does_not_downgrade():
     core_dev = "brettcannon"
     non_core_dev = "andreamcinnes"
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{non_core_dev}": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -857,7 +860,9 @@ async def test_new_comment():
         ),
     }
     iterators = {
-        "https://api.github.com/orgs/python/teams": [{"name": "python core", "id": 6}],
+        "https://api.github.com/orgs/python/teams": [
+            {"name": "python core", "id": 6, "slug": "python-core"}
+        ],
         "https://api.github.com/pr/42/reviews": [
             {"user": {"login": "brettcannon"}, "state": "approved"},
             {"user": {"login": "gvanrossum"}, "state": "changes_requested"},
@@ -933,7 +938,7 @@ async def test_change_requested_for_core_dev():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/gvanrossum": True,
         "https://api.github.com/teams/6/memberships/brettcannon": True,
@@ -981,7 +986,7 @@ async def test_change_requested_for_non_core_dev():
         },
     }
     event = sansio.Event(data, event="pull_request_review", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/gvanrossum": True,
         "https://api.github.com/teams/6/memberships/miss-islington": gidgethub.BadRequest(
@@ -1109,7 +1114,7 @@ async def test_new_commit_pushed_to_approved_pr(issue_url_key, repo_full_name):
         "repository": {"full_name": repo_full_name},
     }
     event = sansio.Event(data, event="push", delivery_id="12345")
-    teams = [{"name": "python core", "id": 6}]
+    teams = [{"name": "python core", "id": 6, "slug": "python-core"}]
     items = {
         f"https://api.github.com/teams/6/memberships/{username}": "OK",
         f"https://api.github.com/search/issues?q=type:pr+repo:{repo_full_name}+sha:{sha}": {
@@ -1225,3 +1230,41 @@ async def test_pushed_without_commits():
 
     # no posts
     assert len(gh.post_) == 0
+
+
+@pytest.mark.parametrize(
+    "author,reviews,expected",
+    [
+        ("contributor", [], [awaiting.Blocker.review]),
+        ("brett", [], [awaiting.Blocker.core_review]),
+        ("contributor", [("contributor2", "commented")], [awaiting.Blocker.review]),
+        (
+            "contributor",
+            [("contributor2", "approved")],
+            [awaiting.Blocker.core_review],
+        ),
+        (
+            "contributor",
+            [("contributor2", "changes_requested"), ("brett", "approved")],
+            [awaiting.Blocker.merge, awaiting.Blocker.core_review],
+        ),
+        (
+            "contributor",
+            [("brett", "changes_requested")],
+            [awaiting.Blocker.changes, awaiting.Blocker.change_review],
+        ),
+        (
+            "contributor",
+            [("brett", "changes_requested"), ("mariatta", "approved")],
+            [
+                awaiting.Blocker.changes,
+                awaiting.Blocker.change_review,
+                awaiting.Blocker.merge,
+                awaiting.Blocker.core_review,
+            ],
+        ),
+    ],
+)
+def test_expected_blockers(author, reviews, expected):
+    core_devs = {"brett", "mariatta"}
+    assert awaiting.expected_blockers(author, reviews, core_devs) == expected
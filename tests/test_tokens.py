@@ -0,0 +1,30 @@
+import time
+
+import aiohttp
+
+from bedevere import client, tokens
+
+from .test_catchup import app_env
+
+
+def token_requests(fake):
+    return [r for r in fake.requests if r[1].endswith("/access_tokens")]
+
+
+async def test_installation_token(fake, app_env, monkeypatch):
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(session, "bedevere-test", base_url=fake.base_url)
+        token = await tokens.installation_token(gh, 123)
+        assert token == fake.token("123")
+        hits = tokens.HIT.get()
+        assert await tokens.installation_token(gh, 123) == token
+        assert tokens.HIT.get() == hits + 1
+        assert len(token_requests(fake)) == 1
+
+        # Tokens about to expire aren't handed out.
+        expires_at = tokens.TOKENS[123]["expires_at"]
+        # Read as UTC.
+        assert expires_at == int(fake.reset)
+        monkeypatch.setattr(time, "time", lambda: expires_at - tokens.MARGIN + 1)
+        await tokens.installation_token(gh, 123)
+        assert len(token_requests(fake)) == 2
@@ -0,0 +1,112 @@
+import pytest
+import sentry_sdk
+from gidgethub import sansio
+from sentry_sdk.tracing import NoOpSpan
+
+from bedevere import __main__ as main
+from bedevere import bpo, gh_issue, tracing
+
+from .test_gh_issue import FakeGH, FakeSession
+
+
+@pytest.fixture
+def transactions():
+    """Trace everything, collecting the finished transactions."""
+    transactions = []
+
+    def collect(event, hint):
+        transactions.append(event)
+        return None
+
+    sentry_sdk.init(traces_sample_rate=1.0, before_send_transaction=collect)
+    yield transactions
+    sentry_sdk.init()
+
+
+def spans(transaction):
+    return {(span["op"], span["description"]): span for span in transaction["spans"]}
+
+
+def test_sample_rate(monkeypatch):
+    monkeypatch.delenv("SENTRY_TRACES_SAMPLE_RATE", raising=False)
+    assert tracing.sample_rate() is None
+    monkeypatch.setenv("SENTRY_TRACES_SAMPLE_RATE", "0.05")
+    assert tracing.sample_rate() == 0.05
+
+
+def test_span_outside_transaction(transactions):
+    assert isinstance(tracing.span("handler", "stage.new_review"), NoOpSpan)
+
+
+def test_span_not_sampled():
+    with sentry_sdk.start_transaction(name="unsampled", sampled=False):
+        assert isinstance(tracing.span("handler", "stage.new_review"), NoOpSpan)
+
+
+async def test_delivery_transaction(transactions):
+    event = sansio.Event({"action": "opened"}, event="pull_request", delivery_id="9")
+    with tracing.delivery(event):
+        with tracing.span("handler", "stage.opened_pr"):
+            pass
+    (transaction,) = transactions
+    assert transaction["transaction"] == "pull_request.opened"
+    assert transaction["tags"] == {
+        "github.event": "pull_request",
+        "github.delivery": "9",
+    }
+    assert ("handler", "stage.opened_pr") in spans(transaction)
+
+
+async def test_delivery_through_app(
+    transactions, fake, aiohttp_client, private_key, monkeypatch
+):
+    monkeypatch.setenv("GH_BASE_URL", fake.base_url)
+    monkeypatch.setenv("GH_APP_ID", "1")
+    monkeypatch.setenv("GH_PRIVATE_KEY", private_key)
+    monkeypatch.delenv("GH_SECRET", raising=False)
+    monkeypatch.setattr(main, "CONSISTENCY_DELAY", 0)
+    fake.add_issue(100, "A bug")
+    pr = fake.add_pull_request(101, "gh-100: Fix the bug")
+    client = await aiohttp_client(main.create_app())
+    headers = {"x-github-event": "pull_request", "x-github-delivery": "1"}
+    data = {
+        "action": "labeled",
+        "label": {"name": "skip news"},
+        "number": 101,
+        "pull_request": pr,
+        "repository": {"full_name": "python/cpython"},
+        "installation": {"id": 123},
+    }
+    response = await client.post("/", headers=headers, json=data)
+    assert response.status == 200
+    await main.handled()
+
+    # The fake GitHub API's requests are traced too.
+    by_name = {transaction["transaction"]: transaction for transaction in transactions}
+    transaction = by_name["pull_request.labeled"]
+    assert transaction["contexts"]["trace"]["op"] == "webhook"
+    # Handled after the request Sentry's aiohttp integration traced, as part
+    # of the same trace.
+    by_span = {other["contexts"]["trace"]["span_id"]: other for other in transactions}
+    request = by_span[transaction["contexts"]["trace"]["parent_span_id"]]
+    assert request["contexts"]["trace"]["op"] == "http.server"
+    trace_id = request["contexts"]["trace"]["trace_id"]
+    assert transaction["contexts"]["trace"]["trace_id"] == trace_id
+    found = spans(transaction)
+    assert ("handler", "news.label_added") in found
+    span = found[("http.client", "POST /repos/python/cpython/statuses/{sha}")]
+    assert span["tags"]["cache"] == "uncached"
+    assert span["data"]["url.template"] == "/repos/python/cpython/statuses/{sha}"
+
+
+async def test_bpo_head_span(transactions, monkeypatch):
+    monkeypatch.setattr(bpo, "INDEX", bpo.BPOIndex("/nonexistent"))
+    with sentry_sdk.start_transaction(name="bpo"):
+        await gh_issue._validate_issue_number(
+            FakeGH(), 123, kind="bpo", session=FakeSession(200)
+        )
+    (transaction,) = transactions
+    span = spans(transaction)[
+        ("http.client", "HEAD https://bugs.python.org/issue{issue_number}")
+    ]
+    assert span["data"]["http.response.status_code"] == 200
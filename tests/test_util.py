@@ -1,10 +1,12 @@
 import http
+import re
 from unittest.mock import patch
 
+import aiohttp
 import gidgethub
 import pytest
 
-from bedevere import util
+from bedevere import client, util
 
 from .test_stage import FakeGH
 
@@ -66,7 +68,7 @@ async def test_is_core_dev():
     with pytest.raises(ValueError):
         await util.is_core_dev(gh, "brett")
 
-    teams = [{"name": "Python core", "id": 42}]
+    teams = [{"name": "Python core", "id": 42, "slug": "python-core"}]
     getitem = {"https://api.github.com/teams/42/memberships/brett": True}
     gh = FakeGH(
         getiter={"https://api.github.com/orgs/python/teams": teams}, getitem=getitem
@@ -74,7 +76,7 @@ async def test_is_core_dev():
     assert await util.is_core_dev(gh, "brett")
     assert gh.getiter_url == "https://api.github.com/orgs/python/teams"
 
-    teams = [{"name": "Python core", "id": 42}]
+    teams = [{"name": "Python core", "id": 42, "slug": "python-core"}]
     getitem = {
         "https://api.github.com/teams/42/memberships/andrea": gidgethub.BadRequest(
             status_code=http.HTTPStatus(404)
@@ -85,7 +87,7 @@ async def test_is_core_dev():
     )
     assert not await util.is_core_dev(gh, "andrea")
 
-    teams = [{"name": "Python core", "id": 42}]
+    teams = [{"name": "Python core", "id": 42, "slug": "python-core"}]
     getitem = {
         "https://api.github.com/teams/42/memberships/andrea": gidgethub.BadRequest(
             status_code=http.HTTPStatus(400)
@@ -109,6 +111,35 @@ async def test_is_core_dev_resource_not_accessible():
     assert await util.is_core_dev(gh, "mariatta") is False
 
 
+async def test_core_devs():
+    teams = [{"name": "Python core", "id": 42, "slug": "python-core"}]
+    members = [{"login": "brett"}, {"login": "mariatta"}]
+    gh = FakeGH(
+        getiter={
+            "https://api.github.com/orgs/python/teams": teams,
+            "https://api.github.com/orgs/python/teams/python-core/members?per_page=100": members,
+        }
+    )
+    assert await util.core_devs(gh) == {"brett", "mariatta"}
+    # The roster is kept, and answers is_core_dev().
+    gh = FakeGH()
+    assert await util.core_devs(gh) == {"brett", "mariatta"}
+    assert await util.is_core_dev(gh, "brett")
+    assert not await util.is_core_dev(gh, "andrea")
+
+
+async def test_is_core_dev_cached():
+    teams = [{"name": "Python core", "id": 42, "slug": "python-core"}]
+    getitem = {"https://api.github.com/teams/42/memberships/brett": True}
+    gh = FakeGH(
+        getiter={"https://api.github.com/orgs/python/teams": teams}, getitem=getitem
+    )
+    assert await util.is_core_dev(gh, "brett")
+    gh = FakeGH()
+    assert await util.is_core_dev(gh, "brett")
+    assert gh.getitem_url is None
+
+
 def test_title_normalization():
     title = "abcd"
     body = "1234"
@@ -321,3 +352,145 @@ async def test_patch_body_adds_pr_to_legacy_issue_body():
         }
         mock.assert_called_once_with("https://fake.com", data=data)
     assert await gh.patch(vals["url"], data=vals) == None
+
+
+def test_build_issue_body_multiple_prs():
+    body = util.build_issue_body([1, 2], "Some issue")
+    assert body == (
+        "Some issue\n\n<!-- gh-linked-prs -->\n"
+        "### Linked PRs\n* gh-1\n* gh-2\n"
+        "<!-- /gh-linked-prs -->\n"
+    )
+    assert util.build_issue_body([3, 4], body) == (
+        "Some issue\n\n<!-- gh-linked-prs -->\n"
+        "### Linked PRs\n* gh-1\n* gh-2\n* gh-3\n* gh-4\n"
+        "<!-- /gh-linked-prs -->\n"
+    )
+    legacy = "<!-- gh-pr-number: gh-1 -->\n* PR: gh-1\n<!-- /gh-pr-number -->\n"
+    assert util.build_issue_body([2, 3], legacy) == (
+        legacy + "\n\n<!-- gh-pr-number: gh-2 -->\n* PR: gh-2\n<!-- /gh-pr-number -->\n"
+        "\n\n<!-- gh-pr-number: gh-3 -->\n* PR: gh-3\n<!-- /gh-pr-number -->\n"
+    )
+
+
+async def test_link_pr_to_issue_coalesces_updates(monkeypatch):
+    monkeypatch.setattr(util, "ISSUE_LINK_WINDOW", 0.01)
+    issue_url = "https://api.github.com/repos/python/cpython/issues/42"
+    issue = {"url": issue_url, "body": "An issue\n"}
+    gh = FakeGH(getitem={issue_url: issue})
+    util.link_pr_to_issue(gh, issue_url, 103)
+    util.link_pr_to_issue(gh, issue_url, 101)
+    util.link_pr_to_issue(gh, issue_url, 102)
+    # The callers don't wait for the window to pass.
+    assert gh.getitem_url is None
+    assert util._issue_link_batches
+    await util.issue_links_written()
+    assert gh.getitem_url == issue_url
+    assert gh.patch_ == [
+        (
+            issue_url,
+            {
+                "body": (
+                    "An issue\n\n\n<!-- gh-linked-prs -->\n"
+                    "### Linked PRs\n* gh-101\n* gh-102\n* gh-103\n"
+                    "<!-- /gh-linked-prs -->\n"
+                )
+            },
+        )
+    ]
+    assert not util._issue_link_batches
+
+
+async def test_link_pr_to_issue_fetches_issue():
+    issue_url = "https://api.github.com/repos/python/cpython/issues/42"
+    issue = {"url": issue_url, "body": "Fixed by gh-101"}
+    gh = FakeGH(getitem={issue_url: issue})
+    util.link_pr_to_issue(gh, issue_url, 101)
+    await util.issue_links_written()
+    assert gh.getitem_url == issue_url
+    assert not gh.patch_
+
+
+async def test_link_pr_to_issue_reuses_issue():
+    issue_url = "https://api.github.com/repos/python/cpython/issues/42"
+    issue = {"url": issue_url, "body": None}
+    gh = FakeGH()
+    util.link_pr_to_issue(gh, issue_url, 101, issue=issue)
+    await util.issue_links_written()
+    assert gh.getitem_url is None
+    assert "* gh-101\n" in gh.patch_[0][1]["body"]
+
+    # Since then, someone removed the link again. A copy fetched before the
+    # update isn't used, and the link removed isn't added back.
+    edited = {"url": issue_url, "body": "Edited"}
+    gh = FakeGH(getitem={issue_url: edited})
+    util.link_pr_to_issue(gh, issue_url, 102, issue=issue)
+    await util.issue_links_written()
+    assert gh.getitem_url == issue_url
+    assert gh.patch_ == [
+        (
+            issue_url,
+            {
+                "body": (
+                    "Edited\n\n<!-- gh-linked-prs -->\n"
+                    "### Linked PRs\n* gh-102\n"
+                    "<!-- /gh-linked-prs -->\n"
+                )
+            },
+        )
+    ]
+
+
+async def test_link_pr_to_issue_failed(capsys):
+    issue_url = "https://api.github.com/repos/python/cpython/issues/42"
+    error = gidgethub.BadRequest(status_code=http.HTTPStatus(404))
+    gh = FakeGH(getitem={issue_url: error})
+    util.link_pr_to_issue(gh, issue_url, 102)
+    util.link_pr_to_issue(gh, issue_url, 101)
+    await util.issue_links_written()
+    assert f"Linking [101, 102] to {issue_url} failed" in capsys.readouterr().err
+    assert not gh.patch_
+    assert not util._issue_link_batches
+
+
+async def test_link_pr_to_issue_outlives_session(fake):
+    fake.add_issue(42, body="An issue")
+    issue_url = "/repos/python/cpython/issues/42"
+    records = []
+    async with aiohttp.ClientSession() as session:
+        gh = client.GitHubAPI(session, "bedevere-test", base_url=fake.base_url)
+        gh.observers.append(records.append)
+        util.link_pr_to_issue(gh, issue_url, 101)
+    # The delivery's session is closed by the time the batch is written.
+    await util.issue_links_written()
+    assert "* gh-101\n" in fake.issues[42]["body"]
+    assert [record.method for record in records] == ["GET", "PATCH"]
+
+
+def test_scan_body():
+    body = (
+        "#1 fixes GH-2, gh-3 and (#4) but not #5 (see bpo-6, xgh-7, gh-8a).\n"
+        "#9\n"
+        "<!-- gh-linked-prs -->\n### Linked PRs\n* gh-10\n<!-- /gh-linked-prs -->\n"
+    )
+    scan = util.scan_body(body)
+    assert scan.references == frozenset({"1", "2", "3", "10"})
+    # Same results as searching for each number separately.
+    for number in range(1, 11):
+        pattern = rf"(^|\b)(GH-|gh-|#){number}\b"
+        assert (str(number) in scan.references) == bool(re.search(pattern, body))
+    assert body[scan.tasklist_end :] == "<!-- /gh-linked-prs -->\n"
+    assert not scan.legacy
+    assert util.scan_body(body) is scan
+
+    assert util.scan_body("").tasklist_end is None
+    assert util.scan_body("<!-- gh-linked-prs -->").tasklist_end is None
+    assert util.scan_body("<!-- /gh-linked-prs -->").tasklist_end is None
+    assert util.scan_body("<!-- /gh-pr-number -->").legacy
+
+
+def test_mentions():
+    assert util._mentions("#1234 in some prose", 1234)
+    assert util._mentions("see GH-1234.", 1234)
+    assert not util._mentions("see gh-12345", 1234)
+    assert not util._mentions("see gh-01234", 1234)
@@ -0,0 +1,93 @@
+import asyncio
+import gzip
+import os
+import stat
+
+from bedevere import __main__ as main
+from bedevere import caches, tokens, util, warmstart
+
+from .test_catchup import app_env
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "caches.json.gz")
+    cache = caches.Cache("test", maxsize=10, ttl=60)
+    cache[("gh", 1)] = True
+    cache["etag"] = ["W/1", None, {}, None]
+    warmstart.save(path, {"test": cache})
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert os.listdir(tmp_path) == ["caches.json.gz"]
+
+    loaded = caches.Cache("test", maxsize=10, ttl=60)
+    entries = warmstart.LOADED.labels("test").get()
+    assert warmstart.load(path, {"test": loaded, "other": cache}) == 2
+    assert loaded[("gh", 1)]
+    assert warmstart.LOADED.labels("test").get() == entries + 2
+    # Caches which are gone are ignored.
+    assert warmstart.load(path, {}) == 0
+
+
+def test_load_missing_or_corrupt(tmp_path, capsys):
+    path = tmp_path / "caches.json.gz"
+    assert warmstart.load(str(path)) == 0
+    path.write_bytes(b"not gzipped")
+    assert warmstart.load(str(path)) == 0
+    assert "Not loading caches" in capsys.readouterr().err
+    path.write_bytes(gzip.compress(b"{"))
+    assert warmstart.load(str(path)) == 0
+
+
+async def test_warm_up(fake, app_env):
+    fake.core_devs = {"brettcannon"}
+    await warmstart.warm_up()
+    assert tokens.TOKENS[fake.installation_id]["token"] == fake.token(123)
+    requests = len(fake.requests)
+    # Known from the roster, without asking GitHub.
+    assert await util.is_core_dev(None, "brettcannon")
+    assert not await util.is_core_dev(None, "miss-islington")
+    assert len(fake.requests) == requests
+
+
+async def test_warm_up_elsewhere(fake, app_env):
+    # The core developers can only be listed by the installation on python.
+    fake.installation_account = "someone-else"
+    await warmstart.warm_up()
+    assert fake.installation_id in tokens.TOKENS
+    assert "roster" not in util._core_devs
+
+
+async def test_warm_start(fake, app_env, aiohttp_client, monkeypatch, tmp_path):
+    path = str(tmp_path / "caches.json.gz")
+    monkeypatch.setenv("WARM_START_PATH", path)
+    fake.core_devs = {"brettcannon"}
+    client = await aiohttp_client(main.create_app())
+
+    async def warmed_up():
+        while "roster" not in util._core_devs:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(warmed_up(), timeout=5)
+    await client.close()
+    assert os.path.exists(path)
+
+    tokens.TOKENS.clear()
+    util._core_devs.clear()
+    requests = len(fake.requests)
+    client = await aiohttp_client(main.create_app())
+    assert tokens.TOKENS[fake.installation_id]["token"] == fake.token(123)
+    assert await util.core_devs(None) == {"brettcannon"}
+
+    async def listed():
+        while len(fake.requests) == requests:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(listed(), timeout=5)
+    await client.close()
+    # Only the installations were listed again.
+    assert [path for _, path, _ in fake.requests[requests:]] == ["/app/installations"]
+
+
+async def test_warm_up_failure(fake, app_env, monkeypatch, capsys):
+    fake.fail(500, times=10)
+    await main.warm_up()
+    assert "Traceback" in capsys.readouterr().err
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+from benchmarks import webhooks
+from benchmarks.fakegh import FakeGitHub
+
+
+async def test_run_every_event():
+    results = await webhooks.run(deliveries=18, concurrency=4, seed=1)
+    assert results["statuses"] == {"200": 18}
+    assert results["config"]["deliveries"] == 18
+    assert results["throughput"] > 0
+    assert set(results["latency_ms"]) == {"mean", "p50", "p90", "p99", "max"}
+    assert set(results["events"]) <= set(webhooks.EVENT_WEIGHTS)
+    total = sum(details["count"] for details in results["events"].values())
+    assert total == 18
+    # Every delivery needs at least an installation token.
+    assert results["github_calls"] >= 18
+    json.dumps(results)
+
+
+@pytest.mark.parametrize("kind", list(webhooks.EVENT_WEIGHTS))
+async def test_each_event_is_handled(kind):
+    results = await webhooks.run(deliveries=1, rate=100, weights={kind: 1})
+    assert results["statuses"] == {"200": 1}
+    # Beyond the installation token, every event makes GitHub API calls.
+    assert results["events"][kind]["github_calls_per_event"] > 1
+
+
+def test_delivery_is_signed():
+    fake = FakeGitHub()
+    factory = webhooks.DeliveryFactory(fake, secret="secret")
+    headers, body = factory.delivery("pull_request.opened", 7)
+    assert headers["x-github-event"] == "pull_request"
+    assert headers["x-github-delivery"] == "7"
+    assert headers["x-hub-signature-256"].startswith("sha256=")
+    data = json.loads(body)
+    assert data["action"] == "opened"
+    assert data["installation"] == {"id": 7}
+    assert data["pull_request"]["number"] in fake.pulls
+
+
+def test_unknown_event():
+    factory = webhooks.DeliveryFactory(FakeGitHub())
+    with pytest.raises(ValueError):
+        factory.payload("pull_request_review_comment.created")
+
+
+def test_percentiles():
+    assert webhooks.percentiles([]) == {}
+    summary = webhooks.percentiles([i / 1000 for i in range(1, 101)])
+    assert summary["p50"] == pytest.approx(50)
+    assert summary["p90"] == pytest.approx(90)
+    assert summary["p99"] == pytest.approx(99)
+    assert summary["max"] == pytest.approx(100)
+    assert summary["mean"] == pytest.approx(50.5)
+
+
+async def test_report():
+    results = await webhooks.run(deliveries=2, weights={"create": 1})
+    output = io.StringIO()
+    webhooks.report(results, file=output)
+    assert "2 deliveries" in output.getvalue()
+    assert "create" in output.getvalue()
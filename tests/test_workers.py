@@ -0,0 +1,170 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from bedevere import __main__ as main
+from bedevere import workers
+
+# The workers' code runs in forked processes, which coverage doesn't follow.
+
+
+def sleep(index):  # pragma: no cover
+    time.sleep(60)
+
+
+def ready_workers(run_worker, count, **kwargs):
+    """Start workers, returning once each has run its setup."""
+    read, write = os.pipe()
+
+    def setup_and_run(index):  # pragma: no cover
+        run_worker(index, lambda: os.write(write, b"."))
+
+    supervisor = workers.Supervisor(setup_and_run, count, **kwargs)
+    supervisor.start()
+    for _ in range(count):
+        os.read(read, 1)
+    os.close(read)
+    os.close(write)
+    return supervisor
+
+
+def test_stop():
+    supervisor = workers.Supervisor(sleep, 2)
+    supervisor.start()
+    assert sorted(supervisor.pids.values()) == [0, 1]
+    supervisor.stop()
+    supervisor.stop()
+    assert supervisor.wait() == 0
+    assert not supervisor.pids
+    # Stopped before all the workers were started.
+    supervisor.start()
+    assert not supervisor.pids
+
+
+def test_worker_exits(capsys):
+    def run_worker(index):  # pragma: no cover
+        if index == 1:
+            sys.exit(3)
+        sleep(index)
+
+    supervisor = workers.Supervisor(run_worker, 3)
+    supervisor.start()
+    # The other workers are stopped.
+    assert supervisor.wait() == 1
+    assert "Worker 1 exited (1), stopping" in capsys.readouterr().err
+
+
+def test_worker_fails_to_stop(capsys):
+    def run_worker(index, ready):  # pragma: no cover
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        ready()
+        if index:
+            sleep(index)
+
+    supervisor = ready_workers(run_worker, 2, grace=0.2)
+    supervisor.stop()
+    assert supervisor.wait() == 1
+    assert "Killing 1 workers" in capsys.readouterr().err
+
+
+def test_worker_fails_while_stopping():
+    def run_worker(index, ready):  # pragma: no cover
+        signal.signal(signal.SIGTERM, lambda *args: os._exit(2))
+        ready()
+        sleep(index)
+
+    supervisor = ready_workers(run_worker, 1)
+    supervisor.stop()
+    assert supervisor.wait() == 1
+
+
+def test_serve(monkeypatch):
+    def run_worker(create_app, port, directory, index):  # pragma: no cover
+        assert os.path.isdir(directory)
+        if index == 0:
+            os.kill(os.getppid(), signal.SIGTERM)
+        sleep(index)
+
+    monkeypatch.setattr(workers, "_run_worker", run_worker)
+    handler = signal.getsignal(signal.SIGTERM)
+    directories = os.listdir(workers.tempfile.gettempdir())
+    assert workers.serve(main.create_app, port=None, workers=2) == 0
+    # Everything was put back.
+    assert signal.getsignal(signal.SIGTERM) is handler
+    assert os.listdir(workers.tempfile.gettempdir()) == directories
+
+
+async def test_secondary_worker(aiohttp_client, tmp_path, monkeypatch):
+    path = tmp_path / "caches.json.gz"
+    monkeypatch.setenv("WARM_START_PATH", str(path))
+    client = await aiohttp_client(main.create_app(primary=False))
+    await client.close()
+    # Only the primary worker saves the caches.
+    assert not path.exists()
+
+
+def test_parse_args():
+    assert main.parse_args([]).workers == 1
+    assert main.parse_args(["--workers", "4"]).workers == 4
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def request(url, data=None, headers={}):
+    with urllib.request.urlopen(
+        urllib.request.Request(url, data=data, headers=headers), timeout=5
+    ) as response:
+        return response.read().decode()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="needs SO_REUSEPORT")
+def test_workers(tmp_path):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    env.pop("WARM_START_PATH", None)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bedevere", "--workers", "3"],
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    url = f"http://localhost:{port}"
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                request(f"{url}/metrics")
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "the workers didn't start"
+                time.sleep(0.1)
+        # Each on a new connection, so they're spread across the workers.
+        for delivery_id in range(12):
+            headers = {
+                "content-type": "application/json",
+                "x-github-event": "pull_request",
+                "x-github-delivery": f"worker-{delivery_id}",
+            }
+            try:
+                request(url, b'{"action": "opened"}', headers)
+            except urllib.error.HTTPError as exc:
+                assert exc.code == 400
+        line = 'bedevere_deliveries_total{event="pull_request",action="opened"} 12'
+        while line not in request(f"{url}/metrics").splitlines():
+            assert time.monotonic() < deadline + 10, "metrics weren't combined"
+            time.sleep(0.1)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        _, err = server.communicate(timeout=30)
+    assert server.returncode == 0, err
+    assert "Started 3 workers" in err